@@ -1,5 +1,6 @@
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
+import logging
 import os
 from config import get_config
 
@@ -12,16 +13,43 @@ except ImportError:
     cors_available = False
 
 from flask_jwt_extended import JWTManager
+from flask_migrate import Migrate
 
-# Initialize SQLAlchemy instance
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+# Initialize SQLAlchemy instance; the session routes reads to a replica when asked
+from app.services.replica import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Initialize JWT
 jwt = JWTManager()
 
-def create_app():
+# Schema migrations live in backend/migrations (`flask db ...`)
+migrate = Migrate()
+
+def create_app(config=None):
     app = Flask(__name__)
     app.config.from_object(get_config())
+    if config:
+        app.config.update(config)  # overrides, e.g. a throwaway database for checks
+
+    # Logging (level, JSON output, background queue) comes from config.py
+    from app.services.log_config import configure_logging
+    configure_logging(app)
+
+    # orjson-backed jsonify when available
+    from app.services.json_provider import init_json
+    init_json(app)
+
+    # Client address and scheme from X-Forwarded-* set by trusted proxies only
+    if app.config['TRUSTED_PROXIES']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        proxies = app.config['TRUSTED_PROXIES']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    # Stream multipart uploads to disk with content sniffing and hashing
+    from app.services.uploads import UploadRequest
+    app.request_class = UploadRequest
     
     # Настройка параметров JWT
     app.config['JWT_ERROR_MESSAGE_KEY'] = 'message'
@@ -29,37 +57,63 @@ def create_app():
     app.config['JWT_JSON_KEY'] = 'access_token'  # По умолчанию - 'access_token'
     
     # Initialize extensions
+    from app.services.database import MIGRATIONS_DIR, configure_engines, init_engines
+    configure_engines(app)
     db.init_app(app)
+    init_engines(app)
+    # Prometheus metrics (SQL timing hooks into the engines) and the opt-in profiler
+    from app.services.metrics import init_metrics
+    from app.services.profiler import init_profiler
+    init_metrics(app)
+    init_profiler(app)
     jwt.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
     
     # Установка обработчиков ошибок JWT
     @jwt.invalid_token_loader
     def invalid_token_callback(error_string):
-        import logging
-        logging.error(f"Invalid token error: {error_string}")
+        logger.info("Invalid token error: %s", error_string)
         return jsonify({"message": error_string}), 422
     
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
-        logging.error(f"Expired token: header={jwt_header}, payload={jwt_payload}")
+        logger.info("Expired token for identity %s", jwt_payload.get('sub'))
         return jsonify({"message": "Token has expired"}), 401
     
     @jwt.unauthorized_loader
     def unauthorized_loader_callback(error_string):
-        logging.error(f"Unauthorized: {error_string}")
+        logger.info("Unauthorized: %s", error_string)
         return jsonify({"message": "Missing or invalid Authorization header"}), 401
     
     @jwt.needs_fresh_token_loader
     def needs_fresh_token_callback(jwt_header, jwt_payload):
-        logging.error(f"Needs fresh token: header={jwt_header}, payload={jwt_payload}")
+        logger.info("Needs fresh token for identity %s", jwt_payload.get('sub'))
         return jsonify({"message": "Fresh token required"}), 401
     
     # Enable CORS if available
     if cors_available:
         cors = CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
-        print("CORS has been enabled with extended settings")
+        logger.debug("CORS has been enabled with extended settings")
     else:
-        print("WARNING: Running without CORS support")
+        logger.warning("Running without CORS support")
+
+    # Password hashing pool and login throttling
+    from app.services.passwords import init_passwords
+    from app.services.throttle import init_throttle
+    init_passwords(app)
+    init_throttle(app)
+
+    # Response cache for public endpoints
+    from app.services.cache import init_cache
+    init_cache(app)
+
+    # Server-Sent Events hub for the live feed
+    from app.services.live import init_live
+    init_live(app)
+
+    # Offline geocoding from the local gazetteer
+    from app.services.geocoding import init_geocoding
+    init_geocoding(app)
 
     # Ensure upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -67,11 +121,37 @@ def create_app():
     # Register blueprints
     from app.routes.auth import auth_bp
     from app.routes.pets import pets_bp
+    from app.routes.uploads import uploads_bp
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(pets_bp, url_prefix='/api/pets')
+    app.register_blueprint(uploads_bp)
+
+    # Register CLI commands
+    from app.cli import pets_cli, worker_command
+    app.cli.add_command(pets_cli)
+    app.cli.add_command(worker_command)
     
-    # Create database tables
+    # Apply pending migrations (production runs `flask db upgrade` on deploy)
     with app.app_context():
-        db.create_all()
+        from app.services.database import schema_is_current, upgrade_database
+        if app.config['DB_AUTO_MIGRATE']:
+            upgrade_database()
+        elif not schema_is_current():
+            # e.g. `flask db upgrade` itself: nothing to seed yet
+            logger.warning("Database schema is not up to date, run `flask db upgrade`")
+            return app
+
+        # Seed the map cluster aggregates for databases that predate them
+        from app.services.clusters import clusters_need_rebuild, rebuild_clusters
+        if clusters_need_rebuild():
+            rebuild_clusters()
+
+        # Set up the full-text search index
+        from app.services.search import init_search
+        init_search(app)
+
+        # Build the in-memory feed index
+        from app.services.feed_index import init_feed_index
+        init_feed_index(app)
     
     return app
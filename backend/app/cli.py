@@ -0,0 +1,205 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+# `flask pets ...` maintenance commands
+pets_cli = AppGroup('pets', help='Pet post maintenance commands.')
+
+
+@pets_cli.command('rebuild-clusters')
+def rebuild_clusters_command():
+    """Recompute the map cluster aggregates from pet_posts."""
+    from app.services.clusters import rebuild_clusters
+    rebuild_clusters()
+    click.echo('Map clusters rebuilt')
+
+
+@pets_cli.command('rebuild-search')
+def rebuild_search_command():
+    """Rebuild the full-text search index from pet_posts."""
+    from app.services.search import rebuild_search_index
+    rebuild_search_index()
+    click.echo('Search index rebuilt')
+
+
+@pets_cli.command('rebuild-matches')
+def rebuild_matches_command():
+    """Recompute the lost/found matches of every post."""
+    from app.services.matching import rebuild_matches
+    total = rebuild_matches()
+    click.echo(f'Stored {total} matches')
+
+
+@pets_cli.command('build-image-variants')
+@click.option('--batch-size', type=int, default=200)
+def build_image_variants_command(batch_size):
+    """Generate resized variants for stored images that don't have them yet.
+
+    Uploads from before the blob store are imported first by backfill-image-hashes.
+    """
+    from app.services.storage import build_missing_variants
+    built, failed = build_missing_variants(batch_size)
+    click.echo(f'Processed {built} images' + (f', {failed} missing, too large or unreadable' if failed else ''))
+
+
+@pets_cli.command('backfill-image-hashes')
+@click.option('--batch-size', type=int, default=200)
+def backfill_image_hashes_command(batch_size):
+    """Compute perceptual hashes for stored images that don't have them yet.
+
+    Uploads from before the blob store (uuid-named files) are imported into it first.
+    """
+    from app.services.image_hashes import backfill_hashes
+    from app.services.storage import import_legacy_uploads
+    imported, missing = import_legacy_uploads(batch_size)
+    click.echo(f'Imported {imported} older uploads' + (f', {missing} files missing or unreadable' if missing else ''))
+    images, jobs = backfill_hashes(batch_size)
+    if current_app.config['IMAGE_PROCESSING_ASYNC']:
+        click.echo(f'Queued {images} images to hash in {jobs} jobs (run `flask worker`)')
+    else:
+        click.echo(f'Hashed {images} images')
+
+
+@pets_cli.command('gc-images')
+@click.option('--grace', type=int, default=None, help='Keep unreferenced images younger than this many seconds.')
+def gc_images_command(grace):
+    """Delete stored images no pet post references any more."""
+    from app.services.storage import collect_garbage, collect_orphan_files
+    blobs = collect_garbage(grace_seconds=grace)
+    files = collect_orphan_files(grace_seconds=grace)
+    click.echo(f'Removed {blobs} unreferenced images and {files} orphaned files')
+
+
+@pets_cli.command('check-indexes')
+@click.option('--verbose', '-v', is_flag=True, help='Print every query plan.')
+def check_indexes_command(verbose):
+    """EXPLAIN the listing queries and fail if any of them scans pet_posts or misses its index range."""
+    from app.services.database import check_listing_plans
+    failed = 0
+    for name, plan, problems in check_listing_plans():
+        click.echo(f"{'FAIL' if problems else 'ok  '}  {name}")
+        if problems or verbose:
+            for step in plan:
+                click.echo(f'        {step}')
+            for problem in problems:
+                if problem not in plan:
+                    click.echo(f'        ! {problem}')
+        failed += bool(problems)
+    if failed:
+        raise click.ClickException(f'{failed} listing queries are not index-backed')
+    click.echo('All listing queries use an index')
+
+
+@pets_cli.command('check-queries')
+def check_queries_command():
+    """Fail if embedding authors (?include=author) costs a query per listed post.
+
+    Runs on a temporary SQLite database with its own posts, so it works in CI.
+    """
+    from app.services.database import check_query_counts
+    failed = 0
+    for name, counts in check_query_counts():
+        constant = len({statements for _, statements in counts}) == 1
+        detail = ', '.join(f'{rows} rows: {statements} queries' for rows, statements in counts)
+        click.echo(f"{'ok  ' if constant else 'FAIL'}  {name} ({detail})")
+        failed += not constant
+    if failed:
+        raise click.ClickException(f'{failed} endpoints issue more queries for bigger pages')
+    click.echo('Query counts do not depend on the page size')
+
+
+@pets_cli.command('build-gazetteer')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--output', default=None, help='Defaults to GEOCODING_GAZETTEER_PATH or instance/gazetteer.bin.')
+def build_gazetteer_command(source, output):
+    """Build the offline geocoding file from a name,latitude,longitude CSV."""
+    from app.services.geocoding import build_gazetteer, read_gazetteer_csv
+    output = output or current_app.config['GEOCODING_GAZETTEER_PATH'] or \
+        os.path.join(current_app.instance_path, 'gazetteer.bin')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    count = build_gazetteer(read_gazetteer_csv(source), output)
+    click.echo(f'Wrote {count} places to {output} (restart the app to load it)')
+
+
+@pets_cli.command('live-broker')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', type=int, default=7001)
+def live_broker_command(host, port):
+    """Relay live feed events between workers (set LIVE_BROKER_URL=tcp://host:port)."""
+    from app.services.live import run_broker
+    click.echo(f'Live broker listening on {host}:{port}')
+    run_broker(host, port)
+
+
+@pets_cli.command('retry-failed-jobs')
+@click.option('--task', 'task_name', default=None, help='Only jobs of this task.')
+def retry_failed_jobs_command(task_name):
+    """Queue background jobs that ran out of attempts again."""
+    from app.services.jobs import retry_failed
+    click.echo(f'Requeued {retry_failed(task_name)} jobs')
+
+
+@pets_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--user', 'username', help='Owner of the imported posts, dated now; without it rows keep their user_id and created_at.')
+@click.option('--chunk-size', type=int, default=None, help='Rows per transaction.')
+@click.option('--dry-run', is_flag=True, help='Validate only.')
+def import_command(source, fmt, username, chunk_size, dry_run):
+    """Import pet posts from a CSV or NDJSON file ('-' for stdin)."""
+    from app.models.user import User
+    from app.services.bulk import guess_format, import_pet_posts, read_records
+    fmt = fmt or guess_format(name=source.name)
+    if not fmt:
+        raise click.UsageError('Cannot tell the format from the file name, use --format')
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.UsageError(f'No user named {username}')
+        user_id = user.id
+
+    result = import_pet_posts(read_records(source, fmt), user_id=user_id, chunk_size=chunk_size,
+                              max_errors=float('inf'), dry_run=dry_run)
+    for error in result.errors:
+        click.echo(f"row {error['row']}: {'; '.join(error['errors'])}", err=True)
+    verb = 'Valid' if dry_run else 'Imported'
+    click.echo(f'{verb}: {result.created}, failed: {result.failed}')
+    if result.failed:
+        raise SystemExit(1)
+
+
+@pets_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension, else NDJSON.')
+@click.option('--pet-type', default=None)
+@click.option('--status', default=None)
+def export_command(target, fmt, pet_type, status):
+    """Export pet posts to a CSV or NDJSON file for backup.
+
+    Application logs go to stdout, so prefer a file over '-'.
+    """
+    from app.services.bulk import export_pet_posts, export_query, guess_format
+    fmt = fmt or guess_format(name=target.name) or 'ndjson'
+    for chunk in export_pet_posts(export_query(pet_type, status), fmt):
+        target.write(chunk)
+
+
+# `flask worker`: runs the background jobs (app/services/jobs.py)
+@click.command('worker')
+@click.option('--concurrency', type=int, default=1, help='Jobs run at once by this process (threads).')
+@click.option('--tasks', default=None, help='Comma-separated task names to run; default all.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+@click.option('--metrics-port', type=int, default=None, help='Serve /metrics for this worker on this port.')
+@click.option('--metrics-host', default='127.0.0.1', help='Address for --metrics-port (0.0.0.0 for all interfaces).')
+@with_appcontext
+def worker_command(concurrency, tasks, burst, metrics_port, metrics_host):
+    """Process background jobs until stopped (SIGTERM finishes the current jobs)."""
+    from app.services.jobs import Worker, serve_metrics
+    app = current_app._get_current_object()
+    if metrics_port:
+        serve_metrics(app, metrics_host, metrics_port)
+    task_names = [name.strip() for name in tasks.split(',') if name.strip()] if tasks else None
+    Worker(app, task_names, concurrency, app.config['JOBS_POLL_INTERVAL']).run(burst=burst)
@@ -1,2 +1,8 @@
 from app.models.user import User
 from app.models.pet_post import PetPost
+from app.models.map_cluster import MapCluster
+from app.models.search_index import SearchTerm, SearchDocument
+from app.models.image_blob import ImageBlob
+from app.models.pet_match import PetMatch
+from app.models.image_hash import ImageHash
+from app.models.job import Job
@@ -0,0 +1,42 @@
+from app import db
+from datetime import datetime
+import re
+
+_DIGEST_URL_RE = re.compile(r'/([0-9a-f]{64})\.[a-z0-9]+$')
+
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+
+    # Uploaded images are stored once per distinct content, keyed by SHA-256
+    digest = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(8), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # pet posts using this image
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Resized variants are built after the upload, and not at all for oversized
+    # or unreadable images; until then posts don't advertise them
+    variants_ready = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    def __init__(self, digest, extension, size):
+        self.digest = digest
+        self.extension = extension
+        self.size = size
+        self.ref_count = 0
+        self.variants_ready = False
+
+    @property
+    def key(self):
+        return blob_key(self.digest, self.extension)
+
+
+def blob_key(digest, extension):
+    # Sharded by the first byte so no directory grows past a few thousand files
+    return f"{digest[:2]}/{digest}.{extension}"
+
+
+def digest_from_url(image_url):
+    if not image_url:
+        return None
+    match = _DIGEST_URL_RE.search(image_url)
+    return match.group(1) if match else None
@@ -0,0 +1,26 @@
+from app import db
+from datetime import datetime
+
+class ImageHash(db.Model):
+    __tablename__ = 'image_hashes'
+    __table_args__ = (
+        # Each chunk index also carries the full hash, so candidates are
+        # filtered on the index alone; matches are then looked up by phash
+        db.Index('ix_image_hashes_phash_0', 'phash_0', 'phash'),
+        db.Index('ix_image_hashes_phash_1', 'phash_1', 'phash'),
+        db.Index('ix_image_hashes_phash_2', 'phash_2', 'phash'),
+        db.Index('ix_image_hashes_phash_3', 'phash_3', 'phash'),
+        db.Index('ix_image_hashes_phash', 'phash'),
+    )
+
+    # Perceptual hashes of a stored image (see ImageBlob), as signed 64-bit integers.
+    # phash_0..3 are its 16-bit chunks, indexed separately for multi-index hashing:
+    # two hashes within Hamming distance r share a chunk within distance r // 4.
+    digest = db.Column(db.String(64), primary_key=True)
+    phash = db.Column(db.BigInteger, nullable=False)
+    dhash = db.Column(db.BigInteger, nullable=False)
+    phash_0 = db.Column(db.Integer, nullable=False)
+    phash_1 = db.Column(db.Integer, nullable=False)
+    phash_2 = db.Column(db.Integer, nullable=False)
+    phash_3 = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
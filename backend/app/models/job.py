@@ -0,0 +1,28 @@
+from app import db
+from datetime import datetime
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Workers take the due job with the lowest priority value, oldest first
+        db.Index('ix_jobs_dequeue', 'status', 'priority', 'run_at'),
+    )
+
+    # A unit of deferred work for `flask worker` (see app/services/jobs.py).
+    # A claimed job is 'running' until locked_until; if its worker dies it is
+    # picked up again once that visibility timeout has passed.
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    priority = db.Column(db.Integer, nullable=False, default=100)  # lower runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before (retry backoff)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    idempotency_key = db.Column(db.String(200), nullable=True, unique=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,14 @@
+from app import db
+
+class MapCluster(db.Model):
+    __tablename__ = 'map_clusters'
+
+    # One row per geohash cell, precision and pet_type/status combination.
+    # The primary key doubles as the index for "cells of precision P in range".
+    precision = db.Column(db.Integer, primary_key=True)
+    cell = db.Column(db.String(12), primary_key=True)
+    pet_type = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    latitude_sum = db.Column(db.Float, nullable=False, default=0.0)
+    longitude_sum = db.Column(db.Float, nullable=False, default=0.0)
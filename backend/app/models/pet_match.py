@@ -0,0 +1,18 @@
+from app import db
+from datetime import datetime
+
+class PetMatch(db.Model):
+    __tablename__ = 'pet_post_matches'
+    __table_args__ = (
+        # The primary key serves lookups from the missing side
+        db.Index('ix_pet_post_matches_found_id', 'found_id', 'score'),
+    )
+
+    # A scored pair of a missing post and a found post of the same pet type
+    missing_id = db.Column(db.Integer, primary_key=True)
+    found_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)  # 0..1, higher is a better match
+    distance_km = db.Column(db.Float, nullable=True)  # None when a post has no coordinates
+    days_apart = db.Column(db.Float, nullable=False)
+    text_score = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,8 +1,26 @@
 from app import db
+from app.services.geo import encode_geohash
+from app.services.images import variant_urls
+from app.models.image_blob import ImageBlob, digest_from_url
 from datetime import datetime
+from operator import attrgetter
+from sqlalchemy import event, select
 
 class PetPost(db.Model):
     __tablename__ = 'pet_posts'
+    __table_args__ = (
+        # Covering index: radius/bbox candidates are found without touching the table
+        db.Index('ix_pet_posts_geohash', 'geohash', 'latitude', 'longitude'),
+        db.Index('ix_pet_posts_image_digest', 'image_digest'),
+        # Listing filters; each ends in (created_at, id) to match the keyset ORDER BY
+        db.Index('ix_pet_posts_created_at', 'created_at', 'id'),
+        db.Index('ix_pet_posts_status_created_at', 'status', 'created_at', 'id'),
+        db.Index('ix_pet_posts_pet_type_created_at', 'pet_type', 'created_at', 'id'),
+        db.Index('ix_pet_posts_status_pet_type_created_at', 'status', 'pet_type', 'created_at', 'id'),
+        db.Index('ix_pet_posts_user_id_created_at', 'user_id', 'created_at', 'id'),
+        # Lost/found matching candidates: same pet type, opposite status, nearby cells
+        db.Index('ix_pet_posts_match_candidates', 'pet_type', 'status', 'geohash'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -10,10 +28,14 @@ class PetPost(db.Model):
     pet_type = db.Column(db.String(20), nullable=False)  # 'cat', 'dog', etc.
     status = db.Column(db.String(20), default='missing')  # 'missing' or 'found'
     image_url = db.Column(db.String(255), nullable=True)
+    image_digest = db.Column(db.String(64), nullable=True)  # content-addressed image, see ImageBlob
+    # Copy of ImageBlob.variants_ready, so listings and the feed index need no join
+    image_variants_ready = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     last_seen_address = db.Column(db.String(255), nullable=False)
     last_seen_date = db.Column(db.DateTime, nullable=False)
     latitude = db.Column(db.Float, nullable=True)
     longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)  # derived from latitude/longitude
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
@@ -31,18 +53,81 @@ class PetPost(db.Model):
         self.longitude = longitude
         self.user_id = user_id
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'pet_type': self.pet_type,
-            'status': self.status,
-            'image_url': self.image_url,
-            'last_seen_address': self.last_seen_address,
-            'last_seen_date': self.last_seen_date.isoformat() if self.last_seen_date else None,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'created_at': self.created_at.isoformat(),
-            'user_id': self.user_id
-        } 
\ No newline at end of file
+    def to_dict(self, fields=None):
+        return post_serializer(fields)(self)
+
+
+# Fields of the pet post payload, in to_dict order; clients can ask for a
+# subset with ?fields=
+POST_FIELDS = (
+    'id', 'title', 'description', 'pet_type', 'status', 'image_url', 'image_variants',
+    'last_seen_address', 'last_seen_date', 'latitude', 'longitude', 'created_at', 'user_id'
+)
+
+
+def _isoformat(name):
+    def get(row):
+        value = getattr(row, name)
+        return value.isoformat() if value is not None else None
+    return get
+
+
+def _field_getter(name):
+    if name == 'image_variants':
+        return lambda row: variant_urls(row.image_url) if row.image_variants_ready else None
+    if name in ('last_seen_date', 'created_at'):
+        return _isoformat(name)
+    return attrgetter(name)
+
+
+_serializers = {}
+
+
+def post_serializer(fields=None):
+    """Return a function turning a PetPost, or a row of post_columns(), into a dict.
+
+    Rows only need the attributes the requested fields are built from, so
+    list endpoints can select plain tuples instead of hydrating ORM objects.
+    """
+    fields = tuple(fields) if fields else POST_FIELDS
+    serializer = _serializers.get(fields)
+    if serializer is None:
+        getters = [(name, _field_getter(name)) for name in fields]
+
+        def serializer(row):
+            return {name: get(row) for name, get in getters}
+        _serializers[fields] = serializer
+    return serializer
+
+
+def post_columns(fields=None):
+    """Columns to select for post_serializer(fields), plus the keyset (created_at, id)."""
+    names = set(fields or POST_FIELDS) | {'id', 'created_at'}
+    if 'image_variants' in names:
+        names.discard('image_variants')
+        names.update(('image_url', 'image_variants_ready'))
+    return [getattr(PetPost, column.key) for column in PetPost.__table__.columns if column.key in names]
+
+
+# Keep the geohash cell in sync with the coordinates
+@event.listens_for(PetPost, 'before_insert')
+@event.listens_for(PetPost, 'before_update')
+def update_geohash(mapper, connection, target):
+    if target.latitude is not None and target.longitude is not None:
+        target.geohash = encode_geohash(target.latitude, target.longitude)
+    else:
+        target.geohash = None
+
+
+
+# Track which stored image the post references, for reference counting,
+# and whether its variants exist yet (later ones come from mark_variants_ready)
+@event.listens_for(PetPost, 'before_insert')
+@event.listens_for(PetPost, 'before_update')
+def update_image_digest(mapper, connection, target):
+    digest = digest_from_url(target.image_url)
+    if digest == target.image_digest and target.image_variants_ready is not None:
+        return
+    target.image_digest = digest
+    target.image_variants_ready = bool(digest) and bool(connection.scalar(
+        select(ImageBlob.variants_ready).where(ImageBlob.digest == digest)))
@@ -0,0 +1,20 @@
+from app import db
+
+# Inverted index used for full-text search when SQLite FTS5 isn't available
+
+class SearchTerm(db.Model):
+    __tablename__ = 'pet_post_terms'
+    __table_args__ = (
+        db.Index('ix_pet_post_terms_post_id', 'post_id'),
+    )
+
+    term = db.Column(db.String(64), primary_key=True)
+    post_id = db.Column(db.Integer, primary_key=True)
+    tf = db.Column(db.Integer, nullable=False)  # occurrences of term in the post
+
+
+class SearchDocument(db.Model):
+    __tablename__ = 'pet_post_search_docs'
+
+    post_id = db.Column(db.Integer, primary_key=True)
+    length = db.Column(db.Integer, nullable=False)  # token count, for BM25 length normalization
@@ -1,5 +1,5 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.services.passwords import get_hasher
 from datetime import datetime
 
 class User(db.Model):
@@ -8,7 +8,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, index=True)
     email = db.Column(db.String(120), unique=True, index=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))  # room for scrypt hashes
     phone = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -21,11 +21,16 @@ class User(db.Model):
         self.set_password(password)
         self.phone = phone
     
+    # Hashing runs on the bounded pool (see app.services.passwords) and may
+    # raise HashingBusy when it is saturated
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_hasher().hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return get_hasher().needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -34,4 +39,12 @@ class User(db.Model):
             'email': self.email,
             'phone': self.phone,
             'created_at': self.created_at.isoformat()
-        } 
\ No newline at end of file
+        } 
+
+
+def load_authors(user_ids):
+    """Public author payloads ({id: {...}}) for a set of user ids, in one query."""
+    if not user_ids:
+        return {}
+    rows = db.session.query(User.id, User.username, User.phone).filter(User.id.in_(user_ids))
+    return {row.id: {'id': row.id, 'username': row.username, 'phone': row.phone} for row in rows}
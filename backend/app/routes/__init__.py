@@ -1,3 +1,4 @@
 # Import routes to make them available
 from app.routes.auth import auth_bp
 from app.routes.pets import pets_bp
+from app.routes.uploads import uploads_bp
\ No newline at end of file
@@ -1,17 +1,37 @@
 from flask import Blueprint, request, jsonify
 from app import db, jwt
 from app.models.user import User
-from flask_jwt_extended import (
-    create_access_token,
-    jwt_required,
-    get_jwt_identity
-)
+from app.services.identity import current_user, user_required
+from app.services.passwords import HashingBusy
+from app.services.throttle import get_limiter
+from flask_jwt_extended import create_access_token
+import logging
 
 auth_bp = Blueprint('auth', __name__)
 
+logger = logging.getLogger(__name__)
+
+def too_many_attempts(retry_after):
+    response = jsonify({'message': 'Too many attempts, try again later'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+# Password hashing pool is saturated: fail fast, the client may retry shortly
+@auth_bp.errorhandler(HashingBusy)
+def hashing_busy(error):
+    logger.warning("Password hashing pool is busy, rejecting %s", request.path)
+    response = jsonify({'message': 'Server is busy, try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
+
+    # Every attempt costs a password hash
+    retry_after = get_limiter('ip').hit(request.remote_addr)
+    if retry_after:
+        return too_many_attempts(retry_after)
     
     # Check if required fields are provided
     required_fields = ['username', 'email', 'password']
@@ -55,12 +75,27 @@ def login():
     if not data.get('email') or not data.get('password'):
         return jsonify({'message': 'Email and password are required'}), 400
     
+    # Throttle by address and by account before spending CPU on the hash.
+    # Failed logins count per account *and* address, so someone guessing from
+    # elsewhere can't lock the owner out; the per-address bucket caps guessing.
+    account_key = f"{str(data['email']).strip().lower()}|{request.remote_addr}"
+    retry_after = get_limiter('account').retry_after(account_key) or get_limiter('ip').hit(request.remote_addr)
+    if retry_after:
+        return too_many_attempts(retry_after)
+    
     # Find user by email
     user = User.query.filter_by(email=data['email']).first()
     
     # Check if user exists and password is correct
     if not user or not user.check_password(data['password']):
+        get_limiter('account').hit(account_key)
         return jsonify({'message': 'Invalid email or password'}), 401
+    get_limiter('account').reset(account_key)
+
+    # Upgrade the stored hash when the hashing parameters have changed
+    if user.password_needs_rehash():
+        user.set_password(data['password'])
+        db.session.commit()
     
     # Generate access token
     access_token = create_access_token(identity=str(user.id))
@@ -73,33 +108,13 @@ def login():
 
 
 @auth_bp.route('/profile', methods=['GET'])
-@jwt_required()
+@user_required
 def get_profile():
-    current_user_id = get_jwt_identity()
-    print(f"JWT identity received: {current_user_id}, type: {type(current_user_id)}")
-    
-    try:
-        # Check if the identifier is a string
-        if not isinstance(current_user_id, str):
-            print(f"User ID is not a string: {type(current_user_id)}")
-            return jsonify({'message': 'User ID must be a string'}), 400
-            
-        # Check if the string represents a number
-        if not current_user_id.isdigit():
-            print(f"User ID is not a number: {current_user_id}")
-            return jsonify({'message': 'User ID must be a number'}), 400
-            
-        # Convert to integer
-        current_user_id = int(current_user_id)
-    except (ValueError, TypeError, AttributeError) as e:
-        print(f"Error processing user ID ({current_user_id}): {e}")
-        return jsonify({'message': f'Invalid user ID format: {e}'}), 400
-        
-    user = User.query.get(current_user_id)
+    user = current_user()
     
     if not user:
         return jsonify({'message': 'User not found'}), 404
     
     return jsonify({
         'user': user.to_dict()
-    }), 200 
\ No newline at end of file
+    }), 200
\ No newline at end of file
@@ -1,148 +1,278 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from app import db
-from app.models.pet_post import PetPost
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.models.pet_post import POST_FIELDS, PetPost, post_columns, post_serializer
+from app.models.pet_match import PetMatch
+from app.models.user import load_authors
+from app.services.cache import cached_response, listing_tag, post_tag
+from app.services.clusters import get_clusters
+from app.services.storage import store_upload
+from app.services.uploads import UploadSpool
+from app.services.log_config import redact_headers
+from app.services.identity import get_current_user_id, user_required
+from app.services.replica import use_replica
+from app.services.geocoding import complete_location
+from app.services.geo import GeoQueryError, bbox_filter, haversine_km, parse_bbox, parse_geohash_prefix, parse_point, radius_bbox, split_antimeridian
+from app.services.search import ranked_matches
+from app.services.pagination import PaginationError, apply_keyset, decode_keyset, decode_offset, keyset_cursor, keyset_page, offset_cursor, parse_limit
+from app.services.feed_index import get_feed_index
+from app.services.image_hashes import similar_digests
+from app.services.live import LiveFull, get_live_hub
+from app.services.matching import OPPOSITE_STATUS
+from app.services.metrics import cache_lookup
+from app.services.pet_data import build_pet_data, validate_pet_data
+from app.services.bulk import BULK_FORMATS, export_query, guess_format, read_records
+from app.services.bulk import export_pet_posts as bulk_export, import_pet_posts as bulk_import
 from datetime import datetime
 import os
-import uuid
-from werkzeug.utils import secure_filename
 import logging
-import json
-import sys
+from itertools import islice
 
 pets_bp = Blueprint('pets', __name__)
 
-# Настройка логирования
+# Handlers, level and format are set up by configure_logging() from config.py
 logger = logging.getLogger("pets_api")
-logger.setLevel(logging.DEBUG)
-# Добавляем вывод в консоль
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+
+# Upload rejections raised while the body is streamed
+@pets_bp.errorhandler(413)
+@pets_bp.errorhandler(415)
+def upload_rejected(error):
+    return jsonify({'message': error.description}), error.code
 
 # Helper function to check if file is allowed
 def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # Helper function to save file
 def save_file(file):
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
-        # Return the URL path to access the file
-        return f"/static/uploads/{unique_filename}"
-    return None
-
-# Helper to validate form data
-def validate_pet_data(data):
-    errors = []
-    
-    # Обработка subject -> title преобразования
-    if 'subject' in data and 'title' not in data:
-        try:
-            data['title'] = str(data['subject'])
-            logger.info(f"Converted subject to title: {data['title']}")
-        except Exception as e:
-            logger.error(f"Failed to convert subject to string: {e}")
-            errors.append("subject must be a string")
-    
-    # Специальная проверка для subject, если оно есть
-    if 'subject' in data and not isinstance(data['subject'], str):
-        try:
-            data['subject'] = str(data['subject'])
-            logger.info(f"Converted subject to string: {data['subject']}")
-        except Exception as e:
-            logger.error(f"Failed to convert subject to string: {e}")
-            errors.append("subject must be a string")
-    
-    # Validate required fields
-    required_fields = ['title', 'description', 'pet_type', 'last_seen_address', 'last_seen_date']
-    for field in required_fields:
-        if field not in data or not data[field]:
-            errors.append(f"{field} is required")
-    
-    # Validate title is a string
-    if 'title' in data:
-        if not isinstance(data['title'], str):
-            errors.append("title must be a string")
-            # Попытка преобразования title в строку
-            try:
-                data['title'] = str(data['title'])
-                logger.info(f"Converted title to string: {data['title']}")
-            except Exception as e:
-                logger.error(f"Failed to convert title to string: {e}")
-    
-    # Validate pet_type
-    valid_pet_types = ['cat', 'dog', 'bird', 'other']
-    if 'pet_type' in data and data['pet_type'] not in valid_pet_types:
-        errors.append(f"pet_type must be one of: {', '.join(valid_pet_types)}")
-    
-    # Validate status
-    valid_statuses = ['missing', 'found']
-    if 'status' in data and data['status'] not in valid_statuses:
-        errors.append(f"status must be one of: {', '.join(valid_statuses)}")
-    
-    # Validate coordinates if present
-    if 'latitude' in data and data['latitude']:
-        try:
-            float(data['latitude'])
-        except (ValueError, TypeError):
-            errors.append("latitude must be a valid number")
-    
-    if 'longitude' in data and data['longitude']:
-        try:
-            float(data['longitude'])
-        except (ValueError, TypeError):
-            errors.append("longitude must be a valid number")
-    
-    return errors
+    if not file or not allowed_file(file.filename):
+        return None
+    # The body was already streamed to a temp file and sniffed by UploadRequest
+    spool = file.stream
+    if not isinstance(spool, UploadSpool) or not spool.finalize():
+        return None
+    # Stored by content hash, so re-posting the same photo costs no disk space
+    return store_upload(spool)
+
+# Sparse payloads: ?fields=id,latitude,longitude (unknown names are rejected)
+def parse_fields():
+    value = request.args.get('fields')
+    if not value:
+        return None
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested.difference(POST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    # Canonical order, so equal field sets share a serializer
+    return tuple(name for name in POST_FIELDS if name in requested)
+
+# Related objects embedded in each post: ?include=author
+INCLUDES = ('author',)
+
+def parse_include():
+    value = request.args.get('include')
+    if not value:
+        return frozenset()
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested.difference(INCLUDES)
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}")
+    return frozenset(requested)
+
+def parse_projection():
+    return parse_fields(), parse_include()
+
+# Columns for a page of posts; authors are looked up by user_id
+def select_columns(fields, include):
+    if fields and 'author' in include and 'user_id' not in fields:
+        fields = fields + ('user_id',)
+    return post_columns(fields)
+
+# Serialize a page of rows. Authors for the whole page come from one query,
+# so the number of statements doesn't grow with the page size.
+def serialize_posts(rows, fields, include):
+    serialize = post_serializer(fields)
+    posts = [serialize(row) for row in rows]
+    if 'author' in include:
+        authors = load_authors({row.user_id for row in rows})
+        for post, row in zip(posts, rows):
+            post['author'] = authors.get(row.user_id)
+    return posts
+
+# Clients opt into NDJSON streaming with ?format=ndjson or the Accept header
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+# Helper to stream a query as NDJSON without materializing the result set
+def stream_pet_posts(query, cursor, fields, include, limit=None):
+    query = apply_keyset(query, PetPost, cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    batch_size = current_app.config['PETS_STREAM_BATCH_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        rows = iter(query.yield_per(batch_size))
+        while batch := list(islice(rows, batch_size)):
+            yield ''.join(dumps(post) + '\n' for post in serialize_posts(batch, fields, include))
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Helper to return one keyset page of a query (or a stream, if requested).
+# Only the columns behind the requested fields are selected, as plain rows.
+def list_pet_posts(query):
+    cursor = request.args.get('cursor')
+    try:
+        fields, include = parse_projection()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    query = query.with_entities(*select_columns(fields, include))
+    try:
+        if wants_ndjson():
+            limit = parse_limit(request.args) if 'limit' in request.args else None
+            return stream_pet_posts(query, cursor, fields, include, limit)
+        limit = parse_limit(request.args)
+        rows, next_cursor = keyset_page(query, PetPost, cursor, limit)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify({
+        'pet_posts': serialize_posts(rows, fields, include),
+        'next_cursor': next_cursor
+    }), 200
+
+# Query arguments a feed index page can answer
+FEED_INDEX_ARGS = frozenset(('pet_type', 'status', 'limit', 'cursor', 'fields', 'include', 'consistency'))
+
+# Helper to answer a plain listing page from the in-memory feed index.
+# Returns None when the index can't serve it and SQL has to.
+def feed_pet_posts(index, pet_type, status):
+    try:
+        fields, include = parse_projection()
+        limit = parse_limit(request.args)
+        cursor = request.args.get('cursor')
+        after = decode_keyset(cursor) if cursor else None
+    except (ValueError, PaginationError) as e:
+        return jsonify({'message': str(e)}), 400
+
+    records = index.page(pet_type, status, after, limit)
+    cache_lookup('feed_index', records is not None)
+    if records is None:
+        return None
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = keyset_cursor(records[-1].created_at, records[-1].id)
+
+    return jsonify({
+        'pet_posts': serialize_posts(records, fields, include),
+        'next_cursor': next_cursor
+    }), 200
+
+# Posts within radius_km of the point as [(distance, id)], nearest first, and
+# whether the list had to be cut short. Candidates come straight from the
+# geohash index, at most GEO_MAX_CANDIDATES per query: when the radius holds
+# more, it is narrowed (bisected) until a covered circle holds the `need`
+# nearest posts. Returns (ranked, truncated).
+def nearest_posts(query, latitude, longitude, radius_km, need, max_steps=12):
+    config = current_app.config
+    max_candidates = config['GEO_MAX_CANDIDATES']
+    fits, overflows = 0.0, None  # radii known to fit under / overflow the cap
+    best = []
+    radius = radius_km
+    for _ in range(max_steps):
+        boxes = radius_bbox(latitude, longitude, radius)
+        candidates = query.filter(bbox_filter(PetPost, boxes, config['GEO_MAX_CELLS'])) \
+            .with_entities(PetPost.id, PetPost.latitude, PetPost.longitude) \
+            .limit(max_candidates + 1).all()
+        if len(candidates) > max_candidates:
+            overflows = radius
+        else:
+            # Every post within this radius is a candidate, so their order is exact
+            ranked = []
+            for post_id, lat, lon in candidates:
+                distance = haversine_km(latitude, longitude, lat, lon)
+                if distance <= radius:
+                    ranked.append((distance, post_id))
+            ranked.sort()
+            if len(ranked) >= need or radius >= radius_km:
+                return ranked, False
+            fits, best = radius, ranked
+        radius = (fits + overflows) / 2
+    return best, True
+
+# Helper to answer near=lat,lon&radius_km= queries, ranked by distance
+def nearby_pet_posts(query, near):
+    try:
+        latitude, longitude = parse_point(near)
+        radius_km = float(request.args.get('radius_km') or current_app.config['GEO_DEFAULT_RADIUS_KM'])
+    except ValueError as e:
+        return jsonify({'message': str(e) if isinstance(e, GeoQueryError) else 'radius_km must be a number'}), 400
+    if not 0 < radius_km <= current_app.config['GEO_MAX_RADIUS_KM']:
+        return jsonify({'message': f"radius_km must be between 0 and {current_app.config['GEO_MAX_RADIUS_KM']}"}), 400
+
+    try:
+        fields, include = parse_projection()
+        limit = parse_limit(request.args)
+        offset = decode_offset(request.args.get('cursor'))
+    except (ValueError, PaginationError) as e:
+        return jsonify({'message': str(e)}), 400
+
+    ranked, truncated = nearest_posts(query, latitude, longitude, radius_km, offset + limit + 1)
+    page = ranked[offset:offset + limit]
+    rows = PetPost.query.with_entities(*select_columns(fields, include)) \
+        .filter(PetPost.id.in_([post_id for _, post_id in page]))
+    posts = {row.id: row for row in rows}
+    results = serialize_posts([posts[post_id] for _, post_id in page], fields, include)
+    for post_dict, (distance, _) in zip(results, page):
+        post_dict['distance_km'] = round(distance, 3)
+
+    next_cursor = offset_cursor(offset + limit) if len(ranked) > offset + limit else None
+    body = {'pet_posts': results, 'next_cursor': next_cursor}
+    if truncated:
+        body['truncated'] = True  # too many posts nearby; the page may miss some
+    return jsonify(body), 200
+
+# Helper to answer q= queries, ranked by BM25 relevance
+def search_pet_posts(query, matches):
+    try:
+        fields, include = parse_projection()
+        limit = parse_limit(request.args)
+        offset = decode_offset(request.args.get('cursor'))
+    except (ValueError, PaginationError) as e:
+        return jsonify({'message': str(e)}), 400
+
+    pet_posts = query.with_entities(*select_columns(fields, include)) \
+        .join(matches, PetPost.id == matches.c.post_id) \
+        .order_by(matches.c.score.desc(), PetPost.id.desc()) \
+        .offset(offset).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(pet_posts) > limit:
+        pet_posts = pet_posts[:limit]
+        next_cursor = offset_cursor(offset + limit)
+    return jsonify({
+        'pet_posts': serialize_posts(pet_posts, fields, include),
+        'next_cursor': next_cursor
+    }), 200
 
 @pets_bp.route('/', methods=['POST'])
-@jwt_required()
+@user_required
 def create_pet_post():
-    current_user_id = get_jwt_identity()
-    logger.info(f"JWT identity received: {current_user_id}, type: {type(current_user_id)}")
-    
-    try:
-        # Check if the identifier is a string
-        if not isinstance(current_user_id, str):
-            logger.error(f"User ID is not a string: {type(current_user_id)}")
-            return jsonify({"message": "User ID must be a string"}), 400
-            
-        # Check if the string represents a number
-        if not current_user_id.isdigit():
-            logger.error(f"User ID is not a number: {current_user_id}")
-            return jsonify({"message": "User ID must be a number"}), 400
-            
-        # Convert to integer
-        current_user_id = int(current_user_id)
-    except (ValueError, TypeError, AttributeError) as e:
-        logger.error(f"Error processing user ID ({current_user_id}): {e}")
-        return jsonify({"message": f"Invalid user ID format: {e}"}), 400
-        
-    logger.info(f"Creating pet post for user: {current_user_id}")
+    current_user_id = get_current_user_id()
+    logger.info("Creating pet post for user %s", current_user_id)
     
-    # Log request information
-    logger.info(f"Request headers: {dict(request.headers)}")
-    logger.info(f"Request form data: {request.form}")
-    logger.info(f"Request files: {request.files}")
+    # Log request information (debug only; auth headers are redacted)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request headers: %s", redact_headers(request.headers, current_app.config['LOG_REDACT_HEADERS']))
+        logger.debug("Request files: %s", request.files)
     
     # Handle form data
     data = request.form.to_dict()
-    logger.info(f"Parsed form data: {data}")
-    
-    # Добавляем расширенное логирование для отладки JWT ошибок
-    logger.info(f"JWT Identity: {current_user_id}, Type: {type(current_user_id)}")
-    try:
-        logger.info(f"JWT Config: {current_app.config.get('JWT_ERROR_MESSAGE_KEY', 'No JWT_ERROR_MESSAGE_KEY found')}")
-    except Exception as e:
-        logger.error(f"Error checking JWT config: {e}")
+    logger.debug("Parsed form data: %s", data)
     
     # Специальная проверка для поля title
     # Проблема может быть в том, что форма передаёт title не как строку
@@ -152,9 +282,9 @@ def create_pet_post():
             title_value = data['title']
             str_title = str(title_value)
             data['title'] = str_title
-            logger.info(f"Title field processed: '{data['title']}', Type: {type(data['title'])}")
+            logger.debug("Title field processed: %r", data['title'])
         except Exception as e:
-            logger.error(f"Error processing title field: {e}")
+            logger.warning("Error processing title field: %s", e)
             # Если title нельзя преобразовать в строку - создаём пустую строку
             data['title'] = ""
     elif 'subject' in data:
@@ -163,24 +293,23 @@ def create_pet_post():
             subject_value = data['subject']
             str_subject = str(subject_value)
             data['title'] = str_subject
-            logger.info(f"Subject field used as title: '{data['title']}', Type: {type(data['title'])}")
+            logger.debug("Subject field used as title: %r", data['title'])
         except Exception as e:
-            logger.error(f"Error processing subject field: {e}")
+            logger.warning("Error processing subject field: %s", e)
             data['title'] = ""
     else:
-        logger.warning("Neither title nor subject field found in data")
-    
-    # Quick debug check for the title field
-    if 'title' in data:
-        logger.info(f"Title field: '{data['title']}', Type: {type(data['title'])}")
-    else:
-        logger.warning("Title field missing from data")
+        logger.info("Neither title nor subject field found in data")
+
+    # Address from coordinates or coordinates from the address, whichever is missing
+    filled = complete_location(data)
+    if filled:
+        logger.debug("Geocoded %s: %s", ', '.join(filled), [data[field] for field in filled])
     
     # Validate the data
     validation_errors = validate_pet_data(data)
     if validation_errors:
         error_msg = f"Validation errors: {', '.join(validation_errors)}"
-        logger.error(f"Error: {error_msg}")
+        logger.info("Rejected pet post: %s", error_msg)
         return jsonify({
             'message': error_msg,
             'errors': validation_errors
@@ -190,79 +319,30 @@ def create_pet_post():
     image_url = None
     if 'image' in request.files:
         file = request.files['image']
-        logger.info(f"Image file: {file.filename}, Content type: {file.content_type}")
+        logger.debug("Image file: %s, content type: %s", file.filename, file.content_type)
         image_url = save_file(file)
         if image_url:
-            logger.info(f"Image saved successfully: {image_url}")
+            logger.debug("Image saved: %s", image_url)
         else:
-            logger.warning("Failed to save image, might be an invalid format")
-    else:
-        logger.info("No image file in request")
+            logger.info("Image not saved, might be an invalid format")
     
-    # Parse date
+    # Parse date and location coordinates
     try:
-        logger.info(f"Parsing date: {data['last_seen_date']}")
-        last_seen_date = datetime.fromisoformat(data['last_seen_date'].replace('Z', '+00:00'))
-        logger.info(f"Parsed date: {last_seen_date}")
+        pet_data = build_pet_data(data, current_user_id, image_url)
     except ValueError as e:
-        error_msg = f"Invalid date format: {str(e)}"
-        logger.error(f"Error: {error_msg}")
-        return jsonify({'message': error_msg}), 400
-    
-    # Parse location coordinates
-    latitude = None
-    longitude = None
-    try:
-        if 'latitude' in data and data['latitude']:
-            latitude = float(data['latitude'])
-            logger.info(f"Parsed latitude: {latitude}")
-        if 'longitude' in data and data['longitude']:
-            longitude = float(data['longitude'])
-            logger.info(f"Parsed longitude: {longitude}")
-    except ValueError as e:
-        error_msg = f"Invalid coordinate format: {str(e)}"
-        logger.error(f"Error: {error_msg}")
-        return jsonify({'message': error_msg}), 400
+        logger.info("Rejected pet post: %s", e)
+        return jsonify({'message': str(e)}), 400
     
     # Create new pet post
     try:
-        # Создаем словарь с данными для отладки
-        pet_data = {
-            'title': data['title'],
-            'description': data['description'],
-            'pet_type': data['pet_type'],
-            'status': data.get('status', 'missing'),
-            'image_url': image_url,
-            'last_seen_address': data['last_seen_address'],
-            'last_seen_date': last_seen_date,
-            'latitude': latitude,
-            'longitude': longitude,
-            'user_id': current_user_id
-        }
+        logger.debug("Creating new PetPost instance with data: %s", pet_data)
         
-        logger.info(f"Creating new PetPost instance with data: {pet_data}")
-        
-        # Выводим типы данных для отладки
-        type_info = {key: str(type(value)) for key, value in pet_data.items()}
-        logger.info(f"Data types: {type_info}")
-        
-        pet_post = PetPost(
-            title=data['title'],
-            description=data['description'],
-            pet_type=data['pet_type'],
-            status=data.get('status', 'missing'),
-            image_url=image_url,
-            last_seen_address=data['last_seen_address'],
-            last_seen_date=last_seen_date,
-            latitude=latitude,
-            longitude=longitude,
-            user_id=current_user_id
-        )
+        pet_post = PetPost(**pet_data)
         
         db.session.add(pet_post)
         db.session.commit()
         
-        logger.info(f"Pet post created successfully with ID: {pet_post.id}")
+        logger.info("Pet post created with ID %s", pet_post.id)
         return jsonify({
             'message': 'Pet post created successfully',
             'pet_post': pet_post.to_dict()
@@ -270,12 +350,13 @@ def create_pet_post():
     except Exception as e:
         db.session.rollback()
         error_msg = f"Database error: {str(e)}"
-        logger.error(f"Error: {error_msg}")
-        logger.exception("Exception details")
+        logger.exception("Failed to create pet post")
         return jsonify({'message': error_msg}), 422
 
 
 @pets_bp.route('/', methods=['GET'])
+@cached_response(lambda: [listing_tag(request.args.get('pet_type'), request.args.get('status'))])
+@use_replica
 def get_pet_posts():
     # Get query parameters
     pet_type = request.args.get('pet_type')
@@ -289,47 +370,206 @@ def get_pet_posts():
         query = query.filter_by(pet_type=pet_type)
     if status:
         query = query.filter_by(status=status)
-    
-    # Order by created_at descending
-    pet_posts = query.order_by(PetPost.created_at.desc()).all()
-    
+
+    # Full-text matches come from the search index, never a LIKE scan
+    q = request.args.get('q')
+    matches = ranked_matches(q) if q else None
+
+    # Geo modes use the geohash index instead of scanning the table
+    near = request.args.get('near')
+    if near:
+        if matches is not None:
+            query = query.filter(PetPost.id.in_(db.select(matches.c.post_id)))
+        return nearby_pet_posts(query, near)
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            boxes = split_antimeridian(*parse_bbox(bbox))
+        except GeoQueryError as e:
+            return jsonify({'message': str(e)}), 400
+        query = query.filter(bbox_filter(PetPost, boxes, current_app.config['GEO_MAX_CELLS']))
+
+    if matches is not None:
+        return search_pet_posts(query, matches)
+
+    # Plain feed pages come from memory; ?consistency=strong always reads SQL.
+    # Any argument the index doesn't model (bbox, ...) also goes to SQL.
+    if request.args.get('consistency') != 'strong' and not wants_ndjson() \
+            and set(request.args) <= FEED_INDEX_ARGS:
+        index = get_feed_index()
+        if index is not None:
+            response = feed_pet_posts(index, pet_type, status)
+            if response is not None:
+                return response
+    
+    # Newest first, paginated by (created_at, id)
+    return list_pet_posts(query)
+
+
+@pets_bp.route('/live', methods=['GET'])
+def live_pet_posts():
+    hub = get_live_hub()
+    if hub is None:
+        return jsonify({'message': 'Live feed is disabled'}), 404
+
+    # Region: a geohash prefix or a bbox; without either every post is sent
+    prefix = boxes = None
+    try:
+        if request.args.get('geohash') and request.args.get('bbox'):
+            raise GeoQueryError('Use either geohash or bbox')
+        if request.args.get('geohash'):
+            prefix = parse_geohash_prefix(request.args['geohash'])
+        elif request.args.get('bbox'):
+            boxes = split_antimeridian(*parse_bbox(request.args['bbox']))
+    except GeoQueryError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        subscription = hub.subscribe(request.args.get('pet_type'), request.args.get('status'), prefix, boxes)
+    except LiveFull:
+        return jsonify({'message': 'Too many live connections, try again later'}), 503, {'Retry-After': '30'}
+    heartbeat = current_app.config['LIVE_HEARTBEAT']
+
+    def generate():
+        try:
+            yield b'retry: 5000\n: connected\n\n'
+            while not subscription.closed:
+                yield subscription.next_frame(heartbeat) or b': ping\n\n'
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx must not buffer the stream
+    return response
+
+
+@pets_bp.route('/clusters', methods=['GET'])
+def get_pet_clusters():
+    bbox = request.args.get('bbox')
+    if not bbox:
+        return jsonify({'message': 'bbox is required'}), 400
+    try:
+        boxes = split_antimeridian(*parse_bbox(bbox))
+    except GeoQueryError as e:
+        return jsonify({'message': str(e)}), 400
+    try:
+        zoom = int(request.args.get('zoom', 10))
+    except ValueError:
+        return jsonify({'message': 'zoom must be an integer'}), 400
+    if not 0 <= zoom <= 22:
+        return jsonify({'message': 'zoom must be between 0 and 22'}), 400
+
+    # Served from the precomputed aggregates, so cost grows with visible cells only
+    precision = None
+    clusters = []
+    for box in boxes:
+        precision, box_clusters = get_clusters(
+            *box, zoom,
+            pet_type=request.args.get('pet_type'),
+            status=request.args.get('status'),
+            max_cells=current_app.config['CLUSTER_MAX_CELLS']
+        )
+        clusters.extend(box_clusters)
+
     return jsonify({
-        'pet_posts': [post.to_dict() for post in pet_posts]
+        'precision': precision,
+        'clusters': clusters
     }), 200
 
 
 @pets_bp.route('/<int:post_id>', methods=['GET'])
+@cached_response(lambda post_id: [post_tag(post_id)])
+@use_replica
 def get_pet_post(post_id):
-    pet_post = PetPost.query.get_or_404(post_id)
+    try:
+        fields, include = parse_projection()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    pet_post = PetPost.query.with_entities(*select_columns(fields, include)) \
+        .filter(PetPost.id == post_id).first_or_404()
     
     return jsonify({
-        'pet_post': pet_post.to_dict()
+        'pet_post': serialize_posts([pet_post], fields, include)[0]
     }), 200
 
 
+@pets_bp.route('/<int:post_id>/matches', methods=['GET'])
+@use_replica
+def get_pet_post_matches(post_id):
+    try:
+        fields, include = parse_projection()
+        limit = parse_limit(request.args)
+    except (ValueError, PaginationError) as e:
+        return jsonify({'message': str(e)}), 400
+    pet_post = PetPost.query.with_entities(PetPost.id, PetPost.status) \
+        .filter(PetPost.id == post_id).first_or_404()
+    if pet_post.status not in OPPOSITE_STATUS:
+        return jsonify({'matches': []}), 200
+
+    # Matches are stored once per (missing, found) pair
+    if pet_post.status == 'missing':
+        own_side, other_side = PetMatch.missing_id, PetMatch.found_id
+    else:
+        own_side, other_side = PetMatch.found_id, PetMatch.missing_id
+    rows = PetPost.query.with_entities(*select_columns(fields, include), PetMatch.score,
+                                       PetMatch.distance_km, PetMatch.days_apart) \
+        .join(PetMatch, other_side == PetPost.id) \
+        .filter(own_side == post_id) \
+        .order_by(PetMatch.score.desc(), PetPost.id.desc()) \
+        .limit(limit).all()
+
+    matches = serialize_posts(rows, fields, include)
+    for match, row in zip(matches, rows):
+        match['match'] = {'score': row.score, 'distance_km': row.distance_km, 'days_apart': row.days_apart}
+    return jsonify({'matches': matches}), 200
+
+
+@pets_bp.route('/<int:post_id>/similar-images', methods=['GET'])
+@use_replica
+def get_similar_images(post_id):
+    try:
+        fields, include = parse_projection()
+        limit = parse_limit(request.args)
+    except (ValueError, PaginationError) as e:
+        return jsonify({'message': str(e)}), 400
+    pet_post = PetPost.query.with_entities(PetPost.id, PetPost.image_digest) \
+        .filter(PetPost.id == post_id).first_or_404()
+    if not pet_post.image_digest:
+        return jsonify({'message': 'Pet post has no image'}), 404
+
+    similar = similar_digests(pet_post.image_digest, current_app.config['IMAGE_SIMILARITY_MAX_DISTANCE'], limit)
+    if similar is None:
+        # Hashing runs in the background right after the upload
+        return jsonify({'similar': [], 'pending': True}), 200
+    # Other posts with the very same image come first
+    distances = {pet_post.image_digest: (0, 0)}
+    distances.update((digest, (distance, dhash_distance)) for digest, distance, dhash_distance in similar)
+
+    # At most `limit` posts per image, in one query
+    ranked = db.select(PetPost.id, db.func.row_number().over(
+        partition_by=PetPost.image_digest, order_by=PetPost.id.desc()).label('rank')) \
+        .where(PetPost.image_digest.in_(list(distances)), PetPost.id != post_id)
+    status = request.args.get('status')
+    if status:
+        ranked = ranked.where(PetPost.status == status)
+    ranked = ranked.subquery()
+    rows = PetPost.query.with_entities(*select_columns(fields, include), PetPost.image_digest) \
+        .join(ranked, ranked.c.id == PetPost.id).filter(ranked.c.rank <= limit).all()
+    rows.sort(key=lambda row: (distances[row.image_digest], -row.id))
+    rows = rows[:limit]
+
+    posts = serialize_posts(rows, fields, include)
+    for post, row in zip(posts, rows):
+        distance, dhash_distance = distances[row.image_digest]
+        post['similarity'] = {'distance': distance, 'dhash_distance': dhash_distance}
+    return jsonify({'similar': posts}), 200
+
+
 @pets_bp.route('/<int:post_id>', methods=['PUT'])
-@jwt_required()
+@user_required
 def update_pet_post(post_id):
-    current_user_id = get_jwt_identity()
-    logger.info(f"Получен JWT identity: {current_user_id}, тип: {type(current_user_id)}")
-    
-    try:
-        # Проверяем, что идентификатор - это строка
-        if not isinstance(current_user_id, str):
-            logger.error(f"ID пользователя не строка: {type(current_user_id)}")
-            return jsonify({"message": "ID пользователя должен быть строкой"}), 400
-            
-        # Проверяем, что строка представляет число
-        if not current_user_id.isdigit():
-            logger.error(f"ID пользователя не является числом: {current_user_id}")
-            return jsonify({"message": "ID пользователя должен быть числом"}), 400
-            
-        # Преобразуем в целое число
-        current_user_id = int(current_user_id)
-    except (ValueError, TypeError, AttributeError) as e:
-        logger.error(f"Ошибка при обработке ID пользователя ({current_user_id}): {e}")
-        return jsonify({"message": f"Неверный формат ID пользователя: {e}"}), 400
-        
+    current_user_id = get_current_user_id()
     pet_post = PetPost.query.get_or_404(post_id)
     
     # Check if the user is the owner of the post
@@ -384,28 +624,9 @@ def update_pet_post(post_id):
 
 
 @pets_bp.route('/<int:post_id>', methods=['DELETE'])
-@jwt_required()
+@user_required
 def delete_pet_post(post_id):
-    current_user_id = get_jwt_identity()
-    logger.info(f"Получен JWT identity: {current_user_id}, тип: {type(current_user_id)}")
-    
-    try:
-        # Проверяем, что идентификатор - это строка
-        if not isinstance(current_user_id, str):
-            logger.error(f"ID пользователя не строка: {type(current_user_id)}")
-            return jsonify({"message": "ID пользователя должен быть строкой"}), 400
-            
-        # Проверяем, что строка представляет число
-        if not current_user_id.isdigit():
-            logger.error(f"ID пользователя не является числом: {current_user_id}")
-            return jsonify({"message": "ID пользователя должен быть числом"}), 400
-            
-        # Преобразуем в целое число
-        current_user_id = int(current_user_id)
-    except (ValueError, TypeError, AttributeError) as e:
-        logger.error(f"Ошибка при обработке ID пользователя ({current_user_id}): {e}")
-        return jsonify({"message": f"Неверный формат ID пользователя: {e}"}), 400
-        
+    current_user_id = get_current_user_id()
     pet_post = PetPost.query.get_or_404(post_id)
     
     # Check if the user is the owner of the post
@@ -421,30 +642,35 @@ def delete_pet_post(post_id):
 
 
 @pets_bp.route('/user', methods=['GET'])
-@jwt_required()
+@user_required
 def get_user_pet_posts():
-    current_user_id = get_jwt_identity()
-    logger.info(f"Получен JWT identity: {current_user_id}, тип: {type(current_user_id)}")
-    
-    try:
-        # Проверяем, что идентификатор - это строка
-        if not isinstance(current_user_id, str):
-            logger.error(f"ID пользователя не строка: {type(current_user_id)}")
-            return jsonify({"message": "ID пользователя должен быть строкой"}), 400
-            
-        # Проверяем, что строка представляет число
-        if not current_user_id.isdigit():
-            logger.error(f"ID пользователя не является числом: {current_user_id}")
-            return jsonify({"message": "ID пользователя должен быть числом"}), 400
-            
-        # Преобразуем в целое число
-        current_user_id = int(current_user_id)
-    except (ValueError, TypeError, AttributeError) as e:
-        logger.error(f"Ошибка при обработке ID пользователя ({current_user_id}): {e}")
-        return jsonify({"message": f"Неверный формат ID пользователя: {e}"}), 400
-        
-    pet_posts = PetPost.query.filter_by(user_id=current_user_id).order_by(PetPost.created_at.desc()).all()
-    
-    return jsonify({
-        'pet_posts': [post.to_dict() for post in pet_posts]
-    }), 200 
\ No newline at end of file
+    current_user_id = get_current_user_id()
+    return list_pet_posts(PetPost.query.filter_by(user_id=current_user_id)) 
+
+@pets_bp.route('/import', methods=['POST'])
+@user_required
+def import_pet_posts():
+    # Raw CSV or NDJSON body (Content-Type or ?format=), read as a stream
+    fmt = request.args.get('format') or guess_format(mimetype=request.mimetype)
+    if fmt not in BULK_FORMATS:
+        return jsonify({'message': f"format must be one of: {', '.join(BULK_FORMATS)}"}), 415
+    result = bulk_import(
+        read_records(request.stream, fmt),
+        user_id=get_current_user_id(),
+        dry_run=request.args.get('dry_run') in ('1', 'true')
+    )
+    return jsonify(result.to_dict()), 200
+
+
+@pets_bp.route('/export', methods=['GET'])
+@user_required
+@use_replica
+def export_pet_posts():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in BULK_FORMATS:
+        return jsonify({'message': f"format must be one of: {', '.join(BULK_FORMATS)}"}), 400
+    query = export_query(request.args.get('pet_type'), request.args.get('status'))
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(bulk_export(query, fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=pet_posts.{fmt}'
+    return response
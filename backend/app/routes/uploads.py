@@ -0,0 +1,58 @@
+import os
+import re
+
+from flask import Blueprint, Response, abort, current_app, send_file
+from werkzeug.security import safe_join
+
+from app.services.uploads import INCOMING_DIR
+
+uploads_bp = Blueprint('uploads', __name__)
+
+# Content-addressed names never change content: "ab/<sha256>.png", "ab/<sha256>_thumb.webp"
+_IMMUTABLE_RE = re.compile(r'^[0-9a-f]{2}/([0-9a-f]{64}(?:_[a-z]+)?)\.([a-z0-9]+)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_MIMETYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp'
+}
+
+
+@uploads_bp.route('/static/uploads/<path:filename>', methods=['GET', 'HEAD'])
+def serve_upload(filename):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = safe_join(upload_folder, filename)
+    if path is None or filename.split('/', 1)[0] == INCOMING_DIR or not os.path.isfile(path):
+        abort(404)
+
+    extension = filename.rsplit('.', 1)[-1].lower()
+    match = _IMMUTABLE_RE.match(filename)
+    etag = f"{match.group(1)}-{match.group(2)}" if match else None
+    max_age = IMMUTABLE_MAX_AGE if match else current_app.config['UPLOADS_LEGACY_MAX_AGE']
+
+    # Behind nginx, hand the transfer to the proxy (internal location) entirely
+    accel_prefix = current_app.config['UPLOADS_ACCEL_REDIRECT_PREFIX']
+    if accel_prefix:
+        response = Response(mimetype=_MIMETYPES.get(extension, 'application/octet-stream'))
+        response.headers['X-Accel-Redirect'] = accel_prefix + filename
+    else:
+        # send_file answers If-None-Match/Range itself and streams through
+        # wsgi.file_wrapper, which gunicorn implements with sendfile()
+        response = send_file(
+            path,
+            mimetype=_MIMETYPES.get(extension),
+            conditional=True,
+            etag=etag if etag else True,
+            max_age=max_age
+        )
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if match:
+        response.cache_control.immutable = True
+        response.set_etag(etag)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
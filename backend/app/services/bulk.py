@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+import logging
+
+from flask import current_app
+
+from app import db
+from app.models.pet_post import PetPost, post_columns, post_serializer
+from app.models.user import User
+from app.services.pet_data import build_pet_data, parse_date, valid_image_url, validate_pet_data
+
+logger = logging.getLogger(__name__)
+
+# Bulk import/export of pet posts as CSV or NDJSON. Exports carry every stored
+# column, so a backup can be imported again as is.
+BULK_FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = (
+    'id', 'title', 'description', 'pet_type', 'status', 'image_url', 'last_seen_address',
+    'last_seen_date', 'latitude', 'longitude', 'created_at', 'user_id'
+)
+
+
+class BulkFormatError(ValueError):
+    pass
+
+
+def guess_format(name=None, mimetype=None):
+    if mimetype in ('text/csv', 'application/csv'):
+        return 'csv'
+    if mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        return 'ndjson'
+    if name and name.lower().endswith('.csv'):
+        return 'csv'
+    if name and name.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def read_records(stream, fmt):
+    """Yield (row number, record or None, error or None) from a binary stream."""
+    if fmt not in BULK_FORMATS:
+        raise BulkFormatError(f"format must be one of: {', '.join(BULK_FORMATS)}")
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    try:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(text), start=1):
+                # Empty cells mean "not given", like absent form fields
+                yield number, {k: v for k, v in row.items() if k and v not in ('', None)}, None
+            return
+
+        number = 0
+        for line in text:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield number, None, "each line must be a JSON object"
+                continue
+            yield number, {k: v for k, v in record.items() if v not in ('', None)}, None
+    except UnicodeDecodeError:
+        yield None, None, "input is not valid UTF-8"
+    finally:
+        text.detach()
+
+
+class ImportResult:
+    def __init__(self, max_errors):
+        self.created = 0
+        self.failed = 0
+        self.errors = []  # first max_errors failures: {'row': n, 'errors': [...]}
+        self.max_errors = max_errors
+
+    def fail(self, row, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def to_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+
+def _prepare(record, user_id, known_users):
+    """PetPost for one record, or a list of error messages."""
+    errors = validate_pet_data(record)
+    image_url = record.get('image_url')
+    if image_url is not None and not (isinstance(image_url, str) and valid_image_url(image_url)):
+        errors.append("image_url must be an http(s) URL or an uploaded image path")
+    if user_id is None:
+        # Restoring a backup: keep the owner, which has to exist
+        try:
+            owner = int(record['user_id'])
+        except (KeyError, TypeError, ValueError):
+            errors.append("user_id is required")
+        else:
+            if owner not in known_users:
+                if db.session.get(User, owner) is None:
+                    errors.append(f"user {owner} does not exist")
+                else:
+                    known_users.add(owner)
+    else:
+        owner = user_id
+    if errors:
+        return errors
+
+    try:
+        pet_post = PetPost(**build_pet_data(record, owner, image_url))
+        # Only a restore keeps the original dates; imported posts are new, or a
+        # future created_at would pin them to the top of the feed
+        if user_id is None and 'created_at' in record:
+            pet_post.created_at = parse_date(record['created_at'])
+    except (TypeError, ValueError) as e:
+        return [str(e)]
+    return pet_post
+
+
+def _commit_chunk(chunk, result):
+    db.session.add_all([pet_post for _, pet_post in chunk])
+    try:
+        db.session.commit()
+        result.created += len(chunk)
+        return
+    except Exception:
+        db.session.rollback()
+        logger.warning("Bulk import chunk failed, retrying its %d rows one by one", len(chunk), exc_info=True)
+
+    # Isolate the bad rows so the rest of the chunk still goes in
+    for row, pet_post in chunk:
+        db.session.add(pet_post)
+        try:
+            db.session.commit()
+            result.created += 1
+        except Exception as e:
+            db.session.rollback()
+            result.fail(row, [f"Database error: {e.__class__.__name__}"])
+
+
+def import_pet_posts(records, user_id=None, chunk_size=None, max_errors=None, dry_run=False):
+    """Validate and insert records from read_records().
+
+    Rows are inserted chunk_size at a time, each chunk in one transaction, so
+    the usual commit hooks (clusters, search index, caches) run once per chunk.
+    Posts belong to user_id and are dated now. With user_id None (restoring a
+    backup) each record keeps its user_id and created_at.
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config['BULK_IMPORT_CHUNK_SIZE']
+    result = ImportResult(max_errors if max_errors is not None else config['BULK_IMPORT_MAX_ERRORS'])
+    known_users = set()
+    chunk = []
+    for row, record, error in records:
+        if error:
+            result.fail(row, [error])
+            continue
+        prepared = _prepare(record, user_id, known_users)
+        if isinstance(prepared, list):
+            result.fail(row, prepared)
+            continue
+        if dry_run:
+            result.created += 1
+            continue
+        chunk.append((row, prepared))
+        if len(chunk) >= chunk_size:
+            _commit_chunk(chunk, result)
+            chunk = []
+    if chunk:
+        _commit_chunk(chunk, result)
+    logger.info("Bulk import: %d created, %d failed", result.created, result.failed)
+    return result
+
+
+def export_query(pet_type=None, status=None):
+    query = PetPost.query.with_entities(*post_columns(EXPORT_FIELDS)).order_by(PetPost.id)
+    if pet_type:
+        query = query.filter_by(pet_type=pet_type)
+    if status:
+        query = query.filter_by(status=status)
+    return query
+
+
+def export_pet_posts(query, fmt, batch_size=None):
+    """Yield the export as text chunks, one per batch of rows."""
+    if fmt not in BULK_FORMATS:
+        raise BulkFormatError(f"format must be one of: {', '.join(BULK_FORMATS)}")
+    batch_size = batch_size or current_app.config['PETS_STREAM_BATCH_SIZE']
+    serialize = post_serializer(EXPORT_FIELDS)
+    dumps = current_app.json.dumps
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+
+    count = 0
+    for row in query.yield_per(batch_size):
+        if writer:
+            writer.writerow(serialize(row))
+        else:
+            buffer.write(dumps(serialize(row)) + '\n')
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,256 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from app.services import changes
+from app.services.metrics import cache_lookup
+
+# Optional shared tier
+try:
+    import redis
+    redis_available = True
+except ImportError:
+    redis_available = False
+
+
+# Entries are stored together with the versions of their tags at the time the
+# view ran. Invalidating a tag just moves its version on, so every entry that
+# depends on it stops matching - no key scans, and it works the same for the
+# shared tier. Versions are timestamps rather than counters so that a version
+# evicted from the LRU can never come back with an old value.
+def _new_version():
+    return time.time_ns()
+
+
+class LocalCache:
+    """In-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self._lock:
+            versions = []
+            for tag in tags:
+                version = self._versions.get(tag)
+                if version is None:
+                    version = self._versions[tag] = _new_version()
+                else:
+                    self._versions.move_to_end(tag)
+                versions.append(version)
+            while len(self._versions) > self.max_entries * 4:
+                self._versions.popitem(last=False)
+            return versions
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = _new_version()
+                self._versions.move_to_end(tag)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class RedisCache:
+    """Shared tier, so every worker sees the same entries and invalidations."""
+
+    def __init__(self, url, prefix='findmypet:cache:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def get_versions(self, tags):
+        keys = [self.prefix + 'tag:' + tag for tag in tags]
+        versions = self.client.mget(keys)
+        for i, version in enumerate(versions):
+            if version is None:
+                self.client.set(keys[i], _new_version(), nx=True)
+                versions[i] = self.client.get(keys[i])
+        return [int(version) for version in versions]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.set(self.prefix + 'tag:' + tag, _new_version())
+        pipe.execute()
+
+
+class CachedResponse:
+    __slots__ = ('versions', 'body', 'mimetype', 'etag')
+
+    def __init__(self, versions, body, mimetype, etag):
+        self.versions = versions
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = etag
+
+
+class ResponseCache:
+    def __init__(self, ttl, max_entries, redis_url=None):
+        self.ttl = ttl
+        self.local = LocalCache(max_entries)
+        self.shared = RedisCache(redis_url) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(path, args, representation=''):
+        # Parameter order and empty values don't change the response;
+        # the negotiated type does (JSON page vs NDJSON stream)
+        params = sorted((k, v) for k, v in args.items(multi=True) if v != '')
+        return path + '?' + '&'.join(f'{k}={v}' for k, v in params) + '#' + representation
+
+    def _versions(self, tags):
+        # Tag versions come from the shared tier when there is one, so an
+        # invalidation in one worker is seen by all of them
+        return (self.shared or self.local).get_versions(tags)
+
+    def lookup(self, key, tags):
+        versions = self._versions(tags)
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None and entry.versions == versions:
+                self.local.set(key, entry, self.ttl)
+        if entry is not None and entry.versions == versions:
+            self.hits += 1
+            cache_lookup('response', True)
+            return entry, versions
+        self.misses += 1
+        cache_lookup('response', False)
+        return None, versions
+
+    def store(self, key, versions, body, mimetype):
+        entry = CachedResponse(versions, body, mimetype, hashlib.sha1(body).hexdigest())
+        self.local.set(key, entry, self.ttl)
+        if self.shared is not None:
+            self.shared.set(key, entry, self.ttl)
+        return entry
+
+    def invalidate(self, tags):
+        self.local.bump(tags)
+        if self.shared is not None:
+            self.shared.bump(tags)
+
+
+def init_cache(app):
+    redis_url = app.config['CACHE_REDIS_URL']
+    if redis_url and not redis_available:
+        app.logger.warning("CACHE_REDIS_URL is set but redis is not installed; using the local cache only")
+        redis_url = None
+    app.extensions['response_cache'] = ResponseCache(
+        ttl=app.config['CACHE_TTL'],
+        max_entries=app.config['CACHE_MAX_ENTRIES'],
+        redis_url=redis_url
+    )
+
+
+def get_response_cache():
+    return current_app.extensions['response_cache']
+
+
+# Tags: listings depend on their (pet_type, status) filter, details on the post
+def listing_tag(pet_type=None, status=None):
+    return f"list:{pet_type or '*'}:{status or '*'}"
+
+
+def post_tag(post_id):
+    return f"post:{post_id}"
+
+
+def _change_tags(values):
+    pet_type = values.get('pet_type')
+    status = values.get('status')
+    return {
+        listing_tag(pet_type, status),
+        listing_tag(pet_type, None),
+        listing_tag(None, status),
+        listing_tag(None, None)
+    }
+
+
+@changes.on_commit
+def invalidate_responses(post_changes):
+    tags = set()
+    for change in post_changes:
+        tags.add(post_tag(change.post_id))
+        for values in (change.old, change.new):
+            if values:
+                tags.update(_change_tags(values))
+    get_response_cache().invalidate(sorted(tags))
+
+
+# Types a cached view may negotiate through Accept
+REPRESENTATIONS = ('application/json', 'application/x-ndjson')
+
+
+def _vary_accept(response):
+    # Browser and proxy caches must keep the JSON and NDJSON bodies apart
+    response.vary.add('Accept')
+    return response
+
+
+def cached_response(tags):
+    """Cache a public GET view's 200 responses. `tags` maps the view's kwargs to cache tags."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config['CACHE_ENABLED']:
+                return _vary_accept(make_response(view(*args, **kwargs)))
+
+            cache = get_response_cache()
+            best = request.accept_mimetypes.best
+            representation = best if best in REPRESENTATIONS else ''
+            key = cache.make_key(request.path, request.args, representation)
+            entry, versions = cache.lookup(key, tags(**kwargs))
+            if entry is not None:
+                response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+            else:
+                response = _vary_accept(make_response(view(*args, **kwargs)))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                entry = cache.store(key, versions, response.get_data(), response.mimetype)
+
+            _vary_accept(response)
+            response.set_etag(entry.etag)
+            response.cache_control.public = True
+            response.cache_control.no_cache = True  # clients revalidate with If-None-Match
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
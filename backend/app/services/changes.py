@@ -0,0 +1,113 @@
+import logging
+
+from sqlalchemy import event, inspect
+
+from app import db
+from app.models.pet_post import PetPost
+
+# Subsystems that derive data from pet posts (map clusters, caches, ...) register
+# here instead of each wiring its own session events.
+#   on_flush handlers run inside the writing transaction: fn(session, changes)
+#   on_commit handlers run once the transaction is durable: fn(changes)
+_flush_handlers = []
+_commit_handlers = []
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = 'pet_post_changes'
+_DELETED_KEY = 'pet_post_deleted_snapshots'
+
+
+class PostChange:
+    __slots__ = ('kind', 'post_id', 'old', 'new')
+
+    def __init__(self, kind, post_id, old=None, new=None):
+        self.kind = kind  # 'insert', 'update' or 'delete'
+        self.post_id = post_id
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        return f"<PostChange {self.kind} {self.post_id}>"
+
+
+def on_flush(fn):
+    _flush_handlers.append(fn)
+    return fn
+
+
+def on_commit(fn):
+    _commit_handlers.append(fn)
+    return fn
+
+
+def _column_keys():
+    return [attr.key for attr in inspect(PetPost).column_attrs]
+
+
+def _current_values(obj):
+    return {key: getattr(obj, key) for key in _column_keys()}
+
+
+def _previous_values(obj):
+    state = inspect(obj)
+    values = {}
+    for key in _column_keys():
+        history = state.attrs[key].history
+        if history.deleted:
+            values[key] = history.deleted[0]
+        elif history.unchanged:
+            values[key] = history.unchanged[0]
+        else:
+            values[key] = getattr(obj, key)
+    return values
+
+
+@event.listens_for(db.session, 'before_flush')
+def _snapshot_deleted(session, flush_context, instances):
+    # Deleted rows can't be loaded after the flush, so capture them now
+    snapshots = session.info.setdefault(_DELETED_KEY, {})
+    for obj in session.deleted:
+        if isinstance(obj, PetPost):
+            snapshots[id(obj)] = _previous_values(obj)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    snapshots = session.info.pop(_DELETED_KEY, {})
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, PetPost):
+            changes.append(PostChange('insert', obj.id, new=_current_values(obj)))
+    for obj in session.dirty:
+        if isinstance(obj, PetPost) and session.is_modified(obj, include_collections=False):
+            changes.append(PostChange('update', obj.id, old=_previous_values(obj), new=_current_values(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, PetPost):
+            old = snapshots.get(id(obj)) or {'id': obj.id}
+            changes.append(PostChange('delete', old['id'], old=old))
+    if not changes:
+        return
+
+    for handler in _flush_handlers:
+        handler(session, changes)
+    session.info.setdefault(_PENDING_KEY, []).extend(changes)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _dispatch_commit(session):
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    # The data is already committed; a failing subscriber must not fail the request
+    for handler in _commit_handlers:
+        try:
+            handler(changes)
+        except Exception:
+            logger.exception("Post commit handler %s failed", handler.__name__)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_DELETED_KEY, None)
@@ -0,0 +1,189 @@
+from collections import defaultdict
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
+from app import db
+from app.models.map_cluster import MapCluster
+from app.models.pet_post import PetPost
+from app.services import changes
+from app.services.geo import cover_bbox, decode_geohash, encode_geohash
+
+CLUSTER_PRECISIONS = range(1, 8)
+
+# Leaflet zoom level -> geohash precision, so a viewport spans roughly 4-40 cells
+_ZOOM_PRECISION = [
+    (3, 1),
+    (5, 2),
+    (8, 3),
+    (10, 4),
+    (13, 5),
+    (15, 6),
+]
+
+
+def zoom_to_precision(zoom):
+    for max_zoom, precision in _ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return CLUSTER_PRECISIONS[-1]
+
+
+def _contributions(values, sign, deltas):
+    latitude = values.get('latitude')
+    longitude = values.get('longitude')
+    if latitude is None or longitude is None:
+        return
+    geohash = encode_geohash(latitude, longitude, CLUSTER_PRECISIONS[-1])
+    pet_type = values.get('pet_type') or ''
+    status = values.get('status') or ''
+    for precision in CLUSTER_PRECISIONS:
+        delta = deltas[(precision, geohash[:precision], pet_type, status)]
+        delta[0] += sign
+        delta[1] += sign * latitude
+        delta[2] += sign * longitude
+
+
+def _upsert_statement(connection, table, values):
+    # One statement, so concurrent first posts in a cell can't both INSERT;
+    # None on databases without an upsert
+    dialect = connection.dialect.name
+    increments = {name: table.c[name] + values[name] for name in ('count', 'latitude_sum', 'longitude_sum')}
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(table).values(values).on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key], set_=increments)
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        return dialect_insert(table).values(values).on_duplicate_key_update(**increments)
+    return None
+
+
+def _apply_deltas(connection, deltas):
+    table = MapCluster.__table__
+    for (precision, cell, pet_type, status), (count, lat_sum, lon_sum) in deltas.items():
+        if count == 0 and lat_sum == 0 and lon_sum == 0:
+            continue
+        values = dict(precision=precision, cell=cell, pet_type=pet_type, status=status,
+                      count=count, latitude_sum=lat_sum, longitude_sum=lon_sum)
+        upsert = _upsert_statement(connection, table, values) if count > 0 else None
+        if upsert is not None:
+            connection.execute(upsert)
+            continue
+        key = and_(
+            table.c.precision == precision,
+            table.c.cell == cell,
+            table.c.pet_type == pet_type,
+            table.c.status == status
+        )
+        result = connection.execute(update(table).where(key).values(
+            count=table.c.count + count,
+            latitude_sum=table.c.latitude_sum + lat_sum,
+            longitude_sum=table.c.longitude_sum + lon_sum
+        ))
+        if result.rowcount == 0 and count > 0:
+            connection.execute(insert(table).values(values))
+        elif count < 0:
+            connection.execute(delete(table).where(key, table.c.count <= 0))
+
+
+# Cluster aggregates are written in the same transaction as the post itself
+@changes.on_flush
+def update_clusters(session, post_changes):
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for change in post_changes:
+        if change.old is not None:
+            _contributions(change.old, -1, deltas)
+        if change.new is not None:
+            _contributions(change.new, 1, deltas)
+    if deltas:
+        _apply_deltas(session.connection(), deltas)
+
+
+# Recompute every aggregate from pet_posts (first start, or after bulk edits)
+def rebuild_clusters():
+    table = MapCluster.__table__
+    db.session.execute(delete(table))
+    for precision in CLUSTER_PRECISIONS:
+        cell = func.substr(PetPost.geohash, 1, precision)
+        rows = db.session.execute(
+            select(
+                cell,
+                func.coalesce(PetPost.pet_type, ''),
+                func.coalesce(PetPost.status, ''),
+                func.count(),
+                func.sum(PetPost.latitude),
+                func.sum(PetPost.longitude)
+            ).where(PetPost.geohash.isnot(None)).group_by(cell, PetPost.pet_type, PetPost.status)
+        ).all()
+        if rows:
+            db.session.execute(insert(table), [
+                {
+                    'precision': precision, 'cell': row[0], 'pet_type': row[1], 'status': row[2],
+                    'count': row[3], 'latitude_sum': row[4], 'longitude_sum': row[5]
+                }
+                for row in rows
+            ])
+    db.session.commit()
+
+
+def clusters_need_rebuild():
+    has_clusters = db.session.query(MapCluster.query.exists()).scalar()
+    if has_clusters:
+        return False
+    return db.session.query(PetPost.query.filter(PetPost.geohash.isnot(None)).exists()).scalar()
+
+
+def get_clusters(south, west, north, east, zoom, pet_type=None, status=None, max_cells=16):
+    precision = zoom_to_precision(zoom)
+    prefixes = sorted({cell[:precision] for cell in cover_bbox(south, west, north, east, max_cells)})
+
+    query = MapCluster.query.filter(
+        MapCluster.precision == precision,
+        or_(*[and_(MapCluster.cell >= prefix, MapCluster.cell < prefix + '~') for prefix in prefixes])
+    )
+    if pet_type:
+        query = query.filter(MapCluster.pet_type == pet_type)
+    if status:
+        query = query.filter(MapCluster.status == status)
+
+    cells = {}
+    for row in query:
+        cluster = cells.get(row.cell)
+        if cluster is None:
+            cluster = cells[row.cell] = {
+                'geohash': row.cell,
+                'count': 0,
+                'latitude_sum': 0.0,
+                'longitude_sum': 0.0,
+                'pet_types': defaultdict(int),
+                'statuses': defaultdict(int)
+            }
+        cluster['count'] += row.count
+        cluster['latitude_sum'] += row.latitude_sum
+        cluster['longitude_sum'] += row.longitude_sum
+        cluster['pet_types'][row.pet_type] += row.count
+        cluster['statuses'][row.status] += row.count
+
+    results = []
+    for cluster in cells.values():
+        count = cluster['count']
+        if count <= 0:
+            continue
+        cell_south, cell_west, cell_north, cell_east = decode_geohash(cluster['geohash'])
+        # Prefix ranges over-cover the viewport; drop cells that don't touch it
+        if cell_north < south or cell_south > north or cell_east < west or cell_west > east:
+            continue
+        results.append({
+            'geohash': cluster['geohash'],
+            'count': count,
+            'latitude': cluster.pop('latitude_sum') / count,
+            'longitude': cluster.pop('longitude_sum') / count,
+            'bounds': [cell_south, cell_west, cell_north, cell_east],
+            'pet_types': dict(cluster['pet_types']),
+            'statuses': dict(cluster['statuses'])
+        })
+    results.sort(key=lambda c: c['count'], reverse=True)
+    return precision, results
@@ -0,0 +1,250 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from alembic import command
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask import current_app
+from sqlalchemy import event, func, inspect
+
+from app import db
+from app.services.replica import REPLICA_BIND
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'migrations')
+
+# Revision matching the schema db.create_all() produced before migrations existed
+BASELINE_REVISION = '3f1c2a9d0b11'
+
+
+def engine_options(uri, config):
+    """Pool settings for server databases; SQLite is tuned with PRAGMAs instead."""
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_engines(app):
+    """Fill in engine options and the replica bind before db.init_app."""
+    config = app.config
+    options = engine_options(config['SQLALCHEMY_DATABASE_URI'], config)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    replica_uri = config.get('SQLALCHEMY_REPLICA_URI')
+    if replica_uri:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_uri, **engine_options(replica_uri, config)}
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def _sqlite_pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def init_engines(app):
+    """Apply SQLITE_PRAGMAS to every new connection of the SQLite engines."""
+    pragmas = app.config['SQLITE_PRAGMAS']
+    if not pragmas:
+        return
+    listener = _sqlite_pragma_listener(pragmas)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', listener)
+
+
+def _alembic_config():
+    config = current_app.extensions['migrate'].migrate.get_config()
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def upgrade_database():
+    """Bring the schema to the latest migration (`flask db upgrade` equivalent)."""
+    config = _alembic_config()
+    tables = inspect(db.engine).get_table_names()
+    if 'alembic_version' not in tables and 'pet_posts' in tables:
+        # Database created by db.create_all(): adopt it at the baseline
+        logger.info("Stamping unversioned database at %s", BASELINE_REVISION)
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, 'head')
+
+
+def schema_is_current():
+    """True when the database is at the latest migration revision."""
+    heads = set(ScriptDirectory.from_config(_alembic_config()).get_heads())
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current == heads
+
+
+def listing_queries():
+    """The pet post listing queries as get_pet_posts/get_user_pet_posts build them.
+
+    Yields (name, query, seek): seek is the index range the plan must use,
+    e.g. 'created_at<' for a page after a cursor, or None.
+    """
+    from app.models.pet_post import PetPost
+    from app.services.geo import bbox_filter, radius_bbox
+    from app.services.pagination import apply_keyset, keyset_cursor
+
+    cursor = keyset_cursor(datetime(2024, 1, 1), 1)
+    filters = (
+        ('all', {}),
+        ('pet_type', {'pet_type': 'dog'}),
+        ('status', {'status': 'missing'}),
+        ('pet_type + status', {'pet_type': 'dog', 'status': 'missing'}),
+        ('user_id', {'user_id': 1}),
+    )
+    for name, criteria in filters:
+        query = PetPost.query.filter_by(**criteria)
+        yield name, apply_keyset(query, PetPost, None).limit(51), None
+        yield name + ', after cursor', apply_keyset(query, PetPost, cursor).limit(51), 'created_at<'
+
+    # Radius search candidates: geohash cell ranges, no ordering
+    max_cells = current_app.config['GEO_MAX_CELLS']
+    boxes = radius_bbox(55.75, 37.62, 5)
+    yield 'radius candidates', PetPost.query.filter(bbox_filter(PetPost, boxes, max_cells)) \
+        .with_entities(PetPost.id, PetPost.latitude, PetPost.longitude) \
+        .limit(current_app.config['GEO_MAX_CANDIDATES']), 'geohash>'
+
+
+def check_listing_plans():
+    """EXPLAIN each listing query; returns [(name, plan steps, problems)].
+
+    A query is flagged when SQLite scans pet_posts without an index, sorts
+    through a temporary B-tree instead of reading rows in index order, or
+    doesn't seek the index range it is expected to (the index is then read
+    from the start and the cost grows with the cursor depth).
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan check is only implemented for SQLite')
+
+    results = []
+    with db.engine.connect() as connection:
+        for name, query, seek in listing_queries():
+            compiled = query.statement.compile(dialect=db.engine.dialect)
+            params = compiled.construct_params()
+            rows = connection.exec_driver_sql(
+                'EXPLAIN QUERY PLAN ' + str(compiled),
+                tuple(params[key] for key in compiled.positiontup)
+            ).all()
+            plan = [row[-1] for row in rows]
+            problems = [step for step in plan
+                        if step == 'SCAN pet_posts' or 'TEMP B-TREE' in step]
+            if seek and not any(seek in step for step in plan):
+                problems.append(f'no {seek} index range')
+            results.append((name, plan, problems))
+    return results
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed on any engine inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+
+@contextmanager
+def scratch_app(**config):
+    """An app context on an empty, fully migrated SQLite database in a temporary
+    directory, for checks that need their own rows. Everything is removed afterwards."""
+    from app import create_app
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'check.db'),
+            'SQLALCHEMY_REPLICA_URI': None,
+            'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+            'DB_AUTO_MIGRATE': True,
+            'JOBS_EAGER': False,
+            **config,
+        })
+        with app.app_context():
+            try:
+                yield app
+            finally:
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
+
+
+def _seed_posts(count):
+    # One author with count posts, enough for the biggest page
+    from app.models.pet_post import PetPost
+    from app.models.user import User
+    user = User('query-check', 'query-check@example.com', os.urandom(16).hex())
+    db.session.add(user)
+    db.session.flush()
+    now = datetime.utcnow()
+    db.session.add_all(
+        PetPost(f'Check post {i}', 'Seeded by check-queries', 'dog', 'Check street 1', now, user.id)
+        for i in range(count)
+    )
+    db.session.commit()
+    return user.id, db.session.query(func.max(PetPost.id)).scalar()
+
+
+def check_query_counts(sizes=(1, 50)):
+    """Request the ?include=author listings at each page size; returns [(name, [(rows, statements)])].
+
+    Embedding authors must cost a constant number of statements, so the
+    counts are expected to be equal for every size. The requests go to a
+    scratch database seeded with max(sizes) posts, so any database works.
+    """
+    from flask_jwt_extended import create_access_token
+
+    # Cached responses would hide the queries
+    with scratch_app(CACHE_ENABLED=False) as app:
+        user_id, post_id = _seed_posts(max(sizes))
+        headers = {'Authorization': 'Bearer ' + create_access_token(identity=str(user_id))}
+        urls = (
+            ('feed', '/api/pets/?include=author&limit={size}', {}),
+            ('feed from SQL', '/api/pets/?include=author&consistency=strong&limit={size}', {}),
+            ('NDJSON', '/api/pets/?include=author&format=ndjson&limit={size}', {}),
+            ('user posts', '/api/pets/user?include=author&limit={size}', headers),
+            ('detail', f'/api/pets/{post_id}?include=author', {}),
+        )
+        results = []
+        client = app.test_client()
+        for name, url, request_headers in urls:
+            client.get(url.format(size=1), headers=request_headers)  # warm up the feed index and user cache
+            counts = []
+            for size in sizes:
+                with count_queries() as statements:
+                    response = client.get(url.format(size=size), headers=request_headers)
+                    body = response.get_data(as_text=True)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{url.format(size=size)} returned {response.status_code}: {body[:200]}')
+                rows = body.count('\n') if 'ndjson' in url else len(response.get_json().get('pet_posts', [None]))
+                counts.append((rows, len(statements)))
+            results.append((name, counts))
+    return results
@@ -0,0 +1,206 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from flask import current_app
+
+from app.models.pet_post import PetPost
+from app.services import changes
+
+logger = logging.getLogger(__name__)
+
+# In-process read model for the plain listing (pet_type/status filters, newest
+# first). Records are kept per (status, pet_type) bucket, sorted by the keyset
+# (created_at, id), so a page is a bisect plus a merge of at most a few buckets.
+# Commits in this process are applied right away; writes from other workers
+# show up when the index is rebuilt, in the background, after FEED_INDEX_MAX_AGE
+# seconds. Requests never wait for a rebuild.
+
+# Every column the default payload is built from
+FEED_COLUMNS = (
+    'id', 'title', 'description', 'pet_type', 'status', 'image_url', 'last_seen_address',
+    'last_seen_date', 'latitude', 'longitude', 'created_at', 'user_id', 'image_variants_ready'
+)
+
+
+class FeedRecord:
+    __slots__ = FEED_COLUMNS + ('sort_key',)
+
+    def __init__(self, values):
+        for name in FEED_COLUMNS:
+            setattr(self, name, values.get(name))
+        self.sort_key = (self.created_at or datetime.min, self.id)
+
+
+class _Bucket:
+    __slots__ = ('keys', 'records')
+
+    def __init__(self):
+        self.keys = []  # ascending sort keys, parallel to records
+        self.records = []
+
+    def add(self, record):
+        i = bisect_left(self.keys, record.sort_key)
+        self.keys.insert(i, record.sort_key)
+        self.records.insert(i, record)
+
+    def remove(self, record):
+        i = bisect_left(self.keys, record.sort_key)
+        if i < len(self.keys) and self.records[i] is record:
+            del self.keys[i]
+            del self.records[i]
+
+    def newest_before(self, key):
+        # Records strictly older than key (all of them for None), newest first
+        end = len(self.keys) if key is None else bisect_left(self.keys, key)
+        records = self.records
+        for i in range(end - 1, -1, -1):
+            yield records[i]
+
+
+class FeedIndex:
+    def __init__(self, max_posts):
+        self.max_posts = max_posts
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._records = {}
+        self._cutoff = None  # sort key of the oldest record kept, when truncated
+        self._built_at = None
+        self._pending = None  # changes seen while a rebuild is loading
+        self._refreshing = False  # a background rebuild is running
+
+    @property
+    def ready(self):
+        return self._built_at is not None
+
+    def age(self):
+        return time.monotonic() - self._built_at if self._built_at is not None else None
+
+    def rebuild(self):
+        """Reload from pet_posts; concurrent callers return immediately."""
+        with self._lock:
+            if self._pending is not None:
+                return False
+            self._pending = []
+        try:
+            columns = [getattr(PetPost, name) for name in FEED_COLUMNS]
+            query = PetPost.query.with_entities(*columns) \
+                .order_by(PetPost.created_at.desc(), PetPost.id.desc())
+            rows = query.limit(self.max_posts + 1).all() if self.max_posts else query.all()
+            truncated = bool(self.max_posts) and len(rows) > self.max_posts
+            if truncated:
+                rows = rows[:self.max_posts]
+            records = [FeedRecord(row._mapping) for row in rows]
+
+            buckets = {}
+            for record in reversed(records):
+                bucket = buckets.get((record.status, record.pet_type))
+                if bucket is None:
+                    bucket = buckets[(record.status, record.pet_type)] = _Bucket()
+                bucket.keys.append(record.sort_key)
+                bucket.records.append(record)
+
+            with self._lock:
+                self._buckets = buckets
+                self._records = {record.id: record for record in records}
+                self._cutoff = records[-1].sort_key if truncated and records else None
+                # Commits that landed while loading may or may not be in rows;
+                # replaying them is idempotent
+                for change in self._pending:
+                    self._apply(change)
+                self._built_at = time.monotonic()
+            logger.debug("Feed index rebuilt with %d posts", len(records))
+            return True
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def refresh(self, app):
+        """Rebuild in a background thread while the current records keep serving."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception:
+                logger.exception("Feed index rebuild failed")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+        threading.Thread(target=run, name='feed-index-rebuild', daemon=True).start()
+
+    def apply(self, post_changes):
+        with self._lock:
+            for change in post_changes:
+                self._apply(change)
+                if self._pending is not None:
+                    self._pending.append(change)
+
+    def _apply(self, change):
+        record = self._records.pop(change.post_id, None)
+        if record is not None:
+            self._buckets[(record.status, record.pet_type)].remove(record)
+        if change.kind == 'delete':
+            return
+        record = FeedRecord(change.new)
+        if self._cutoff is not None and record.sort_key < self._cutoff:
+            return  # older than anything kept; SQL serves that range
+        self._records[record.id] = record
+        bucket = self._buckets.get((record.status, record.pet_type))
+        if bucket is None:
+            bucket = self._buckets[(record.status, record.pet_type)] = _Bucket()
+        bucket.add(record)
+
+    def page(self, pet_type, status, after, limit):
+        """Up to limit + 1 records older than the `after` sort key, newest first.
+
+        Returns None when the index can't answer exactly (the page runs past
+        a truncated index), in which case the caller falls back to SQL.
+        """
+        with self._lock:
+            sources = [bucket.newest_before(after) for (bucket_status, bucket_type), bucket in self._buckets.items()
+                       if (not status or bucket_status == status) and (not pet_type or bucket_type == pet_type)]
+            merged = heapq.merge(*sources, key=lambda record: record.sort_key, reverse=True)
+            records = []
+            for record in merged:
+                records.append(record)
+                if len(records) > limit:
+                    break
+            if len(records) <= limit and self._cutoff is not None:
+                return None
+            return records
+
+
+def init_feed_index(app):
+    if not app.config['FEED_INDEX_ENABLED']:
+        return
+    index = FeedIndex(app.config['FEED_INDEX_MAX_POSTS'])
+    app.extensions['feed_index'] = index
+    index.rebuild()
+
+
+def get_feed_index():
+    """The feed index if enabled and built. Once it is older than FEED_INDEX_MAX_AGE
+    a background rebuild starts and the stale one keeps serving until it is done;
+    commits in this process are applied to it right away either way."""
+    index = current_app.extensions.get('feed_index')
+    if index is None:
+        return None
+    max_age = current_app.config['FEED_INDEX_MAX_AGE']
+    if not index.ready or (max_age and index.age() > max_age):
+        index.refresh(current_app._get_current_object())
+    return index if index.ready else None
+
+
+@changes.on_commit
+def update_feed_index(post_changes):
+    index = current_app.extensions.get('feed_index')
+    if index is not None:
+        index.apply(post_changes)
@@ -0,0 +1,178 @@
+import math
+
+from sqlalchemy import and_, or_
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+GEOHASH_PRECISION = 12
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Sorts after every geohash character, so [prefix, prefix + '~') is a prefix range
+_RANGE_END = '~'
+
+
+class GeoQueryError(ValueError):
+    pass
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[ch])
+            bits = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def decode_geohash(geohash):
+    # Returns the cell as (south, west, north, east)
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in geohash:
+        value = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def cell_size(precision):
+    # (height, width) in degrees of a geohash cell
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _frange(start, stop, step):
+    value = start
+    while value < stop:
+        yield value
+        value += step
+    yield stop
+
+
+def cover_bbox(south, west, north, east, max_cells=16):
+    # Smallest set of equal-precision geohash cells covering the box
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = math.floor((north - south) / height) + 2
+        cols = math.floor((east - west) / width) + 2
+        if rows * cols <= max_cells:
+            break
+    cells = set()
+    for lat in _frange(south, north, height):
+        for lon in _frange(west, east, width):
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def parse_bbox(value):
+    # Leaflet's toBBoxString() order: west,south,east,north
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        raise GeoQueryError('bbox must be west,south,east,north')
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise GeoQueryError('bbox is out of range')
+    return south, west, north, east
+
+
+def parse_point(value):
+    try:
+        latitude, longitude = (float(part) for part in value.split(','))
+    except ValueError:
+        raise GeoQueryError('near must be lat,lon')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise GeoQueryError('near is out of range')
+    return latitude, longitude
+
+
+def parse_geohash_prefix(value):
+    prefix = value.strip().lower()
+    if not 0 < len(prefix) <= GEOHASH_PRECISION or any(c not in _BASE32 for c in prefix):
+        raise GeoQueryError('geohash must be 1-12 geohash characters')
+    return prefix
+
+
+def split_antimeridian(south, west, north, east):
+    if west <= east:
+        return [(south, west, north, east)]
+    return [(south, west, north, 180.0), (south, -180.0, north, east)]
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    south = max(latitude - dlat, -90.0)
+    north = min(latitude + dlat, 90.0)
+    cos_lat = math.cos(math.radians(latitude))
+    if north >= 90.0 or south <= -90.0 or cos_lat < 1e-6:
+        return [(south, -180.0, north, 180.0)]
+    dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    if dlon >= 180.0:
+        return [(south, -180.0, north, 180.0)]
+    west = longitude - dlon
+    east = longitude + dlon
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return split_antimeridian(south, west, north, east)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# SQL filter restricting a model to the boxes, driven by the geohash index
+def bbox_filter(model, boxes, max_cells=16):
+    clauses = []
+    for south, west, north, east in boxes:
+        cells = cover_bbox(south, west, north, east, max_cells)
+        clauses.append(and_(
+            or_(*[and_(model.geohash >= cell, model.geohash < cell + _RANGE_END) for cell in cells]),
+            model.latitude.between(south, north),
+            model.longitude.between(west, east)
+        ))
+    return or_(*clauses)
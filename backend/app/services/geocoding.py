@@ -0,0 +1,295 @@
+import csv
+import logging
+import math
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from flask import current_app
+from werkzeug.utils import import_string
+
+from app.services.cache import LocalCache
+from app.services.geo import EARTH_RADIUS_KM
+from app.services.metrics import cache_lookup
+from app.services.search import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Offline geocoding: address -> coordinates and back, from a local gazetteer
+# file instead of a web service. Geocoder puts an LRU cache in front of a
+# provider; GazetteerProvider is the built-in one, another backend only needs
+# geocode() and reverse() (GEOCODING_PROVIDER = 'package.module:Class').
+
+Place = namedtuple('Place', 'name latitude longitude')
+
+# Street type words, so "ул. Ленина 5" and "Ленина улица" find the same entry
+_STOPWORDS = frozenset((
+    'ул', 'улица', 'пр', 'проспект', 'пер', 'переулок', 'бул', 'бульвар', 'ш', 'шоссе',
+    'пл', 'площадь', 'наб', 'набережная', 'мкр', 'микрорайон', 'д', 'дом', 'г', 'город',
+    'st', 'street', 'ave', 'avenue', 'rd', 'road', 'blvd', 'boulevard', 'ln', 'lane', 'sq', 'square',
+))
+_MAX_QUERY_TOKENS = 6
+
+
+def normalize(address):
+    """Lowercase words of an address without punctuation and street type words."""
+    tokens = tokenize((address or '').replace('ё', 'е').replace('Ё', 'Е'))
+    return ' '.join(token for token in tokens if token not in _STOPWORDS)
+
+
+class GeocodingProvider:
+    def geocode(self, address):
+        """Best Place for a free-form address, or None."""
+        raise NotImplementedError
+
+    def reverse(self, latitude, longitude, max_km):
+        """Nearest Place within max_km, or None."""
+        raise NotImplementedError
+
+
+# Gazetteer file layout (little-endian):
+#   header
+#   index: one entry per name, sorted by normalized key (binary searched in place)
+#   tree: the points as unit vectors, laid out as an implicit k-d tree
+#   strings: UTF-8 keys and display names
+_MAGIC = b'FMPGAZ01'
+_HEADER = struct.Struct('<8sIQQQ')  # magic, count, index, tree and strings offsets
+_ENTRY = struct.Struct('<IHIHdd')  # key offset/length, name offset/length, latitude, longitude
+_NODE = struct.Struct('<dddI')  # x, y, z, index entry
+
+
+def _unit_vector(latitude, longitude):
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat)
+
+
+def _chord(km):
+    # Straight-line distance through the unit sphere for a great-circle distance
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class GazetteerProvider(GeocodingProvider):
+    """Read-only view of a gazetteer file built by `flask pets build-gazetteer`.
+
+    The file is memory-mapped, so gunicorn workers share one copy through the
+    page cache and only the pages a lookup touches are read.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._index, self._tree, self._strings = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a gazetteer file")
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._mm, self._index + i * _ENTRY.size)
+
+    def _key(self, i):
+        key_offset, key_length = _ENTRY.unpack_from(self._mm, self._index + i * _ENTRY.size)[:2]
+        start = self._strings + key_offset
+        return self._mm[start:start + key_length]
+
+    def _place(self, i):
+        _, _, name_offset, name_length, latitude, longitude = self._entry(i)
+        start = self._strings + name_offset
+        return Place(self._mm[start:start + name_length].decode(), latitude, longitude)
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, key):
+        """Entry whose key equals key, else the first one starting with key + ' '."""
+        encoded = key.encode()
+        i = self._lower_bound(encoded)
+        if i < self.count and self._key(i) == encoded:
+            return i
+        i = self._lower_bound(encoded + b' ')
+        if i < self.count and self._key(i).startswith(encoded + b' '):
+            return i
+        return None
+
+    def geocode(self, address):
+        tokens = normalize(address).split()[:_MAX_QUERY_TOKENS]
+        # Longest run of words that names a place: "москва тверская 7" -> "тверская"
+        for length in range(len(tokens), 0, -1):
+            for start in range(len(tokens) - length + 1):
+                words = tokens[start:start + length]
+                if all(word.isdigit() for word in words):
+                    continue  # house numbers alone name nothing
+                i = self.lookup(' '.join(words))
+                if i is not None:
+                    return self._place(i)
+        return None
+
+    def reverse(self, latitude, longitude, max_km):
+        if not self.count:
+            return None
+        target = _unit_vector(latitude, longitude)
+        best_distance = _chord(max_km) ** 2
+        best = None
+        mm, tree, size = self._mm, self._tree, _NODE.size
+        # (lo, hi, axis, squared distance from target to the splitting plane)
+        stack = [(0, self.count, 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            if lo >= hi or bound >= best_distance:
+                continue
+            mid = (lo + hi) // 2
+            node = _NODE.unpack_from(mm, tree + mid * size)
+            distance = ((node[0] - target[0]) ** 2 + (node[1] - target[1]) ** 2
+                        + (node[2] - target[2]) ** 2)
+            if distance < best_distance:
+                best_distance, best = distance, node[3]
+            diff = target[axis] - node[axis]
+            next_axis = (axis + 1) % 3
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            stack.append((far[0], far[1], next_axis, diff * diff))
+            stack.append((near[0], near[1], next_axis, 0.0))
+        return self._place(best) if best is not None else None
+
+
+def build_gazetteer(rows, path):
+    """Write a gazetteer file from (name, latitude, longitude) rows. Returns the entry count."""
+    entries = []
+    for name, latitude, longitude in rows:
+        key = normalize(name)
+        if key and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+            entries.append((key.encode(), name.strip().encode(), latitude, longitude))
+    entries.sort(key=lambda entry: entry[0])
+
+    strings = bytearray()
+    index = bytearray()
+    for key, name, latitude, longitude in entries:
+        key_offset = len(strings)
+        strings += key
+        name_offset = len(strings)
+        strings += name
+        index += _ENTRY.pack(key_offset, len(key), name_offset, len(name), latitude, longitude)
+
+    points = [_unit_vector(latitude, longitude) + (i,) for i, (_, _, latitude, longitude) in enumerate(entries)]
+    nodes = [None] * len(points)
+    # Median splits, cycling x/y/z; node i of [lo, hi) sits at (lo + hi) // 2
+    stack = [(0, len(points), 0)]
+    while stack:
+        lo, hi, axis = stack.pop()
+        if lo >= hi:
+            continue
+        points[lo:hi] = sorted(points[lo:hi], key=lambda point: point[axis])
+        mid = (lo + hi) // 2
+        nodes[mid] = points[mid]
+        stack.append((lo, mid, (axis + 1) % 3))
+        stack.append((mid + 1, hi, (axis + 1) % 3))
+    tree = b''.join(_NODE.pack(*node) for node in nodes)
+
+    index_offset = _HEADER.size
+    tree_offset = index_offset + len(index)
+    strings_offset = tree_offset + len(tree)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, len(entries), index_offset, tree_offset, strings_offset))
+        f.write(index)
+        f.write(tree)
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def read_gazetteer_csv(f):
+    # name,latitude,longitude (extra columns are ignored)
+    for row in csv.DictReader(f):
+        try:
+            yield row['name'], float(row['latitude']), float(row['longitude'])
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Skipping gazetteer row %r", row)
+
+
+class Geocoder:
+    """LRU-cached front of a provider; misses are cached too."""
+
+    def __init__(self, provider, cache_size, cache_ttl, reverse_max_km):
+        self.provider = provider
+        self.reverse_max_km = reverse_max_km
+        self._cache = LocalCache(cache_size)
+        self._ttl = cache_ttl
+
+    def _cached(self, key, compute):
+        item = self._cache.get(key)
+        cache_lookup('geocode', item is not None)
+        if item is None:
+            item = (compute(),)
+            self._cache.set(key, item, self._ttl)
+        return item[0]
+
+    def geocode(self, address):
+        key = normalize(address)
+        if not key:
+            return None
+        return self._cached(('geocode', key), lambda: self.provider.geocode(address))
+
+    def reverse(self, latitude, longitude):
+        # ~1 m apart share a cache entry
+        key = ('reverse', round(latitude, 5), round(longitude, 5))
+        return self._cached(key, lambda: self.provider.reverse(latitude, longitude, self.reverse_max_km))
+
+
+def _make_provider(app):
+    name = app.config['GEOCODING_PROVIDER']
+    if name == 'gazetteer':
+        path = app.config['GEOCODING_GAZETTEER_PATH'] or os.path.join(app.instance_path, 'gazetteer.bin')
+        if not os.path.exists(path):
+            logger.info("No gazetteer at %s, geocoding is disabled", path)
+            return None
+        return GazetteerProvider(path)
+    # Any other value is a provider class, constructed with the app
+    return import_string(name.replace(':', '.'))(app)
+
+
+def init_geocoding(app):
+    if app.config['GEOCODING_PROVIDER'] == 'off':
+        return
+    provider = _make_provider(app)
+    if provider is not None:
+        app.extensions['geocoder'] = Geocoder(provider, app.config['GEOCODING_CACHE_SIZE'],
+                                              app.config['GEOCODING_CACHE_TTL'], app.config['GEOCODING_REVERSE_MAX_KM'])
+
+
+def get_geocoder():
+    return current_app.extensions.get('geocoder')
+
+
+def _coordinate(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None  # reported by validate_pet_data
+
+
+def complete_location(data):
+    """Fill in last_seen_address from the coordinates or the coordinates from the
+    address, whichever half of the form is missing. Returns the filled field names."""
+    geocoder = get_geocoder()
+    if geocoder is None:
+        return []
+    latitude, longitude = _coordinate(data.get('latitude')), _coordinate(data.get('longitude'))
+    has_point = latitude is not None and longitude is not None
+    address = (data.get('last_seen_address') or '').strip()
+    if not address and has_point:
+        place = geocoder.reverse(latitude, longitude)
+        if place is not None:
+            data['last_seen_address'] = place.name
+            return ['last_seen_address']
+    elif address and not data.get('latitude') and not data.get('longitude'):
+        place = geocoder.geocode(address)
+        if place is not None:
+            data['latitude'], data['longitude'] = place.latitude, place.longitude
+            return ['latitude', 'longitude']
+    return []
@@ -0,0 +1,116 @@
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, jsonify
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db
+from app.models.user import User
+from app.services.metrics import cache_lookup
+
+
+class IdentityError(ValueError):
+    pass
+
+
+# Tokens carry the user id as a numeric string (see create_access_token calls)
+def parse_identity(identity):
+    if not isinstance(identity, str):
+        raise IdentityError('User ID must be a string')
+    if not identity.isdigit():
+        raise IdentityError('User ID must be a number')
+    return int(identity)
+
+
+def user_required(fn):
+    """jwt_required plus a single validation of the identity claim.
+
+    The parsed id is available through get_current_user_id() for the rest of the
+    request; the User row is only loaded if the view asks for current_user().
+    """
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        try:
+            g.current_user_id = parse_identity(get_jwt_identity())
+        except IdentityError as e:
+            return jsonify({'message': str(e)}), 400
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def get_current_user_id():
+    return g.current_user_id
+
+
+class UserCache:
+    """Short-lived per-process cache of user rows, keyed by id."""
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, ttl):
+        with self._lock:
+            item = self._rows.get(user_id)
+        if item is None or item[0] < time.monotonic():
+            cache_lookup('user', False)
+            return None
+        cache_lookup('user', True)
+        return item[1]
+
+    def put(self, user_id, values, ttl, max_entries):
+        with self._lock:
+            if len(self._rows) >= max_entries:
+                self._rows.clear()
+            self._rows[user_id] = (time.monotonic() + ttl, values)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._rows.pop(user_id, None)
+
+
+_user_cache = UserCache()
+
+
+def _column_keys():
+    return [attr.key for attr in inspect(User).column_attrs]
+
+
+def _from_snapshot(values):
+    # Rebuild a detached instance and attach it without a SELECT
+    user = inspect(User).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_user(user_id):
+    ttl = current_app.config['USER_CACHE_TTL']
+    if ttl > 0:
+        values = _user_cache.get(user_id, ttl)
+        if values is not None:
+            return _from_snapshot(values)
+
+    user = db.session.get(User, user_id)
+    if user is not None and ttl > 0:
+        values = {key: getattr(user, key) for key in _column_keys()}
+        _user_cache.put(user_id, values, ttl, current_app.config['USER_CACHE_MAX_ENTRIES'])
+    return user
+
+
+def current_user():
+    # Resolved once per request
+    if 'current_user' not in g:
+        g.current_user = load_user(get_current_user_id())
+    return g.current_user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    _user_cache.invalidate(target.id)
@@ -0,0 +1,232 @@
+import logging
+import math
+from itertools import combinations
+
+from flask import current_app
+from PIL import Image, ImageOps
+from sqlalchemy import delete, insert, select, union_all
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.image_blob import ImageBlob, blob_key
+from app.models.image_hash import ImageHash
+from app.services.jobs import enqueue, task
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+_CHUNK_MASK = (1 << CHUNK_BITS) - 1
+_MASK = (1 << HASH_BITS) - 1
+
+# pHash: 32x32 DCT, top-left 8x8 coefficients compared with their median
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_COSINES = [[math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+            for u in range(_DCT_KEEP)]
+
+
+def _grayscale(image, size):
+    return image.convert('L').resize(size, Image.LANCZOS)
+
+
+def _bits(flags):
+    value = 0
+    for flag in flags:
+        value = (value << 1) | bool(flag)
+    return value
+
+
+def dhash(image):
+    """Difference hash: is each pixel of a 9x8 thumbnail brighter than its left neighbour."""
+    pixels = list(_grayscale(image, (9, 8)).getdata())
+    return _bits(pixels[row * 9 + col + 1] > pixels[row * 9 + col] for row in range(8) for col in range(8))
+
+
+def phash(image):
+    """DCT hash: which low-frequency coefficients of a 32x32 thumbnail are above the median."""
+    pixels = list(_grayscale(image, (_DCT_SIZE, _DCT_SIZE)).getdata())
+    rows = [pixels[i:i + _DCT_SIZE] for i in range(0, len(pixels), _DCT_SIZE)]
+    # Separable 2-D DCT-II, only the coefficients that are kept
+    row_coeffs = [[sum(c * p for c, p in zip(cosines, row)) for cosines in _COSINES] for row in rows]
+    coeffs = [sum(_COSINES[v][y] * row_coeffs[y][u] for y in range(_DCT_SIZE))
+              for v in range(_DCT_KEEP) for u in range(_DCT_KEEP)]
+    median = sorted(coeffs)[len(coeffs) // 2]
+    return _bits(c > median for c in coeffs)
+
+
+def compute_hashes(path, max_pixels):
+    """(phash, dhash) of an image file as unsigned 64-bit integers, or None if it is too big."""
+    with Image.open(path) as image:
+        if image.width * image.height > max_pixels:
+            return None
+        # JPEGs decode straight at a reduced scale; the hashes only look at 32x32
+        image.draft('L', (_DCT_SIZE * 4, _DCT_SIZE * 4))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    return phash(image), dhash(image)
+
+
+def _signed(value):
+    # Database integers are signed 64-bit
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def _unsigned(value):
+    return value & _MASK
+
+
+def chunks(value):
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & _CHUNK_MASK for i in range(CHUNKS)]
+
+
+def hamming(a, b):
+    # Works on the signed database values too
+    return _popcount((a ^ b) & _MASK)
+
+
+try:
+    _popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def hash_row(digest, phash_value, dhash_value):
+    row = {'digest': digest, 'phash': _signed(phash_value), 'dhash': _signed(dhash_value)}
+    for i, chunk in enumerate(chunks(phash_value)):
+        row[f'phash_{i}'] = chunk
+    return row
+
+
+def store_hashes(connection, rows):
+    known = set(connection.execute(
+        select(ImageHash.digest).where(ImageHash.digest.in_([row['digest'] for row in rows]))
+    ).scalars())
+    rows = [row for row in rows if row['digest'] not in known]
+    if rows:
+        connection.execute(insert(ImageHash.__table__), rows)
+
+
+def hash_image(digest, path):
+    """Compute and store the hashes of one stored image."""
+    try:
+        hashes = compute_hashes(path, current_app.config['IMAGE_MAX_PIXELS'])
+    except Exception:
+        logger.exception("Image hashing failed for %s", path)
+        return
+    if hashes is None:
+        return
+    try:
+        with db.engine.begin() as connection:
+            store_hashes(connection, [hash_row(digest, *hashes)])
+    except IntegrityError:
+        pass  # the same image was hashed concurrently
+
+
+def backfill_hashes(batch_size=200):
+    """Queue hash_images jobs for stored images that have no hashes yet
+    (hashed right here when IMAGE_PROCESSING_ASYNC is off). Returns (images, jobs)."""
+    images = jobs = 0
+    after = ''
+    while True:
+        digests = db.session.execute(
+            select(ImageBlob.digest)
+            .outerjoin(ImageHash, ImageHash.digest == ImageBlob.digest)
+            .where(ImageHash.digest.is_(None), ImageBlob.digest > after)
+            .order_by(ImageBlob.digest).limit(batch_size)
+        ).scalars().all()
+        if not digests:
+            break
+        after = digests[-1]
+        if current_app.config['IMAGE_PROCESSING_ASYNC']:
+            enqueue('hash_images', {'digests': digests})
+            db.session.commit()
+        else:
+            hash_images_job(digests)
+        images += len(digests)
+        jobs += 1
+    return images, jobs
+
+
+@task('hash_images', priority=90)
+def hash_images_job(digests):
+    from app.services.storage import get_store
+    store = get_store()
+    max_pixels = current_app.config['IMAGE_MAX_PIXELS']
+    blobs = db.session.execute(
+        select(ImageBlob.digest, ImageBlob.extension).where(ImageBlob.digest.in_(digests))
+    ).all()
+    rows = []
+    for digest, extension in blobs:
+        key = blob_key(digest, extension)
+        path = store.local_path(key)
+        try:
+            hashes = compute_hashes(path, max_pixels) if path else None
+        except Exception as e:
+            logger.warning("Cannot hash %s: %s", key, e)
+            continue
+        if hashes is not None:
+            rows.append(hash_row(digest, *hashes))
+    if rows:
+        with db.engine.begin() as connection:
+            store_hashes(connection, rows)
+
+
+def _neighbours(chunk, radius):
+    # Every 16-bit value within `radius` bit flips of chunk
+    values = [chunk]
+    for distance in range(1, radius + 1):
+        for positions in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
+
+
+def similar_digests(digest, max_distance, limit):
+    """Images whose pHash is within max_distance bits of the given image's.
+
+    Returns [(digest, phash distance, dhash distance)] closest first, or None
+    when the image has not been hashed yet. By the pigeonhole principle a match
+    agrees with the query on at least one 16-bit chunk up to max_distance // 4
+    flipped bits, so only those index ranges are read.
+    """
+    row = db.session.execute(
+        select(ImageHash.phash, ImageHash.dhash).where(ImageHash.digest == digest)
+    ).first()
+    if row is None:
+        return None
+    query_phash, query_dhash = row.phash, row.dhash
+
+    radius = max_distance // CHUNKS
+    columns = (ImageHash.phash_0, ImageHash.phash_1, ImageHash.phash_2, ImageHash.phash_3)
+    # Candidates come from the (chunk, phash) indexes without touching the table;
+    # one SELECT per chunk, since an OR would be answered through the rows
+    candidates = db.session.execute(union_all(*[
+        select(ImageHash.phash).where(column.in_(_neighbours(chunk, radius)))
+        for column, chunk in zip(columns, chunks(_unsigned(query_phash)))
+    ])).scalars().all()
+    close = {}
+    for candidate in candidates:
+        distance = hamming(query_phash, candidate)
+        if distance <= max_distance:
+            close[candidate] = distance
+    if not close:
+        return []
+
+    results = []
+    rows = db.session.execute(
+        select(ImageHash.digest, ImageHash.phash, ImageHash.dhash).where(ImageHash.phash.in_(list(close)))
+    )
+    for candidate, candidate_phash, candidate_dhash in rows:
+        if candidate != digest:
+            results.append((candidate, close[candidate_phash], hamming(query_dhash, candidate_dhash)))
+    results.sort(key=lambda item: (item[1], item[2], item[0]))
+    return results[:limit]
+
+
+def forget_hashes(connection, digests):
+    connection.execute(delete(ImageHash.__table__).where(ImageHash.digest.in_(list(digests))))
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from app.services.metrics import IMAGE_PROCESSING_SECONDS
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL_PREFIX = '/static/uploads/'
+
+# Longest edge in pixels for each variant served to clients
+VARIANTS = {
+    'thumb': 320,
+    'medium': 800,
+    'full': 1600
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})
+}
+_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def variant_filename(filename, variant, fmt):
+    stem = filename.rsplit('.', 1)[0]
+    return f"{stem}_{variant}.{_EXTENSIONS[fmt]}"
+
+
+def variant_urls(image_url):
+    if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    filename = image_url[len(UPLOAD_URL_PREFIX):]
+    return {
+        variant: {fmt: UPLOAD_URL_PREFIX + variant_filename(filename, variant, fmt) for fmt in FORMATS}
+        for variant in VARIANTS
+    }
+
+
+def _flatten(image, fmt):
+    # JPEG has no alpha channel; composite transparent images onto white
+    if fmt == 'jpeg' and image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    return image
+
+
+def process_image(source_path, max_pixels):
+    upload_folder, filename = os.path.split(source_path)
+    with Image.open(source_path) as original:
+        width, height = original.size
+        if width * height > max_pixels:
+            logger.warning("Skipping variants for %s: %sx%s exceeds the pixel limit", filename, width, height)
+            return False
+        original.seek(0)  # first frame of animated images
+        # exif_transpose applies the orientation and drops the EXIF block;
+        # re-encoding without info= strips the remaining metadata
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for fmt, (pil_format, options) in FORMATS.items():
+            target = os.path.join(upload_folder, variant_filename(filename, variant, fmt))
+            tmp_path = f"{target}.tmp"
+            _flatten(resized, fmt).save(tmp_path, pil_format, **options)
+            os.replace(tmp_path, target)
+    return True
+
+
+# True once the variants exist; failures are logged, not raised
+def build_variants(source_path, max_pixels):
+    started = time.perf_counter()
+    try:
+        built = process_image(source_path, max_pixels)
+    except Exception:
+        logger.exception("Image processing failed for %s", source_path)
+        IMAGE_PROCESSING_SECONDS.observe(time.perf_counter() - started, result='error')
+        return False
+    IMAGE_PROCESSING_SECONDS.observe(time.perf_counter() - started, result='ok')
+    return built
+
+
+def is_variant(filename):
+    stem = filename.rsplit('.', 1)[0]
+    return any(stem.endswith(f"_{variant}") for variant in VARIANTS)
@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import current_app
+from sqlalchemy import and_, delete, event, func, insert, select, update
+
+from app import db
+from app.models.job import Job
+from app.services.metrics import (JOB_LATENCY_SECONDS, JOB_SECONDS, JOBS_ENQUEUED, JOBS_PROCESSED,
+                                  register_gauge, render)
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs in the application database, run by `flask worker`.
+# enqueue() writes the job in the caller's transaction, so it exists exactly when
+# the data it refers to was committed. Workers claim a job by moving it to
+# 'running' with a visibility timeout (locked_until); a job whose worker died is
+# claimed again once that passes, so tasks must be safe to run twice.
+# With JOBS_EAGER (tests and scripts only) the jobs enqueued by a transaction run
+# on the same thread right after it commits, no worker needed.
+
+DEFAULT_PRIORITY = 100  # lower runs first
+_EAGER_KEY = 'eager_jobs'
+
+_tasks = {}
+
+
+class TaskSpec:
+    __slots__ = ('name', 'fn', 'priority', 'max_attempts', 'timeout')
+
+    def __init__(self, name, fn, priority, max_attempts, timeout):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+def task(name, priority=DEFAULT_PRIORITY, max_attempts=None, timeout=None):
+    """Register fn(**payload) as a background task. timeout is its visibility
+    timeout in seconds (JOBS_VISIBILITY_TIMEOUT by default)."""
+    def decorator(fn):
+        _tasks[name] = TaskSpec(name, fn, priority, max_attempts, timeout)
+        return fn
+    return decorator
+
+
+def _insert_ignoring_duplicates(connection, values):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        existing = connection.execute(
+            select(Job.id).where(Job.idempotency_key == values['idempotency_key'])).scalar()
+        return None if existing is not None else connection.execute(insert(Job.__table__).values(values))
+    stmt = dialect_insert(Job.__table__).values(values).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    return connection.execute(stmt)
+
+
+def enqueue(name, payload=None, priority=None, delay=0, idempotency_key=None, session=None):
+    """Add a job to the caller's transaction; it is queued once that commits.
+
+    A job whose idempotency_key is already taken (queued, running or finished)
+    is not added again. Returns the new job id, or None for such a duplicate.
+    """
+    spec = _tasks.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown task {name!r}")
+    config = current_app.config
+    session = session or db.session
+    now = datetime.utcnow()
+    values = {
+        'task': name,
+        'payload': json.dumps(payload or {}),
+        'priority': spec.priority if priority is None else priority,
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': spec.max_attempts or config['JOBS_MAX_ATTEMPTS'],
+        'run_at': now + timedelta(seconds=delay),
+        'idempotency_key': idempotency_key,
+        'created_at': now,
+    }
+    connection = session.connection()
+    if idempotency_key is None:
+        result = connection.execute(insert(Job.__table__).values(values))
+    else:
+        result = _insert_ignoring_duplicates(connection, values)
+        if result is None or not result.rowcount:
+            return None
+    job_id = result.inserted_primary_key[0]
+    JOBS_ENQUEUED.inc(task=name)
+    if config['JOBS_EAGER'] and not delay:
+        session.info.setdefault(_EAGER_KEY, []).append(job_id)
+    return job_id
+
+
+def release_idempotency_keys(connection, keys):
+    """Let jobs with these keys be enqueued again (their history stays)."""
+    connection.execute(update(Job.__table__).where(Job.idempotency_key.in_(list(keys))).values(idempotency_key=None))
+
+
+# Claiming
+
+def _due(now):
+    return and_(Job.status == 'queued', Job.run_at <= now)
+
+
+def _abandoned(now):
+    return and_(Job.status == 'running', Job.locked_until < now)
+
+
+def _claim_update(job_id, condition, worker_id, now, timeout):
+    return update(Job.__table__).where(Job.id == job_id, condition).values(
+        status='running', locked_by=worker_id, locked_until=now + timedelta(seconds=timeout),
+        attempts=Job.attempts + 1, started_at=now)
+
+
+def _timeout(task_name):
+    spec = _tasks.get(task_name)
+    return (spec and spec.timeout) or current_app.config['JOBS_VISIBILITY_TIMEOUT']
+
+
+def claim_job(worker_id, tasks=None):
+    """Take the next due job (lowest priority value, then oldest) and return its
+    row, or None when there is nothing to do."""
+    now = datetime.utcnow()
+    with db.engine.connect() as connection:
+        skip_locked = connection.dialect.name == 'postgresql'
+        for condition in (_abandoned(now), _due(now)):
+            query = select(Job.id, Job.task).where(condition)
+            if tasks:
+                query = query.where(Job.task.in_(tasks))
+            query = query.order_by(Job.priority, Job.run_at, Job.id).limit(1)
+            if skip_locked:
+                query = query.with_for_update(skip_locked=True)
+            else:
+                # SQLite: read outside the write transaction (a WAL snapshot could not
+                # be upgraded to a write), the conditional UPDATE settles races
+                connection.commit()
+            while True:
+                row = connection.execute(query).first()
+                if row is None:
+                    break
+                claimed = connection.execute(
+                    _claim_update(row.id, condition, worker_id, now, _timeout(row.task))).rowcount
+                connection.commit()
+                if claimed:
+                    return connection.execute(select(Job.__table__).where(Job.id == row.id)).first()
+                # Another worker got it first
+        connection.commit()
+    return None
+
+
+def _claim_by_id(job_id, worker_id):
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        row = connection.execute(select(Job.task).where(Job.id == job_id)).first()
+        if row is None or not connection.execute(
+                _claim_update(job_id, _due(now), worker_id, now, _timeout(row.task))).rowcount:
+            return None
+        return connection.execute(select(Job.__table__).where(Job.id == job_id)).first()
+
+
+# Running
+
+def _backoff(attempts, config):
+    delay = min(config['JOBS_BACKOFF_MAX'], config['JOBS_BACKOFF_BASE'] * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)  # jitter, so failed jobs don't retry in lockstep
+
+
+def _settle(job, worker_id, **values):
+    # Only the worker holding the lock may settle the job
+    with db.engine.begin() as connection:
+        connection.execute(update(Job.__table__).where(
+            Job.id == job.id, Job.status == 'running', Job.locked_by == worker_id
+        ).values(locked_until=None, **values))
+
+
+def run_job(app, job, worker_id):
+    """Run a claimed job and record the outcome. Returns 'done', 'retry' or 'failed'."""
+    config = app.config
+    JOB_LATENCY_SECONDS.observe(max(0.0, (job.started_at - job.run_at).total_seconds()), task=job.task)
+    started = time.perf_counter()
+    spec = _tasks.get(job.task)
+    error = None
+    try:
+        if spec is None:
+            raise LookupError(f"Unknown task {job.task!r}")
+        # A fresh app context per job: its own db.session, nothing leaks between jobs
+        with app.app_context():
+            spec.fn(**json.loads(job.payload))
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logger.exception("Job %s (%s) failed, attempt %d of %d", job.id, job.task, job.attempts, job.max_attempts)
+    JOB_SECONDS.observe(time.perf_counter() - started, task=job.task)
+
+    now = datetime.utcnow()
+    if error is None:
+        result = 'done'
+        _settle(job, worker_id, status='done', finished_at=now, last_error=None)
+    elif job.attempts < job.max_attempts:
+        result = 'retry'
+        _settle(job, worker_id, status='queued', locked_by=None, last_error=error,
+                run_at=now + timedelta(seconds=_backoff(job.attempts, config)))
+    else:
+        result = 'failed'
+        _settle(job, worker_id, status='failed', finished_at=now, last_error=error)
+    JOBS_PROCESSED.inc(task=job.task, result=result)
+    return result
+
+
+def purge_jobs(older_than):
+    """Delete finished jobs (failed ones are kept for inspection)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+    with db.engine.begin() as connection:
+        return connection.execute(delete(Job.__table__).where(
+            Job.status == 'done', Job.finished_at < cutoff)).rowcount
+
+
+def retry_failed(task_name=None):
+    """Queue failed jobs again with a fresh set of attempts."""
+    condition = Job.status == 'failed'
+    if task_name:
+        condition = and_(condition, Job.task == task_name)
+    with db.engine.begin() as connection:
+        return connection.execute(update(Job.__table__).where(condition).values(
+            status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None)).rowcount
+
+
+# Eager mode: jobs run right after the transaction that enqueued them commits
+
+@event.listens_for(db.session, 'after_commit')
+def _run_eager_jobs(session):
+    job_ids = session.info.pop(_EAGER_KEY, None)
+    if not job_ids:
+        return
+    app = current_app._get_current_object()
+    worker_id = f'eager:{os.getpid()}'
+    for job_id in job_ids:
+        job = _claim_by_id(job_id, worker_id)
+        if job is not None:
+            run_job(app, job, worker_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_eager_jobs(session):
+    session.info.pop(_EAGER_KEY, None)
+
+
+# Worker
+
+class Worker:
+    def __init__(self, app, tasks=None, concurrency=1, poll_interval=1.0):
+        self.app = app
+        self.tasks = tasks or None
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+    def stop(self, *args):
+        if not self._stop.is_set():
+            logger.info("Worker %s stopping after the current jobs", self.name)
+        self._stop.set()
+
+    def run_once(self, worker_id):
+        job = claim_job(worker_id, self.tasks)
+        if job is None:
+            return False
+        run_job(self.app, job, worker_id)
+        return True
+
+    def _loop(self, worker_id, burst):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    if self.run_once(worker_id):
+                        continue
+                    if burst:
+                        return
+                    self._maybe_purge()
+                except Exception:
+                    # e.g. the database is briefly unavailable
+                    logger.exception("Worker %s could not fetch a job", worker_id)
+                self._stop.wait(self.poll_interval)
+
+    def _maybe_purge(self):
+        interval = self.app.config['JOBS_PURGE_INTERVAL']
+        if time.monotonic() - self._last_purge < interval:
+            return
+        self._last_purge = time.monotonic()
+        removed = purge_jobs(self.app.config['JOBS_RETENTION'])
+        if removed:
+            logger.info("Purged %d finished jobs", removed)
+
+    def run(self, burst=False):
+        """Process jobs until SIGTERM/SIGINT (or, with burst, until the queue is empty)."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        logger.info("Worker %s started with %d thread(s)", self.name, self.concurrency)
+        threads = [threading.Thread(target=self._loop, args=(f'{self.name}:{i}', burst),
+                                    name=f'job-worker-{i}', daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+
+
+def serve_metrics(app, host, port):
+    """/metrics for a worker process, which has no HTTP server of its own.
+    Like the web endpoint it wants `Authorization: Bearer <METRICS_TOKEN>` when set."""
+    token = app.config['METRICS_TOKEN']
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            if token and self.headers.get('Authorization') != f'Bearer {token}':
+                self.send_error(401)
+                return
+            with app.app_context():
+                body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='worker-metrics', daemon=True).start()
+    return server
+
+
+# Queue depth, read from the table at scrape time
+
+def _queue_depth():
+    try:
+        rows = db.session.execute(
+            select(Job.task, Job.status, func.count()).where(Job.status != 'done').group_by(Job.task, Job.status)
+        ).all()
+    except Exception:
+        logger.exception("Could not read the job queue depth")
+        return []
+    return [((task_name, status), count) for task_name, status, count in rows]
+
+
+def _oldest_due():
+    now = datetime.utcnow()
+    try:
+        rows = db.session.execute(
+            select(Job.task, func.min(Job.run_at)).where(_due(now)).group_by(Job.task)
+        ).all()
+    except Exception:
+        logger.exception("Could not read the job queue age")
+        return []
+    return [((task_name,), round((now - oldest).total_seconds(), 3)) for task_name, oldest in rows]
+
+
+register_gauge('jobs_queue_depth', 'Jobs not yet done, by task and status (queued, running, failed).',
+               ('task', 'status'), _queue_depth)
+register_gauge('jobs_oldest_due_seconds', 'How long the oldest due job of each task has been waiting.',
+               ('task',), _oldest_due)
@@ -0,0 +1,62 @@
+import logging
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+logger = logging.getLogger(__name__)
+
+# Optional fast encoder
+try:
+    import orjson
+    orjson_available = True
+except ImportError:
+    orjson_available = False
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Output matches the stdlib provider (sorted keys, dates as HTTP dates via
+    Flask's default hook) except that non-ASCII text is written as UTF-8
+    instead of \\u escapes.
+    """
+
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME \
+        if orjson_available else 0
+
+    def dumps_bytes(self, obj, indent=False):
+        return orjson.dumps(obj, default=_default, option=self.options | (orjson.OPT_INDENT_2 if indent else 0))
+
+    def dumps(self, obj, **kwargs):
+        # Anything beyond the defaults (cls=, ensure_ascii=, ...) is stdlib-only
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {
+    'json': DefaultJSONProvider,
+    'orjson': OrjsonProvider,
+}
+
+
+def init_json(app):
+    """Install the JSON provider chosen by JSON_PROVIDER ('auto' prefers orjson)."""
+    name = app.config['JSON_PROVIDER']
+    if name == 'auto':
+        name = 'orjson' if orjson_available else 'json'
+    elif name == 'orjson' and not orjson_available:
+        logger.warning("orjson is not installed, using the stdlib JSON provider")
+        name = 'json'
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f"Unknown JSON_PROVIDER: {name}")
+    app.json = JSON_PROVIDERS[name](app)
@@ -0,0 +1,255 @@
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import current_app
+
+from app.models.pet_post import post_serializer
+from app.services import changes
+
+logger = logging.getLogger(__name__)
+
+# Live feed of post changes for Server-Sent Events (GET /api/pets/live).
+# Committed changes are turned into one message each: the JSON payload plus the
+# (pet_type, status, geohash, lat, lon) points it concerns (old and new values of
+# an update). The hub turns a message into an SSE frame once and hands the same
+# bytes to every matching subscriber. With several workers the messages go
+# through a small TCP broker (LIVE_BROKER_URL) that relays them to all workers.
+
+EVENT_NAMES = {'insert': 'created', 'update': 'updated', 'delete': 'deleted'}
+
+
+class LiveFull(Exception):
+    pass
+
+
+class Subscription:
+    __slots__ = ('pet_type', 'status', 'prefix', 'boxes', 'queue', 'closed')
+
+    def __init__(self, pet_type, status, prefix, boxes, queue_size):
+        self.pet_type = pet_type
+        self.status = status
+        self.prefix = prefix
+        self.boxes = boxes
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+
+    def matches(self, point):
+        pet_type, status, geohash, latitude, longitude = point
+        if self.pet_type and pet_type != self.pet_type:
+            return False
+        if self.status and status != self.status:
+            return False
+        if self.prefix and not (geohash or '').startswith(self.prefix):
+            return False
+        if self.boxes:
+            if latitude is None or longitude is None:
+                return False
+            return any(south <= latitude <= north and west <= longitude <= east
+                       for south, west, north, east in self.boxes)
+        return True
+
+    def next_frame(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LiveHub:
+    def __init__(self, max_subscribers, queue_size):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, pet_type=None, status=None, prefix=None, boxes=None):
+        subscription = Subscription(pet_type, status, prefix, boxes, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise LiveFull()
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def deliver(self, message):
+        points = [tuple(point) for point in message['points']]
+        with self._lock:
+            subscribers = list(self._subscribers)
+        frame = None
+        for subscription in subscribers:
+            if not any(subscription.matches(point) for point in points):
+                continue
+            if frame is None:
+                frame = f"id: {next(self._ids)}\nevent: {message['event']}\ndata: {message['data']}\n\n".encode()
+            try:
+                subscription.queue.put_nowait(frame)
+            except queue.Full:
+                # A client this far behind reconnects and reloads the list
+                logger.info("Dropping a live subscriber that fell %d events behind", self.queue_size)
+                self.unsubscribe(subscription)
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+
+class BrokerClient:
+    """Connection from a worker to the broker: publishes messages and delivers
+    everything the broker relays (its own messages included) to the local hub."""
+
+    def __init__(self, host, port, hub, reconnect_delay=1.0):
+        self.address = (host, port)
+        self.hub = hub
+        self.reconnect_delay = reconnect_delay
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def ensure_started(self):
+        # Started lazily and per process, so forked gunicorn workers get their own connection
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._sock = None
+                threading.Thread(target=self._run, name='live-broker', daemon=True).start()
+
+    def send(self, message):
+        line = json.dumps(message, separators=(',', ':')).encode() + b'\n'
+        with self._send_lock:
+            if self._sock is None:
+                return False
+            try:
+                self._sock.sendall(line)
+                return True
+            except OSError:
+                return False
+
+    def _run(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address, timeout=5)
+                sock.settimeout(None)
+            except OSError as e:
+                logger.warning("Live broker %s:%s unreachable: %s", *self.address, e)
+                time.sleep(self.reconnect_delay)
+                continue
+            with self._send_lock:
+                self._sock = sock
+            try:
+                for line in sock.makefile('rb'):
+                    self.hub.deliver(json.loads(line))
+            except (OSError, ValueError) as e:
+                logger.warning("Live broker connection lost: %s", e)
+            finally:
+                with self._send_lock:
+                    self._sock = None
+                sock.close()
+            time.sleep(self.reconnect_delay)
+
+
+def run_broker(host, port):
+    """Relay every line a worker sends to all connected workers (blocking)."""
+    clients = {}
+    clients_lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.request.settimeout(None)
+            with clients_lock:
+                clients[self.request] = threading.Lock()
+            try:
+                for line in self.rfile:
+                    with clients_lock:
+                        targets = list(clients.items())
+                    for client, lock in targets:
+                        try:
+                            with lock:
+                                client.sendall(line)
+                        except OSError:
+                            with clients_lock:
+                                clients.pop(client, None)
+            finally:
+                with clients_lock:
+                    clients.pop(self.request, None)
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    server = Server((host, port), Handler)
+    logger.info("Live broker listening on %s:%s", host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def parse_broker_url(url):
+    # tcp://host:port
+    address = url.split('://', 1)[-1]
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def init_live(app):
+    if not app.config['LIVE_ENABLED']:
+        return
+    hub = LiveHub(app.config['LIVE_MAX_SUBSCRIBERS'], app.config['LIVE_QUEUE_SIZE'])
+    app.extensions['live_hub'] = hub
+    if app.config['LIVE_BROKER_URL']:
+        app.extensions['live_broker'] = BrokerClient(*parse_broker_url(app.config['LIVE_BROKER_URL']), hub)
+
+
+def get_live_hub():
+    hub = current_app.extensions.get('live_hub')
+    broker = current_app.extensions.get('live_broker')
+    if broker is not None:
+        broker.ensure_started()
+    return hub
+
+
+def publish(message):
+    broker = current_app.extensions.get('live_broker')
+    if broker is not None:
+        broker.ensure_started()
+        if broker.send(message):
+            return
+    # No broker (or it is down): only this worker's subscribers hear about it
+    current_app.extensions['live_hub'].deliver(message)
+
+
+def _point(values):
+    return [values.get('pet_type'), values.get('status'), values.get('geohash'),
+            values.get('latitude'), values.get('longitude')]
+
+
+@changes.on_commit
+def publish_changes(post_changes):
+    if 'live_hub' not in current_app.extensions:
+        return
+    serialize = post_serializer()
+    dumps = current_app.json.dumps
+    for change in post_changes:
+        if change.kind == 'delete':
+            payload = {'pet_post': {'id': change.post_id}}
+        else:
+            payload = {'pet_post': serialize(SimpleNamespace(**change.new))}
+        publish({
+            'event': EVENT_NAMES[change.kind],
+            'points': [_point(values) for values in (change.old, change.new) if values],
+            'data': dumps(payload),
+        })
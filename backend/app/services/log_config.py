@@ -0,0 +1,130 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Loggers owned by the application; module loggers (app.services.*) inherit from 'app'
+APP_LOGGERS = ('app', 'pets_api')
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+REDACTED = '[REDACTED]'
+
+
+def redact_headers(headers, sensitive):
+    sensitive = {name.lower() for name in sensitive}
+    return {name: (REDACTED if name.lower() in sensitive else value) for name, value in headers.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload['exc_info'] = record.exc_text
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Let through only a fraction of DEBUG records; INFO and above always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to a background listener; drops them rather than block when it's full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments here; the (JSON) formatting happens on the
+        # listener thread. Exceptions are rendered now, while the traceback exists.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(app):
+    global _listener
+    config = app.config
+    level = logging.getLevelName(str(config['LOG_LEVEL']).upper())
+
+    output = logging.StreamHandler(sys.stdout)
+    if config['LOG_FORMAT'] == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    _stop_listener()
+    if config['LOG_ASYNC']:
+        handler = NonBlockingQueueHandler(queue.Queue(config['LOG_QUEUE_SIZE']))
+        _listener = QueueListener(handler.queue, output, respect_handler_level=False)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(DebugSamplingFilter(config['LOG_DEBUG_SAMPLE_RATE']))
+
+    for name in APP_LOGGERS:
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.handlers = [handler]
+        logger.propagate = False
+    app.logger.setLevel(level)
+    app.extensions['log_handler'] = handler
+
+
+def _restart_after_fork():
+    # The listener thread doesn't survive fork(); give each worker its own
+    global _listener
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+atexit.register(_stop_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,158 @@
+import logging
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import delete, insert, or_, select
+
+from app import db
+from app.models.pet_match import PetMatch
+from app.models.pet_post import PetPost
+from app.services import changes
+from app.services.geo import bbox_filter, haversine_km, radius_bbox
+from app.services.jobs import enqueue, task
+from app.services.search import tokenize
+
+logger = logging.getLogger(__name__)
+
+# A missing post is matched against found posts and vice versa
+OPPOSITE_STATUS = {'missing': 'found', 'found': 'missing'}
+MATCH_FIELDS = ('pet_type', 'status', 'latitude', 'longitude', 'last_seen_date', 'title', 'description')
+_MIN_TOKEN_LENGTH = 3  # "a", "on", "ул" say nothing about the pet
+
+
+def text_tokens(values):
+    tokens = tokenize(values.get('title')) + tokenize(values.get('description'))
+    return {token for token in tokens if len(token) >= _MIN_TOKEN_LENGTH}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def score_pair(post, candidate, config, post_tokens=None):
+    """Score two posts; returns (score, distance_km, days_apart, text_score) or None
+    when they are too far apart in space or time to be the same pet."""
+    if post['last_seen_date'] is None or candidate['last_seen_date'] is None:
+        return None
+    days = abs((post['last_seen_date'] - candidate['last_seen_date']).total_seconds()) / 86400
+    if days > config['MATCH_MAX_DAYS']:
+        return None
+
+    radius = config['MATCH_RADIUS_KM']
+    distance = None
+    if None not in (post['latitude'], post['longitude'], candidate['latitude'], candidate['longitude']):
+        distance = haversine_km(post['latitude'], post['longitude'], candidate['latitude'], candidate['longitude'])
+        if distance > radius:
+            return None
+
+    if post_tokens is None:
+        post_tokens = text_tokens(post)
+    text_score = _jaccard(post_tokens, text_tokens(candidate))
+
+    weights = config['MATCH_WEIGHTS']
+    score = (
+        weights['distance'] * (1 - distance / radius if distance is not None else 0.5)  # unknown: neutral
+        + weights['time'] * (1 - days / config['MATCH_MAX_DAYS'])
+        + weights['text'] * text_score
+    )
+    return (round(score, 4), round(distance, 3) if distance is not None else None,
+            round(days, 2), round(text_score, 4))
+
+
+def find_candidates(connection, post_id, values, config):
+    """Posts of the opposite status that could be the same pet, read through
+    ix_pet_posts_match_candidates: (pet_type, status) then geohash cells around the post."""
+    opposite = OPPOSITE_STATUS.get(values.get('status'))
+    if opposite is None or not values.get('pet_type') or values.get('last_seen_date') is None:
+        return []
+    window = timedelta(days=config['MATCH_MAX_DAYS'])
+    query = select(
+        PetPost.id, PetPost.latitude, PetPost.longitude, PetPost.last_seen_date, PetPost.title, PetPost.description
+    ).where(
+        PetPost.pet_type == values['pet_type'],
+        PetPost.status == opposite,
+        PetPost.id != post_id,
+        PetPost.last_seen_date.between(values['last_seen_date'] - window, values['last_seen_date'] + window)
+    )
+    if values.get('latitude') is not None and values.get('longitude') is not None:
+        # Posts without coordinates stay candidates, so matching is symmetric
+        boxes = radius_bbox(values['latitude'], values['longitude'], config['MATCH_RADIUS_KM'])
+        query = query.where(or_(bbox_filter(PetPost, boxes, config['GEO_MAX_CELLS']), PetPost.geohash.is_(None)))
+    query = query.order_by(PetPost.last_seen_date.desc()).limit(config['MATCH_MAX_CANDIDATES'])
+    return connection.execute(query).mappings().all()
+
+
+def _forget_post(connection, post_id):
+    connection.execute(delete(PetMatch.__table__).where(
+        or_(PetMatch.missing_id == post_id, PetMatch.found_id == post_id)))
+
+
+def match_post(connection, post_id, values, config):
+    """Replace the stored matches of one post. Returns the number of matches kept."""
+    _forget_post(connection, post_id)
+    candidates = find_candidates(connection, post_id, values, config)
+    if not candidates:
+        return 0
+
+    post_tokens = text_tokens(values)
+    scored = []
+    for candidate in candidates:
+        result = score_pair(values, candidate, config, post_tokens)
+        if result is not None and result[0] >= config['MATCH_MIN_SCORE']:
+            scored.append((result, candidate['id']))
+    scored.sort(key=lambda item: (item[0][0], item[1]), reverse=True)
+    scored = scored[:config['MATCH_MAX_PER_POST']]
+    if not scored:
+        return 0
+
+    missing = values['status'] == 'missing'
+    connection.execute(insert(PetMatch.__table__), [
+        {
+            'missing_id': post_id if missing else candidate_id,
+            'found_id': candidate_id if missing else post_id,
+            'score': score, 'distance_km': distance_km, 'days_apart': days_apart, 'text_score': text_score
+        }
+        for (score, distance_km, days_apart, text_score), candidate_id in scored
+    ])
+    return len(scored)
+
+
+# Scoring reads up to MATCH_MAX_CANDIDATES posts, so it runs as a background job;
+# a deleted post's matches go away in the same transaction
+@changes.on_flush
+def update_matches(session, post_changes):
+    if not current_app.config['MATCHING_ENABLED']:
+        return
+    for change in post_changes:
+        if change.kind == 'delete':
+            _forget_post(session.connection(), change.post_id)
+        elif change.kind == 'insert' or any(change.old[f] != change.new[f] for f in MATCH_FIELDS):
+            enqueue('match_post', {'post_id': change.post_id}, session=session)
+
+
+@task('match_post', priority=50)
+def match_post_job(post_id):
+    # Scores the post as it is now, so a stale or repeated job is harmless
+    config = current_app.config
+    columns = [PetPost.id] + [getattr(PetPost, field) for field in MATCH_FIELDS]
+    with db.engine.begin() as connection:
+        values = connection.execute(select(*columns).where(PetPost.id == post_id)).mappings().first()
+        if values is not None:
+            match_post(connection, post_id, values, config)
+
+
+def rebuild_matches():
+    """Recompute every match, e.g. after `flask db upgrade` or a Core bulk load."""
+    config = current_app.config
+    columns = [PetPost.id] + [getattr(PetPost, field) for field in MATCH_FIELDS]
+    total = 0
+    with db.engine.begin() as connection:
+        connection.execute(delete(PetMatch.__table__))
+        # Every pair has one found side, so scoring from the found posts covers all of them
+        found = connection.execute(select(*columns).where(PetPost.status == 'found')).mappings().all()
+        for values in found:
+            total += match_post(connection, values['id'], values, config)
+    logger.info("Rebuilt %d matches for %d found posts", total, len(found))
+    return total
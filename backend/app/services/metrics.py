@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Minimal Prometheus instrumentation (text exposition format 0.0.4), kept per
+# process like the caches: with several gunicorn workers each one reports its
+# own series and Prometheus sums them.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, _labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + '_bucket', _labels(self.labelnames, key, [('le', _number(float(bound)))]), cumulative
+            yield self.name + '_bucket', _labels(self.labelnames, key, [('le', '+Inf')]), series[-1]
+            yield self.name + '_sum', _labels(self.labelnames, key), series[-2]
+            yield self.name + '_count', _labels(self.labelnames, key), series[-1]
+
+
+class Gauge:
+    """Read at scrape time: collect() returns [(label values, value)]."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in self.collect():
+            yield self.name, _labels(self.labelnames, key), value
+
+
+_metrics = []
+
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def register_gauge(name, help, labels, collect):
+    return _register(Gauge(name, help, labels, collect))
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = _register(Histogram(
+    'http_request_duration_seconds', 'Time to produce the response (streamed bodies excluded).',
+    ('endpoint', 'method', 'status')))
+REQUEST_SQL_QUERIES = _register(Histogram(
+    'http_request_sql_queries', 'SQL statements executed per request.',
+    ('endpoint',), buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)))
+REQUEST_SQL_SECONDS = _register(Histogram(
+    'http_request_sql_seconds', 'Time spent in SQL per request.',
+    ('endpoint',), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+SQL_QUERIES = _register(Counter('db_queries_total', 'SQL statements executed, in and out of requests.'))
+SQL_SECONDS = _register(Counter('db_query_seconds_total', 'Time spent executing SQL statements.'))
+UPLOADS = _register(Counter('uploads_total', 'Stored image uploads.', ('result',)))
+UPLOAD_BYTES = _register(Counter('upload_bytes_total', 'Bytes of accepted image uploads.'))
+UPLOAD_SECONDS = _register(Histogram('upload_store_seconds', 'Time to move an upload into the image store.'))
+IMAGE_PROCESSING_SECONDS = _register(Histogram(
+    'image_processing_seconds', 'Time to build the resized variants of one image.', ('result',)))
+CACHE_REQUESTS = _register(Counter('cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result')))
+JOBS_ENQUEUED = _register(Counter('jobs_enqueued_total', 'Background jobs added to the queue.', ('task',)))
+JOBS_PROCESSED = _register(Counter(
+    'jobs_processed_total', 'Background job runs by outcome (done, retry, failed).', ('task', 'result')))
+JOB_SECONDS = _register(Histogram(
+    'job_duration_seconds', 'Time to run one background job.', ('task',),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)))
+JOB_LATENCY_SECONDS = _register(Histogram(
+    'job_queue_latency_seconds', 'Time from a job becoming due to a worker starting it.', ('task',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)))
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# SQL timing through engine events; per-request totals live on flask.g
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    SQL_QUERIES.inc()
+    SQL_SECONDS.inc(elapsed)
+    if has_request_context() and 'metrics_sql_count' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += elapsed
+
+
+def _endpoint():
+    return request.endpoint or '<unmatched>'
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_sql_seconds = 0.0
+
+
+def _finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    endpoint = _endpoint()
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method,
+                            status=str(response.status_code))
+    REQUEST_SQL_QUERIES.observe(g.pop('metrics_sql_count', 0), endpoint=endpoint)
+    REQUEST_SQL_SECONDS.observe(g.pop('metrics_sql_seconds', 0.0), endpoint=endpoint)
+    return response
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    from app import db
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
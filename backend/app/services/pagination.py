@@ -0,0 +1,96 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+
+class PaginationError(ValueError):
+    pass
+
+
+# Cursors are opaque to clients: url-safe base64 of a small JSON payload
+def encode_cursor(payload):
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise PaginationError('Invalid cursor') from e
+    if not isinstance(payload, dict):
+        raise PaginationError('Invalid cursor')
+    return payload
+
+
+def parse_limit(args, default=None):
+    max_limit = current_app.config['PETS_PAGE_SIZE_MAX']
+    raw = args.get('limit')
+    if raw in (None, ''):
+        return default if default is not None else current_app.config['PETS_PAGE_SIZE']
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be a positive integer')
+    return min(limit, max_limit)
+
+
+# Keyset pagination over (created_at DESC, id DESC)
+def keyset_cursor(created_at, post_id):
+    return encode_cursor({'c': created_at.isoformat(), 'i': post_id})
+
+
+def decode_keyset(cursor):
+    payload = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(payload['c']), int(payload['i'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise PaginationError('Invalid cursor') from e
+
+
+def apply_keyset(query, model, cursor):
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if not cursor:
+        return query
+
+    created_at, post_id = decode_keyset(cursor)
+    # The redundant created_at <= c bound is what lets SQLite seek the
+    # (..., created_at, id) index; the OR alone is only a filter on a scan
+    return query.filter(and_(
+        model.created_at <= created_at,
+        or_(model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < post_id))
+    ))
+
+
+def keyset_page(query, model, cursor, limit):
+    rows = apply_keyset(query, model, cursor).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = keyset_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+# Offset pagination for ranked result sets (distance, relevance)
+def offset_cursor(offset):
+    return encode_cursor({'o': offset})
+
+
+def decode_offset(cursor):
+    if not cursor:
+        return 0
+    try:
+        offset = int(decode_cursor(cursor)['o'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise PaginationError('Invalid cursor') from e
+    if offset < 0:
+        raise PaginationError('Invalid cursor')
+    return offset
@@ -0,0 +1,83 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing runs on a small per-process pool instead of the request
+# thread. hashlib releases the GIL while it works, so the pool really bounds
+# how many CPUs are spent on hashing; when it is full callers get HashingBusy
+# right away (503) rather than queueing behind a login burst.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, method, salt_length, workers, queue_size, timeout):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._method_prefix = None
+
+    def _get_executor(self):
+        # Per process, so forked gunicorn workers get their own threads
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError as e:
+            raise HashingBusy() from e
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True when pwhash was made with other parameters than the configured ones."""
+        if self._method_prefix is None:
+            # Werkzeug fills in defaults (e.g. iterations), so take the method
+            # string from a real hash once
+            self._method_prefix = generate_password_hash('', self.method, self.salt_length).split('$', 1)[0]
+        method, _, rest = (pwhash or '').partition('$')
+        salt = rest.split('$', 1)[0]
+        return method != self._method_prefix or len(salt) != self.salt_length
+
+
+def init_passwords(app):
+    config = app.config
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=config['PASSWORD_HASH_METHOD'],
+        salt_length=config['PASSWORD_SALT_LENGTH'],
+        workers=config['PASSWORD_HASH_WORKERS'],
+        queue_size=config['PASSWORD_HASH_QUEUE'],
+        timeout=config['PASSWORD_HASH_TIMEOUT']
+    )
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,113 @@
+import logging
+from datetime import datetime
+
+from app.services.images import UPLOAD_URL_PREFIX
+
+# Validation and conversion of incoming pet post fields, shared by the
+# create endpoint and bulk imports
+logger = logging.getLogger("pets_api")
+
+
+def validate_pet_data(data):
+    errors = []
+    
+    # Обработка subject -> title преобразования
+    if 'subject' in data and 'title' not in data:
+        try:
+            data['title'] = str(data['subject'])
+            logger.debug("Converted subject to title: %s", data['title'])
+        except Exception as e:
+            logger.warning("Failed to convert subject to string: %s", e)
+            errors.append("subject must be a string")
+    
+    # Специальная проверка для subject, если оно есть
+    if 'subject' in data and not isinstance(data['subject'], str):
+        try:
+            data['subject'] = str(data['subject'])
+            logger.debug("Converted subject to string: %s", data['subject'])
+        except Exception as e:
+            logger.warning("Failed to convert subject to string: %s", e)
+            errors.append("subject must be a string")
+    
+    # Validate required fields
+    required_fields = ['title', 'description', 'pet_type', 'last_seen_address', 'last_seen_date']
+    for field in required_fields:
+        if field not in data or not data[field]:
+            errors.append(f"{field} is required")
+    
+    # Validate title is a string
+    if 'title' in data:
+        if not isinstance(data['title'], str):
+            errors.append("title must be a string")
+            # Попытка преобразования title в строку
+            try:
+                data['title'] = str(data['title'])
+                logger.debug("Converted title to string: %s", data['title'])
+            except Exception as e:
+                logger.warning("Failed to convert title to string: %s", e)
+    
+    # Validate pet_type
+    valid_pet_types = ['cat', 'dog', 'bird', 'other']
+    if 'pet_type' in data and data['pet_type'] not in valid_pet_types:
+        errors.append(f"pet_type must be one of: {', '.join(valid_pet_types)}")
+    
+    # Validate status
+    valid_statuses = ['missing', 'found']
+    if 'status' in data and data['status'] not in valid_statuses:
+        errors.append(f"status must be one of: {', '.join(valid_statuses)}")
+    
+    # Validate coordinates if present
+    if 'latitude' in data and data['latitude']:
+        try:
+            float(data['latitude'])
+        except (ValueError, TypeError):
+            errors.append("latitude must be a valid number")
+    
+    if 'longitude' in data and data['longitude']:
+        try:
+            float(data['longitude'])
+        except (ValueError, TypeError):
+            errors.append("longitude must be a valid number")
+    
+    return errors
+
+
+def parse_date(value):
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+def build_pet_data(data, user_id, image_url=None):
+    """PetPost(**kwargs) for fields that passed validate_pet_data; raises ValueError."""
+    try:
+        last_seen_date = parse_date(data['last_seen_date'])
+    except ValueError as e:
+        raise ValueError(f"Invalid date format: {str(e)}") from e
+
+    latitude = None
+    longitude = None
+    try:
+        if 'latitude' in data and data['latitude']:
+            latitude = float(data['latitude'])
+        if 'longitude' in data and data['longitude']:
+            longitude = float(data['longitude'])
+    except ValueError as e:
+        raise ValueError(f"Invalid coordinate format: {str(e)}") from e
+
+    return {
+        'title': data['title'],
+        'description': data['description'],
+        'pet_type': data['pet_type'],
+        'status': data.get('status', 'missing'),
+        'image_url': image_url,
+        'last_seen_address': data['last_seen_address'],
+        'last_seen_date': last_seen_date,
+        'latitude': latitude,
+        'longitude': longitude,
+        'user_id': user_id
+    }
+
+
+# Imported records may carry an image URL: an external one, or one of ours
+# when restoring a backup
+def valid_image_url(url):
+    return url.startswith(('http://', 'https://', UPLOAD_URL_PREFIX))
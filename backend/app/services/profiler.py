@@ -0,0 +1,126 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StackSampler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread.
+
+    The result is in collapsed format ("frame;frame;frame count" per line),
+    which flamegraph.pl, speedscope and inferno read directly.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            if path.startswith(_BACKEND_DIR):
+                path = os.path.relpath(path, _BACKEND_DIR)
+            else:
+                # site-packages/flask/app.py -> flask/app.py
+                path = path.rsplit('site-packages' + os.sep, 1)[-1]
+            label = self._labels[code] = f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+        return label
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+
+def write_folded(path, stacks):
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+def _wants_profile(config):
+    mode = config['PROFILE_REQUESTS']
+    if mode == 'all':
+        return True
+    token = config['PROFILE_TOKEN']
+    return mode == 'header' and bool(token) and request.headers.get('X-Profile') == token
+
+
+def _start_profile():
+    if not _wants_profile(current_app.config):
+        return
+    g.profile_started = time.perf_counter()
+    g.profiler = StackSampler(threading.get_ident(), current_app.config['PROFILE_INTERVAL']).start()
+
+
+def _finish_profile(response):
+    sampler = g.pop('profiler', None)
+    if sampler is None:
+        return response
+    stacks = sampler.stop()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+    config = current_app.config
+    # An explicit X-Profile request always gets its profile, even an empty one
+    forced = 'X-Profile' in request.headers
+    if not forced and (not stacks or elapsed_ms < config['PROFILE_SLOW_MS']):
+        return response
+
+    endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+    name = f'{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{endpoint}-{elapsed_ms:.0f}ms.folded'
+    try:
+        os.makedirs(config['PROFILE_DIR'], exist_ok=True)
+        write_folded(os.path.join(config['PROFILE_DIR'], name), stacks)
+    except OSError:
+        logger.exception("Could not write profile %s", name)
+        return response
+    logger.info("Profiled %s %s in %.0f ms: %s", request.method, request.path, elapsed_ms, name)
+    if forced:
+        response.headers['X-Profile-File'] = name
+    return response
+
+
+def _discard_profile(exc):
+    # Requests that never reached after_request
+    sampler = g.pop('profiler', None)
+    if sampler is not None:
+        sampler.stop()
+
+
+def init_profiler(app):
+    if app.config['PROFILE_REQUESTS'] == 'off':
+        return
+    if not app.config['PROFILE_DIR']:
+        app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_discard_profile)
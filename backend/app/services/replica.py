@@ -0,0 +1,53 @@
+from functools import wraps
+
+from flask import Response
+
+from flask_sqlalchemy.session import Session
+
+# Bind key of the optional read replica (SQLALCHEMY_REPLICA_URI)
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """Sends reads to the replica while a @use_replica view is running.
+
+    Flushes always go to the primary, and without a configured replica
+    everything does.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_replica') and not self._flushing:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reading_replica(iterable):
+    # Streamed bodies (stream_with_context) run after the view has returned;
+    # the flag is set again around them
+    from app import db
+    session = db.session()
+    session.info['read_replica'] = True
+    try:
+        yield from iterable
+    finally:
+        session.info.pop('read_replica', None)
+
+
+def use_replica(f):
+    """Run a read-only view, and its streamed response, against the read replica
+    if one is configured."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        from app import db
+        session = db.session()
+        session.info['read_replica'] = True
+        try:
+            response = f(*args, **kwargs)
+        finally:
+            session.info.pop('read_replica', None)
+        if isinstance(response, Response) and response.is_streamed:
+            response.response = _reading_replica(response.response)
+        return response
+    return decorated
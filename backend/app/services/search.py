@@ -0,0 +1,173 @@
+import math
+import re
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import and_, case, column, delete, distinct, false, func, insert, literal, literal_column, or_, select, table, text
+
+from app import db
+from app.models.pet_post import PetPost
+from app.models.search_index import SearchDocument, SearchTerm
+from app.services import changes
+
+SEARCH_FIELDS = ('title', 'description', 'last_seen_address')
+FTS_TABLE = 'pet_posts_fts'
+
+# BM25 parameters and per-field weights (title matters most, then address)
+BM25_K1 = 1.2
+BM25_B = 0.75
+FIELD_WEIGHTS = {'title': 10.0, 'description': 1.0, 'last_seen_address': 2.0}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_MAX_TERM_LENGTH = 64
+
+_fts = table(FTS_TABLE, column('rowid'), column(FTS_TABLE), *[column(field) for field in SEARCH_FIELDS])
+
+
+def tokenize(value):
+    if not value:
+        return []
+    return [token[:_MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(value.lower())]
+
+
+def query_tokens(q):
+    tokens = []
+    for token in tokenize(q):
+        if token not in tokens:
+            tokens.append(token)
+    return tokens[:current_app.config['SEARCH_MAX_TOKENS']]
+
+
+def _fts5_available(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        rows = connection.exec_driver_sql('PRAGMA compile_options').fetchall()
+    except Exception:
+        return False
+    return any(row[0] == 'ENABLE_FTS5' for row in rows)
+
+
+def search_backend():
+    return current_app.extensions['pet_search_backend']
+
+
+# Pick the backend and make sure its index exists and is populated
+def init_search(app):
+    with db.engine.begin() as connection:
+        backend = app.config['SEARCH_BACKEND']
+        if backend == 'auto':
+            backend = 'fts5' if _fts5_available(connection) else 'inverted'
+        app.extensions['pet_search_backend'] = backend
+
+        if backend == 'fts5':
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(SEARCH_FIELDS)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+            indexed = connection.execute(select(func.count()).select_from(_fts)).scalar()
+        else:
+            indexed = connection.execute(select(func.count()).select_from(SearchDocument)).scalar()
+        total = connection.execute(select(func.count()).select_from(PetPost)).scalar()
+        if indexed != total:
+            _rebuild(connection, backend)
+
+
+def _rebuild(connection, backend):
+    if backend == 'fts5':
+        connection.execute(delete(_fts))
+    else:
+        connection.execute(delete(SearchTerm.__table__))
+        connection.execute(delete(SearchDocument.__table__))
+    rows = connection.execute(select(PetPost.id, *[getattr(PetPost, field) for field in SEARCH_FIELDS]))
+    for row in rows.mappings().all():
+        _index_post(connection, backend, row['id'], row)
+
+
+def rebuild_search_index():
+    with db.engine.begin() as connection:
+        _rebuild(connection, search_backend())
+
+
+def _index_post(connection, backend, post_id, values):
+    if backend == 'fts5':
+        connection.execute(insert(_fts).values(rowid=post_id, **{field: values.get(field) or '' for field in SEARCH_FIELDS}))
+        return
+    terms = Counter()
+    for field in SEARCH_FIELDS:
+        terms.update(tokenize(values.get(field)))
+    if terms:
+        connection.execute(insert(SearchTerm.__table__), [
+            {'term': term, 'post_id': post_id, 'tf': tf} for term, tf in terms.items()
+        ])
+    connection.execute(insert(SearchDocument.__table__).values(post_id=post_id, length=sum(terms.values())))
+
+
+def _unindex_post(connection, backend, post_id):
+    if backend == 'fts5':
+        connection.execute(delete(_fts).where(_fts.c.rowid == post_id))
+        return
+    connection.execute(delete(SearchTerm.__table__).where(SearchTerm.post_id == post_id))
+    connection.execute(delete(SearchDocument.__table__).where(SearchDocument.post_id == post_id))
+
+
+# Keep the index in the same transaction as the post write
+@changes.on_flush
+def update_search_index(session, post_changes):
+    backend = search_backend()
+    connection = session.connection()
+    for change in post_changes:
+        if change.kind == 'update' and all(change.old[f] == change.new[f] for f in SEARCH_FIELDS):
+            continue
+        if change.kind in ('update', 'delete'):
+            _unindex_post(connection, backend, change.post_id)
+        if change.kind in ('insert', 'update'):
+            _index_post(connection, backend, change.post_id, change.new)
+
+
+def _fts5_matches(tokens):
+    # Every token must match; the last one is a prefix so "lab" finds "labrador"
+    match = ' '.join(f'"{token}"' for token in tokens[:-1])
+    match = f'{match} "{tokens[-1]}"*'.strip()
+    weights = [FIELD_WEIGHTS[field] for field in SEARCH_FIELDS]
+    score = -func.bm25(literal_column(FTS_TABLE), *weights)
+    return select(_fts.c.rowid.label('post_id'), score.label('score')) \
+        .where(literal_column(FTS_TABLE).op('MATCH')(match)) \
+        .subquery('search_matches')
+
+
+def _inverted_matches(tokens):
+    conditions = [SearchTerm.term == token for token in tokens[:-1]]
+    conditions.append(and_(SearchTerm.term >= tokens[-1], SearchTerm.term < tokens[-1] + '\uffff'))
+
+    total_docs, avg_length = db.session.execute(
+        select(func.count(), func.avg(SearchDocument.length))
+    ).one()
+    avg_length = float(avg_length or 1.0)
+
+    score_terms = []
+    for condition in conditions:
+        df = db.session.execute(select(func.count(distinct(SearchTerm.post_id))).where(condition)).scalar()
+        idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * SearchDocument.length / avg_length)
+        score_terms.append(case((condition, idf * SearchTerm.tf * (BM25_K1 + 1) / (SearchTerm.tf + norm)), else_=0.0))
+
+    matched = func.count(distinct(case(*[(condition, index) for index, condition in enumerate(conditions)])))
+    return select(SearchTerm.post_id.label('post_id'), func.sum(sum(score_terms)).label('score')) \
+        .join(SearchDocument, SearchDocument.post_id == SearchTerm.post_id) \
+        .where(or_(*conditions)) \
+        .group_by(SearchTerm.post_id) \
+        .having(matched == len(conditions)) \
+        .subquery('search_matches')
+
+
+# Subquery of (post_id, score) for posts matching q, higher score = better match.
+# A q without any searchable word ("!!!") matches nothing.
+def ranked_matches(q):
+    tokens = query_tokens(q)
+    if not tokens:
+        return select(SearchDocument.post_id.label('post_id'), literal(0.0).label('score')) \
+            .where(false()).subquery('search_matches')
+    if search_backend() == 'fts5':
+        return _fts5_matches(tokens)
+    return _inverted_matches(tokens)
@@ -0,0 +1,365 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, delete, select, update
+
+from app import db
+from app.models.image_blob import ImageBlob, blob_key
+from app.models.pet_post import PetPost
+from app.services import changes
+from app.services.image_hashes import forget_hashes, hash_image
+from app.services.images import FORMATS, UPLOAD_URL_PREFIX, VARIANTS, build_variants, variant_filename
+from app.services.jobs import enqueue, release_idempotency_keys, task
+from app.services.metrics import UPLOAD_BYTES, UPLOAD_SECONDS, UPLOADS
+from app.services.uploads import incoming_dir, sniff_image_type
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Where image bytes live. Keys look like 'ab/<sha256>.jpg'."""
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def put_file(self, source_path, key):
+        # Takes ownership of source_path (it is moved, not copied)
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        # Backends without a local filesystem return None
+        return None
+
+    def iter_keys(self):
+        # Yields (key, modified_timestamp) for every stored object
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root, url_prefix=UPLOAD_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def local_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def put_file(self, source_path, key):
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+
+    def delete(self, key):
+        try:
+            os.unlink(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return self.url_prefix + key
+
+    def iter_keys(self):
+        for shard in os.listdir(self.root):
+            shard_path = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+            for entry in os.scandir(shard_path):
+                if entry.is_file():
+                    yield f"{shard}/{entry.name}", entry.stat().st_mtime
+
+
+STORE_BACKENDS = {
+    'local': lambda app: LocalBlobStore(app.config['UPLOAD_FOLDER'])
+}
+
+
+def get_store():
+    app = current_app._get_current_object()
+    store = app.extensions.get('image_store')
+    if store is None:
+        store = app.extensions['image_store'] = STORE_BACKENDS[app.config['IMAGE_STORE_BACKEND']](app)
+    return store
+
+
+# Store a sniffed upload (see UploadSpool) and return its URL.
+# Identical content is written once; re-uploads only touch the blob row.
+def store_upload(spool):
+    started = time.perf_counter()
+    UPLOAD_BYTES.inc(spool.size)
+    store = get_store()
+    digest = spool.sha256
+    blob = db.session.get(ImageBlob, digest)
+    if blob is not None and store.exists(blob.key):
+        spool.discard()
+        blob.last_used_at = datetime.utcnow()
+        UPLOADS.inc(result='deduplicated')
+        UPLOAD_SECONDS.observe(time.perf_counter() - started)
+        return store.url(blob.key)
+
+    if blob is None:
+        blob = ImageBlob(digest, spool.extension, spool.size)
+        db.session.add(blob)
+    blob.last_used_at = datetime.utcnow()
+
+    key = blob.key
+    local_path = store.local_path(key)
+    if local_path is not None:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        spool.commit(local_path)
+        schedule_processing(digest, local_path)
+    else:
+        store.put_file(spool.detach(), key)
+    UPLOADS.inc(result='stored')
+    UPLOAD_SECONDS.observe(time.perf_counter() - started)
+    return store.url(key)
+
+
+def _processing_key(digest):
+    return f'process_image:{digest}'
+
+
+# Variants and perceptual hashes are derived once per distinct image,
+# by a job committed together with the post
+def schedule_processing(digest, local_path):
+    if current_app.config['IMAGE_PROCESSING_ASYNC']:
+        enqueue('process_image', {'digest': digest}, idempotency_key=_processing_key(digest))
+    else:
+        _process_image(digest, local_path)
+
+
+def _process_image(digest, local_path):
+    built = build_variants(local_path, current_app.config['IMAGE_MAX_PIXELS'])
+    # hash_image commits on its own connection, before this session writes
+    hash_image(digest, local_path)
+    if built:
+        mark_variants_ready(digest)
+
+
+def mark_variants_ready(digest):
+    """Record that the variants of a stored image exist. Posts using it are
+    updated through the ORM, so the feed index and live clients see the change."""
+    db.session.execute(update(ImageBlob).where(ImageBlob.digest == digest).values(variants_ready=True))
+    for post in PetPost.query.filter_by(image_digest=digest, image_variants_ready=False):
+        post.image_variants_ready = True
+
+
+@task('process_image', priority=10)
+def process_image_job(digest):
+    blob = db.session.get(ImageBlob, digest)
+    local_path = get_store().local_path(blob.key) if blob is not None else None
+    if local_path is not None and os.path.exists(local_path):
+        _process_image(digest, local_path)
+        db.session.commit()
+
+
+def build_missing_variants(batch_size=200):
+    """Build variants for stored images that have none yet. Returns (built, failed)."""
+    store = get_store()
+    max_pixels = current_app.config['IMAGE_MAX_PIXELS']
+    built = failed = 0
+    after = ''
+    while True:
+        blobs = ImageBlob.query.filter(ImageBlob.variants_ready.is_(False), ImageBlob.digest > after) \
+            .order_by(ImageBlob.digest).limit(batch_size).all()
+        if not blobs:
+            break
+        after = blobs[-1].digest
+        for blob in blobs:
+            local_path = store.local_path(blob.key)
+            if local_path is not None and os.path.exists(local_path) and build_variants(local_path, max_pixels):
+                mark_variants_ready(blob.digest)
+                built += 1
+            else:
+                failed += 1
+        db.session.commit()
+    return built, failed
+
+
+def _legacy_path(image_url):
+    # /static/uploads/<uuid>.jpg from before the blob store, inside UPLOAD_FOLDER only
+    if not image_url or not image_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    root = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    path = os.path.realpath(os.path.join(root, image_url[len(UPLOAD_URL_PREFIX):]))
+    return path if path.startswith(root + os.sep) and os.path.isfile(path) else None
+
+
+def import_legacy_file(path):
+    """Add a file from outside the blob store to it (copied, the original stays).
+    Returns the stored URL, or None if it is not a supported image."""
+    with open(path, 'rb') as f:
+        extension = sniff_image_type(f.read(16))
+        if extension is None:
+            return None
+        f.seek(0)
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    store = get_store()
+    blob = db.session.get(ImageBlob, digest)
+    if blob is None:
+        blob = ImageBlob(digest, extension, os.path.getsize(path))
+        db.session.add(blob)
+    blob.last_used_at = datetime.utcnow()
+    if not store.exists(blob.key):
+        directory = incoming_dir(current_app.config['UPLOAD_FOLDER'])
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='legacy-', suffix='.part')
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        store.put_file(tmp_path, blob.key)
+        local_path = store.local_path(blob.key)
+        if local_path is not None:
+            schedule_processing(digest, local_path)
+    return store.url(blob.key)
+
+
+def import_legacy_uploads(batch_size=200):
+    """Move posts whose image predates the blob store (uuid-named files) onto it,
+    so they get variants, hashes and reference counts. Returns (imported, missing)."""
+    imported = missing = 0
+    after = 0
+    while True:
+        posts = PetPost.query.filter(PetPost.image_url.isnot(None), PetPost.image_digest.is_(None),
+                                     PetPost.id > after).order_by(PetPost.id).limit(batch_size).all()
+        if not posts:
+            break
+        after = posts[-1].id
+        for post in posts:
+            path = _legacy_path(post.image_url)
+            url = import_legacy_file(path) if path else None
+            if url is None:
+                logger.warning("Cannot import image %s of post %s", post.image_url, post.id)
+                missing += 1
+                continue
+            post.image_url = url  # image_digest and the reference count follow
+            imported += 1
+        db.session.commit()
+    return imported, missing
+
+
+# Reference counts follow image_digest on pet posts, inside the same transaction
+@changes.on_flush
+def update_ref_counts(session, post_changes):
+    deltas = {}
+    for change in post_changes:
+        old = change.old.get('image_digest') if change.old else None
+        new = change.new.get('image_digest') if change.new else None
+        if old == new:
+            continue
+        if old:
+            deltas[old] = deltas.get(old, 0) - 1
+        if new:
+            deltas[new] = deltas.get(new, 0) + 1
+
+    connection = session.connection()
+    for digest, delta in deltas.items():
+        if delta:
+            connection.execute(update(ImageBlob.__table__)
+                               .where(ImageBlob.digest == digest)
+                               .values(ref_count=ImageBlob.ref_count + delta))
+
+
+def _variant_keys(key):
+    return [variant_filename(key, variant, fmt) for variant in VARIANTS for fmt in FORMATS]
+
+
+def collect_garbage(digests=None, grace_seconds=None):
+    """Delete unreferenced blobs (and their variants). Returns the number removed.
+
+    Blobs touched within the grace period are kept, so an upload that is still
+    waiting for its post to commit isn't collected from under it.
+    """
+    store = get_store()
+    if grace_seconds is None:
+        grace_seconds = current_app.config['IMAGE_GC_GRACE_SECONDS']
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    condition = and_(ImageBlob.ref_count <= 0, ImageBlob.last_used_at < cutoff)
+    if digests is not None:
+        condition = and_(condition, ImageBlob.digest.in_(list(digests)))
+
+    removed = 0
+    with db.engine.begin() as connection:
+        candidates = connection.execute(
+            select(ImageBlob.digest, ImageBlob.extension).where(condition)
+        ).all()
+        for digest, extension in candidates:
+            # Re-check under the delete in case the blob was re-referenced meanwhile
+            result = connection.execute(delete(ImageBlob.__table__).where(ImageBlob.digest == digest, condition))
+            if result.rowcount:
+                forget_hashes(connection, [digest])
+                # The same content uploaded again is processed again
+                release_idempotency_keys(connection, [_processing_key(digest)])
+                key = blob_key(digest, extension)
+                for stale in [key] + _variant_keys(key):
+                    store.delete(stale)
+                removed += 1
+    if removed:
+        logger.info("Collected %s unreferenced images", removed)
+    return removed
+
+
+def collect_orphan_files(grace_seconds=None):
+    # Stored files with no blob row, e.g. the post insert failed after the upload
+    store = get_store()
+    if grace_seconds is None:
+        grace_seconds = current_app.config['IMAGE_GC_GRACE_SECONDS']
+    cutoff = datetime.utcnow().timestamp() - grace_seconds
+    known = set(db.session.execute(select(ImageBlob.digest)).scalars())
+    removed = 0
+    for key, modified in list(store.iter_keys()):
+        digest = key.rsplit('/', 1)[-1].split('.', 1)[0].split('_', 1)[0]
+        if digest not in known and modified < cutoff:
+            store.delete(key)
+            removed += 1
+    return removed
+
+
+# Images dropped by an update or delete are collected by a job once they have
+# been unreferenced for IMAGE_GC_GRACE_SECONDS
+@changes.on_flush
+def release_images(session, post_changes):
+    released = set()
+    for change in post_changes:
+        old = change.old.get('image_digest') if change.old else None
+        new = change.new.get('image_digest') if change.new else None
+        if old and old != new:
+            released.add(old)
+    if released:
+        _schedule_collection(sorted(released), current_app.config['IMAGE_GC_GRACE_SECONDS'], session)
+
+
+def _schedule_collection(digests, delay, session=None):
+    enqueue('collect_images', {'digests': digests}, delay=delay + 1, session=session)
+
+
+@task('collect_images')
+def collect_images_job(digests):
+    collect_garbage(digests)
+    # Blobs used again meanwhile (e.g. a re-upload whose post failed) may be
+    # unreferenced but still inside the grace window: look at them again later
+    grace_seconds = current_app.config['IMAGE_GC_GRACE_SECONDS']
+    pending = db.session.execute(
+        select(ImageBlob.digest, ImageBlob.last_used_at)
+        .where(ImageBlob.digest.in_(digests), ImageBlob.ref_count <= 0)
+    ).all()
+    if pending:
+        newest = max(last_used_at for _, last_used_at in pending)
+        remaining = grace_seconds - (datetime.utcnow() - newest).total_seconds()
+        _schedule_collection(sorted(digest for digest, _ in pending), max(0, remaining))
+        db.session.commit()
@@ -0,0 +1,62 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class RateLimiter:
+    """Per-key token buckets: `limit` attempts, refilled evenly over `period` seconds.
+
+    Kept in process memory (LRU-bounded), so with several workers each one
+    enforces its own budget.
+    """
+
+    def __init__(self, limit, period, max_keys=100000):
+        self.limit = limit
+        self.rate = limit / period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.limit, now))
+        return min(self.limit, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key):
+        """Seconds until key may try again (0 if it may now)."""
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        return 0 if tokens >= 1 else math.ceil((1 - tokens) / self.rate)
+
+    def hit(self, key):
+        """Spend one attempt; returns the retry delay instead if none is left."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                return math.ceil((1 - tokens) / self.rate)
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+def init_throttle(app):
+    config = app.config
+    app.extensions['auth_throttle'] = {
+        # Every login/register attempt from an address
+        'ip': RateLimiter(*config['AUTH_RATE_LIMIT_IP'], max_keys=config['AUTH_RATE_LIMIT_MAX_KEYS']),
+        # Failed logins per (account, address), reset by a successful one
+        'account': RateLimiter(*config['AUTH_RATE_LIMIT_ACCOUNT'], max_keys=config['AUTH_RATE_LIMIT_MAX_KEYS']),
+    }
+
+
+def get_limiter(name):
+    return current_app.extensions['auth_throttle'][name]
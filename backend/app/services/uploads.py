@@ -0,0 +1,146 @@
+import hashlib
+import os
+import tempfile
+
+from flask import current_app
+from flask.wrappers import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+INCOMING_DIR = '.incoming'
+_SNIFF_BYTES = 16
+
+# Magic-byte signatures of the image types we accept, mapped to a file extension
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_image_type(header):
+    for signature, extension in _SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def incoming_dir(upload_folder):
+    # Lives inside UPLOAD_FOLDER so the final move is a same-filesystem rename
+    return os.path.join(upload_folder, INCOMING_DIR)
+
+
+class UploadSpool:
+    """File-like target for a multipart file part.
+
+    Bytes are written straight to a temp file as the parser reads them, hashed on
+    the way and checked against image signatures as soon as the first chunk
+    arrives, so invalid or oversized uploads are rejected mid-stream.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.extension = None
+        self._header = b''
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', suffix='.part', delete=False)
+        self.path = self._file.name
+        self.committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge(f"Image exceeds the {self.max_bytes} byte limit")
+        if self.extension is None and len(self._header) < _SNIFF_BYTES:
+            self._header += data[:_SNIFF_BYTES - len(self._header)]
+            if len(self._header) >= _SNIFF_BYTES:
+                self._sniff()
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def _sniff(self):
+        self.extension = sniff_image_type(self._header)
+        if self.extension is None:
+            self.discard()
+            raise UnsupportedMediaType('Uploaded file is not a supported image (JPEG, PNG, GIF or WebP)')
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def finalize(self):
+        # Files shorter than the sniff window are checked once the part ends
+        if self.extension is None:
+            if self.size == 0:
+                return False
+            self._sniff()
+        self._file.flush()
+        return True
+
+    def commit(self, destination):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path, destination)
+        self.committed = True
+
+    def detach(self):
+        # Hand the temp file over to the caller, who becomes responsible for it
+        self._file.flush()
+        self._file.close()
+        self.committed = True
+        return self.path
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.committed = True
+
+    # FileStorage reads the part back through these
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.discard()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+class UploadRequest(Request):
+    # Route multipart file parts into UploadSpools instead of SpooledTemporaryFiles
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        directory = incoming_dir(config['UPLOAD_FOLDER'])
+        os.makedirs(directory, exist_ok=True)
+        spool = UploadSpool(directory, config['IMAGE_MAX_BYTES'])
+        self.__dict__.setdefault('_upload_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        # Remove temp files the view didn't move into place, including parts
+        # from a parse that was aborted midway
+        try:
+            super().close()
+        finally:
+            for spool in self.__dict__.get('_upload_spools', ()):
+                spool.discard()
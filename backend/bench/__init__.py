@@ -0,0 +1 @@
+# Benchmark suite: python -m bench.seed / bench.run / bench.compare (see README.md)
@@ -0,0 +1,86 @@
+import json
+import math
+import os
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# Every seeded user has this password (hashing 10k+ passwords would dominate seeding)
+BENCH_PASSWORD = 'bench-password'
+
+
+def app_environ(data_dir):
+    """Environment for an app process working on the dataset in data_dir."""
+    data_dir = os.path.abspath(data_dir)
+    return {
+        'FLASK_ENV': 'bench',
+        'DATABASE_URL': 'sqlite:///' + os.path.join(data_dir, 'bench.db'),
+        'UPLOAD_FOLDER': os.path.join(data_dir, 'uploads'),
+    }
+
+
+def use_dataset(data_dir):
+    # Must run before `app` is imported: config.py reads the environment at import
+    os.environ.update(app_environ(data_dir))
+
+
+def load_dataset(data_dir):
+    with open(os.path.join(data_dir, 'dataset.json')) as f:
+        return json.load(f)
+
+
+def save_dataset(data_dir, meta):
+    with open(os.path.join(data_dir, 'dataset.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--', 'app', 'config.py'], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def _status_kb(pid, field):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb(pid=None):
+    """Peak resident set size (VmHWM) of a process, in MB."""
+    kb = _status_kb(pid or os.getpid(), 'VmHWM')
+    if kb is None and pid is None:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux
+    return round(kb / 1024, 1) if kb else None
+
+
+def child_pids(pid):
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
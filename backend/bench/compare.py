@@ -0,0 +1,46 @@
+"""Compare two benchmark result files (baseline first).
+
+    python -m bench.compare bench/results/A.json bench/results/B.json
+"""
+import argparse
+import json
+
+METRICS = (('p50_ms', False), ('p95_ms', False), ('p99_ms', False), ('throughput_rps', True))
+
+
+def _change(before, after, higher_is_better):
+    if not before or after is None:
+        return ''
+    change = (after - before) / before * 100
+    better = change > 0 if higher_is_better else change < 0
+    return f"{change:+.1f}%{' ✓' if better and abs(change) >= 5 else ' ✗' if abs(change) >= 5 else ''}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        before = json.load(f)
+    with open(args.candidate) as f:
+        after = json.load(f)
+
+    for label, result in (('baseline', before), ('candidate', after)):
+        print(f"{label:<10} {(result.get('commit') or '?')[:8]}{' (dirty)' if result.get('dirty') else ''} "
+              f"{result['mode']} rows={result['dataset']['rows']} {result['settings']}")
+    if before['dataset'] != after['dataset'] or before['settings'] != after['settings']:
+        print("warning: datasets or settings differ, numbers are not directly comparable")
+
+    print(f"\n{'scenario':<18}" + ''.join(f"{metric:>26}" for metric, _ in METRICS))
+    for name, b in before['scenarios'].items():
+        a = after['scenarios'].get(name)
+        if a is None:
+            continue
+        cells = [f"{b[m]}→{a[m]} {_change(b[m], a[m], higher):>9}" for m, higher in METRICS]
+        print(f"{name:<18}" + ''.join(f"{cell:>26}" for cell in cells))
+    print(f"\npeak RSS (MB): {before['peak_rss_mb']} → {after['peak_rss_mb']}")
+
+
+if __name__ == '__main__':
+    main()
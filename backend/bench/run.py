@@ -0,0 +1,274 @@
+"""Run the API benchmarks against a seeded dataset.
+
+    python -m bench.run --data bench/data/10000 --mode inprocess
+    python -m bench.run --data bench/data/10000 --mode gunicorn --workers 4 --threads 4
+
+Each scenario sends --requests requests from --concurrency client threads.
+Latency percentiles, throughput, status codes and peak RSS are printed and
+saved to bench/results/ together with the git commit, for bench.compare.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bench.common import (BACKEND_DIR, RESULTS_DIR, app_environ, child_pids, git_revision, load_dataset,
+                          peak_rss_mb, percentile, use_dataset)
+from bench.scenarios import DEFAULT_SCENARIOS, SCENARIOS, make_rng
+
+
+class InProcessTransport:
+    """Calls the WSGI app directly through Flask's test client (one per thread)."""
+
+    name = 'inprocess'
+
+    def __init__(self, data_dir, args):
+        use_dataset(data_dir)
+        sys.path.insert(0, BACKEND_DIR)
+        from app import create_app
+        self.app = create_app()
+        self._local = threading.local()
+
+    def send(self, request):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(request.path, method=request.method, headers=request.headers, data=request.body)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+    def peak_rss(self):
+        return {'process': peak_rss_mb()}
+
+    def close(self):
+        pass
+
+
+class GunicornTransport:
+    """Starts gunicorn on a local port and talks HTTP/1.1 keep-alive to it."""
+
+    name = 'gunicorn'
+
+    def __init__(self, data_dir, args):
+        self.host = '127.0.0.1'
+        self.port = args.port or self._free_port()
+        worker_class = 'gthread' if args.threads > 1 else 'sync'
+        command = [
+            sys.executable, '-m', 'gunicorn', 'run:app',
+            '--bind', f'{self.host}:{self.port}',
+            '--workers', str(args.workers),
+            '--threads', str(args.threads),
+            '--worker-class', worker_class,
+            '--log-level', 'warning',
+        ]
+        env = dict(os.environ, **app_environ(data_dir))
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+        self._local = threading.local()
+        self._wait_ready(args.startup_timeout)
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with {self.process.returncode}')
+            try:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=5)
+                connection.request('GET', '/api/pets/?limit=1')
+                if connection.getresponse().status == 200:
+                    connection.close()
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.close()
+        raise RuntimeError('gunicorn did not start in time')
+
+    def send(self, request):
+        for attempt in (1, 2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                connection.request(request.method, request.path, body=request.body, headers=request.headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # The server closed a kept-alive connection; retry once on a new one
+                connection.close()
+                self._local.connection = None
+                if attempt == 2:
+                    raise
+
+    def peak_rss(self):
+        workers = [peak_rss_mb(pid) for pid in child_pids(self.process.pid)]
+        workers = [rss for rss in workers if rss is not None]
+        return {
+            'master': peak_rss_mb(self.process.pid),
+            'worker_max': max(workers) if workers else None,
+            'workers_total': round(sum(workers), 1) if workers else None,
+        }
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+TRANSPORTS = {'inprocess': InProcessTransport, 'gunicorn': GunicornTransport}
+
+
+def run_scenario(transport, scenario, ctx, requests, concurrency, warmup, seed):
+    build = SCENARIOS[scenario]
+    for i in range(warmup):
+        transport.send(build(make_rng(seed, -1 - i), ctx))
+
+    # Every request is built up front so the clock only covers the server
+    per_worker = [requests // concurrency + (1 if w < requests % concurrency else 0) for w in range(concurrency)]
+    batches = []
+    for worker, count in enumerate(per_worker):
+        rng = make_rng(seed, worker)
+        batches.append([build(rng, ctx) for _ in range(count)])
+
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(batch):
+        local_latencies = []
+        local_statuses = {}
+        barrier.wait()
+        for request in batch:
+            started = time.perf_counter()
+            try:
+                status, _ = transport.send(request)
+            except Exception as e:
+                status = type(e).__name__
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(batch,)) for batch in batches]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    ok = sum(count for status, count in statuses.items() if isinstance(status, int) and status < 400)
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+def print_table(results):
+    print(f"{'scenario':<18} {'req':>6} {'ok':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  statuses")
+    for name, r in results['scenarios'].items():
+        print(f"{name:<18} {r['requests']:>6} {r['ok']:>6} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}  {r['statuses']}")
+    print(f"peak RSS (MB): {results['peak_rss_mb']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', required=True, help='dataset directory created by bench.seed')
+    parser.add_argument('--mode', choices=sorted(TRANSPORTS), default='inprocess')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"comma separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=500, help='per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--label', default=None, help='added to the result file name')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    dataset = load_dataset(args.data)
+    transport = TRANSPORTS[args.mode](args.data, args)
+    try:
+        ctx = dict(dataset)
+        status, body = transport.send(SCENARIOS['login'](make_rng(args.seed, 0), ctx))
+        if status != 200:
+            raise RuntimeError(f'login failed with {status}: {body[:200]!r}')
+        ctx['token'] = json.loads(body)['access_token']
+
+        results = {'scenarios': {}}
+        for name in scenarios:
+            print(f"Running {name} ...", flush=True)
+            results['scenarios'][name] = run_scenario(transport, name, ctx, args.requests, args.concurrency,
+                                                      args.warmup, args.seed)
+        results['peak_rss_mb'] = transport.peak_rss()
+    finally:
+        transport.close()
+
+    commit, dirty = git_revision()
+    results.update({
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'settings': {key: getattr(args, key) for key in ('requests', 'concurrency', 'warmup', 'seed')},
+        'dataset': {key: dataset[key] for key in ('rows', 'users', 'images', 'seed')},
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+    })
+    if args.mode == 'gunicorn':
+        results['settings'].update(workers=args.workers, threads=args.threads)
+    print_table(results)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = '-'.join(filter(None, [
+            datetime.now().strftime('%Y%m%d-%H%M%S'), (commit or 'nogit')[:8] + ('-dirty' if dirty else ''),
+            args.mode, str(dataset['rows']), args.label
+        ]))
+        path = os.path.join(RESULTS_DIR, name + '.json')
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import io
+import json
+import random
+import uuid
+
+from bench.common import BENCH_PASSWORD
+from bench.seed import CITIES, COLORS, BREEDS
+
+# A scenario turns (rng, context) into a request: (method, path, headers, body).
+# Requests are built before the clock starts, so only the server is timed.
+
+
+class Request:
+    __slots__ = ('method', 'path', 'headers', 'body')
+
+    def __init__(self, method, path, headers=None, body=None):
+        self.method = method
+        self.path = path
+        self.headers = headers or {}
+        self.body = body
+
+
+def _json(method, path, payload):
+    return Request(method, path, {'Content-Type': 'application/json'}, json.dumps(payload).encode())
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    buf = io.BytesIO()
+    for name, value in fields.items():
+        buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, data) in files.items():
+        buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                  f'Content-Type: {content_type}\r\n\r\n'.encode())
+        buf.write(data)
+        buf.write(b'\r\n')
+    buf.write(f'--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', buf.getvalue()
+
+
+def _near_city(rng):
+    lat, lon, _, _ = rng.choice(CITIES)
+    return rng.gauss(lat, 0.05), rng.gauss(lon, 0.08)
+
+
+def list_posts(rng, ctx):
+    params = []
+    if rng.random() < 0.7:
+        params.append(f"status={rng.choice(['missing', 'found'])}")
+    if rng.random() < 0.6:
+        params.append(f"pet_type={rng.choice(['cat', 'dog'])}")
+    params.append('limit=50')
+    return Request('GET', '/api/pets/?' + '&'.join(params))
+
+
+def detail(rng, ctx):
+    return Request('GET', f"/api/pets/{rng.randint(1, ctx['rows'])}")
+
+
+def geo_near(rng, ctx):
+    lat, lon = _near_city(rng)
+    return Request('GET', f"/api/pets/?near={lat:.5f},{lon:.5f}&radius_km={rng.choice([1, 3, 5])}&limit=50")
+
+
+def geo_bbox(rng, ctx):
+    lat, lon = _near_city(rng)
+    d = rng.uniform(0.02, 0.1)
+    return Request('GET', f"/api/pets/?bbox={lon - d:.5f},{lat - d:.5f},{lon + d:.5f},{lat + d:.5f}&limit=50")
+
+
+def clusters(rng, ctx):
+    lat, lon = _near_city(rng)
+    d = rng.choice([0.5, 2, 8])
+    return Request('GET', f"/api/pets/clusters?bbox={lon - d:.4f},{lat - d:.4f},{lon + d:.4f},{lat + d:.4f}&zoom={rng.randint(6, 12)}")
+
+
+def search(rng, ctx):
+    pet_type = rng.choice(['cat', 'dog'])
+    words = [rng.choice(COLORS), rng.choice(BREEDS[pet_type])]
+    return Request('GET', '/api/pets/?q=' + '+'.join(' '.join(words).split()) + '&limit=20')
+
+
+def login(rng, ctx):
+    return _json('POST', '/api/auth/login', {'email': rng.choice(ctx['user_emails']), 'password': BENCH_PASSWORD})
+
+
+def create_with_image(rng, ctx):
+    from bench.seed import make_image
+    lat, lon = _near_city(rng)
+    pet_type = rng.choice(['cat', 'dog'])
+    content_type, body = _multipart({
+        'title': f"Lost {rng.choice(COLORS)} {rng.choice(BREEDS[pet_type])}",
+        'description': 'Benchmark post',
+        'pet_type': pet_type,
+        'status': 'missing',
+        'last_seen_address': 'Benchmark street 1',
+        'last_seen_date': '2025-05-01T10:00:00',
+        'latitude': f'{lat:.6f}',
+        'longitude': f'{lon:.6f}',
+    }, {'image': ('photo.jpg', 'image/jpeg', make_image(rng, 1600, 1200))})
+    return Request('POST', '/api/pets/', {'Content-Type': content_type,
+                                          'Authorization': 'Bearer ' + ctx['token']}, body)
+
+
+SCENARIOS = {
+    'list': list_posts,
+    'detail': detail,
+    'geo_near': geo_near,
+    'geo_bbox': geo_bbox,
+    'clusters': clusters,
+    'search': search,
+    'login': login,
+    'create_with_image': create_with_image,
+}
+DEFAULT_SCENARIOS = ('list', 'detail', 'geo_near', 'search', 'login', 'create_with_image')
+
+
+def make_rng(seed, worker):
+    return random.Random(seed * 1000 + worker)
@@ -0,0 +1,188 @@
+"""Seed a synthetic dataset for the benchmarks.
+
+    python -m bench.seed --rows 100000 --data bench/data/100k
+
+Creates <data>/bench.db and <data>/uploads. Rows are inserted with bulk
+Core statements, then the derived tables (clusters, search index, image
+reference counts) are rebuilt the same way the CLI maintenance commands do.
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bench.common import BENCH_PASSWORD, save_dataset, use_dataset
+
+# Posts cluster around real cities, most of them in Kazakhstan
+CITIES = (
+    (43.2389, 76.8897, 'Алматы', 0.30),
+    (51.1694, 71.4491, 'Астана', 0.20),
+    (42.3417, 69.5901, 'Шымкент', 0.10),
+    (49.8047, 73.1094, 'Караганда', 0.08),
+    (50.2839, 57.1669, 'Актобе', 0.06),
+    (55.7558, 37.6173, 'Москва', 0.14),
+    (59.9343, 30.3351, 'Санкт-Петербург', 0.07),
+    (52.2870, 76.9674, 'Павлодар', 0.05),
+)
+STREETS = ('Абая', 'Достык', 'Назарбаева', 'Толе би', 'Сатпаева', 'Ленина', 'Гагарина', 'Пушкина', 'Мира')
+COLORS = ('black', 'white', 'ginger', 'grey', 'brown', 'tabby', 'spotted', 'cream')
+BREEDS = {
+    'cat': ('siamese', 'persian', 'british shorthair', 'maine coon', 'sphynx', 'mixed'),
+    'dog': ('husky', 'labrador', 'shepherd', 'terrier', 'corgi', 'spaniel', 'mixed'),
+    'bird': ('parrot', 'budgie', 'canary', 'cockatiel'),
+    'other': ('rabbit', 'hamster', 'ferret', 'turtle'),
+}
+FEATURES = ('red collar', 'blue collar', 'no collar', 'microchipped', 'limping', 'very friendly',
+            'shy', 'answers to her name', 'scar on the ear', 'long tail', 'short hair', 'green eyes')
+PET_TYPES = (('dog', 0.45), ('cat', 0.40), ('bird', 0.08), ('other', 0.07))
+
+
+def _pick(rng, weighted):
+    return rng.choices([item for item, _ in weighted], weights=[w for _, w in weighted])[0]
+
+
+def make_post(rng, now, user_ids, image_urls):
+    lat0, lon0, city, _ = rng.choices(CITIES, weights=[c[3] for c in CITIES])[0]
+    pet_type = _pick(rng, PET_TYPES)
+    breed = rng.choice(BREEDS[pet_type])
+    color = rng.choice(COLORS)
+    status = 'missing' if rng.random() < 0.7 else 'found'
+    created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+    has_location = rng.random() < 0.9
+    features = ', '.join(rng.sample(FEATURES, rng.randint(1, 3)))
+    return {
+        'title': f"{'Lost' if status == 'missing' else 'Found'} {color} {breed}",
+        'description': f"{color.capitalize()} {breed} {pet_type}, {features}. Last seen near {rng.choice(STREETS)} street, {city}.",
+        'pet_type': pet_type,
+        'status': status,
+        'image_url': rng.choice(image_urls) if image_urls and rng.random() < 0.6 else None,
+        'last_seen_address': f"{city}, ул. {rng.choice(STREETS)} {rng.randint(1, 250)}",
+        'last_seen_date': created_at - timedelta(hours=rng.randint(1, 72)),
+        'latitude': round(rng.gauss(lat0, 0.06), 6) if has_location else None,
+        'longitude': round(rng.gauss(lon0, 0.09), 6) if has_location else None,
+        'created_at': created_at,
+        'user_id': rng.choice(user_ids),
+    }
+
+
+def make_image(rng, width=1200, height=900):
+    """A JPEG that compresses like a photo (gradient plus noise), not a flat fill."""
+    from PIL import Image, ImageDraw, ImageFilter
+    image = Image.effect_noise((width // 4, height // 4), rng.uniform(40, 90)).convert('RGB').resize((width, height))
+    overlay = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.blend(image, overlay, 0.5)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randint(20, 160)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def seed(rows, users, images, seed_value, chunk_size=5000):
+    from sqlalchemy import insert, text
+
+    from app import db
+    from app.models.image_blob import ImageBlob, blob_key, digest_from_url
+    from app.models.pet_post import PetPost
+    from app.models.user import User
+    from app.services.clusters import rebuild_clusters
+    from app.services.geo import encode_geohash
+    from app.services.images import UPLOAD_URL_PREFIX
+    from app.services.search import rebuild_search_index
+    from app.services.storage import get_store
+    import hashlib
+    import tempfile
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+
+    print(f"Creating {users} users")
+    password_hash = User('x', 'x', BENCH_PASSWORD).password_hash
+    db.session.execute(insert(User), [
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password_hash': password_hash,
+         'created_at': now} for i in range(users)
+    ])
+    db.session.commit()
+    user_ids = [row[0] for row in db.session.execute(text('SELECT id FROM users'))]
+
+    print(f"Creating {images} images")
+    store = get_store()
+    image_urls = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(images):
+            data = make_image(rng)
+            digest = hashlib.sha256(data).hexdigest()
+            path = os.path.join(tmp, 'image.jpg')
+            with open(path, 'wb') as f:
+                f.write(data)
+            key = blob_key(digest, 'jpg')
+            store.put_file(path, key)
+            db.session.add(ImageBlob(digest, 'jpg', len(data)))
+            image_urls.append(UPLOAD_URL_PREFIX + key)
+    db.session.commit()
+
+    print(f"Creating {rows} pet posts")
+    started = time.perf_counter()
+    for offset in range(0, rows, chunk_size):
+        batch = [make_post(rng, now, user_ids, image_urls) for _ in range(min(chunk_size, rows - offset))]
+        for post in batch:
+            # Core inserts skip the ORM listeners that fill these in
+            post['geohash'] = encode_geohash(post['latitude'], post['longitude']) \
+                if post['latitude'] is not None else None
+            post['image_digest'] = digest_from_url(post['image_url'])
+        db.session.execute(insert(PetPost), batch)
+        db.session.commit()
+        done = offset + len(batch)
+        print(f"  {done}/{rows} ({done / (time.perf_counter() - started):.0f} rows/s)", end='\r')
+    print()
+
+    print("Rebuilding clusters, search index and image reference counts")
+    rebuild_clusters()
+    rebuild_search_index()
+    db.session.execute(text(
+        'UPDATE image_blobs SET ref_count = '
+        '(SELECT count(*) FROM pet_posts WHERE pet_posts.image_digest = image_blobs.digest)'
+    ))
+    db.session.commit()
+    return {'rows': rows, 'users': users, 'images': images, 'seed': seed_value,
+            'user_emails': [f'bench{i}@example.com' for i in range(min(users, 1000))]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=None, help='default: rows / 20')
+    parser.add_argument('--images', type=int, default=200, help='distinct images shared by the posts')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data', default=None, help='dataset directory (default: bench/data/<rows>)')
+    parser.add_argument('--force', action='store_true', help='replace an existing dataset')
+    args = parser.parse_args(argv)
+
+    data_dir = args.data or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', str(args.rows))
+    if os.path.exists(data_dir):
+        if not args.force:
+            sys.exit(f"{data_dir} exists, use --force to replace it")
+        shutil.rmtree(data_dir)
+    os.makedirs(os.path.join(data_dir, 'uploads'))
+    use_dataset(data_dir)
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        meta = seed(args.rows, args.users or max(10, args.rows // 20), args.images, args.seed)
+        meta['seconds'] = round(time.perf_counter() - started, 1)
+    save_dataset(data_dir, meta)
+    print(f"Dataset ready in {data_dir} ({meta['seconds']}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,24 +5,194 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard-to-guess-string'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///findmypet.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Reverse proxies in front of the app (nginx: 1); their X-Forwarded-For /
+    # X-Forwarded-Proto are trusted, so request.remote_addr is the client
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+    DB_AUTO_MIGRATE = True  # run `flask db upgrade` from create_app
+
+    # Engine tuning. SQLite: WAL lets readers run alongside the single writer and
+    # busy_timeout waits for the lock instead of failing with "database is locked".
+    # Server databases (PostgreSQL/MySQL) use the pool settings below.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',  # durable with WAL, fsync only at checkpoints
+        'busy_timeout': 5000,  # ms
+        'cache_size': -16000,  # KiB
+        'mmap_size': 128 * 1024 * 1024,
+    }
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800  # seconds, below typical server idle timeouts
+    DB_POOL_PRE_PING = True
+    # Optional read replica for the public read-only endpoints (may lag the primary)
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-string'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
-    UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app/static/uploads')
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app/static/uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    IMAGE_MAX_BYTES = 10 * 1024 * 1024  # per image, enforced while streaming
+
+    # Resized WebP/JPEG variants and perceptual hashes are built by a background job
+    IMAGE_PROCESSING_ASYNC = True
+    IMAGE_MAX_PIXELS = 40_000_000  # refuse decompression bombs
+
+    # Similar photos (GET /api/pets/<id>/similar-images): pHash bits that may differ
+    IMAGE_SIMILARITY_MAX_DISTANCE = 10
+
+    # Content-addressed image storage ('local' writes under UPLOAD_FOLDER)
+    IMAGE_STORE_BACKEND = os.environ.get('IMAGE_STORE_BACKEND', 'local')
+    IMAGE_GC_GRACE_SECONDS = 3600  # unreferenced images younger than this are kept
+
+    # Response cache for the public listing/detail endpoints
+    CACHE_ENABLED = True
+    CACHE_TTL = int(os.environ.get('CACHE_TTL', 30))  # seconds
+    CACHE_MAX_ENTRIES = 1024
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')  # optional shared tier (needs `redis`)
+
+    # Upload serving: content-addressed files are cached forever by clients.
+    # Set the prefix to an nginx `internal` location to serve them via X-Accel-Redirect.
+    UPLOADS_LEGACY_MAX_AGE = 3600
+    UPLOADS_ACCEL_REDIRECT_PREFIX = os.environ.get('UPLOADS_ACCEL_REDIRECT_PREFIX')
+
+    # JSON encoding: 'auto' uses orjson when installed, 'json' forces the stdlib
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+
+    # Listing pagination
+    PETS_PAGE_SIZE = int(os.environ.get('PETS_PAGE_SIZE', 50))
+    PETS_PAGE_SIZE_MAX = int(os.environ.get('PETS_PAGE_SIZE_MAX', 200))
+    PETS_STREAM_BATCH_SIZE = 500  # rows fetched per round-trip in NDJSON mode
+
+    # Bulk import (flask pets import, POST /api/pets/import)
+    BULK_IMPORT_CHUNK_SIZE = 500  # rows per transaction
+    BULK_IMPORT_MAX_ERRORS = 100  # per-row errors reported back
+
+    # In-memory index for plain feed pages (pet_type/status filters only).
+    # Local commits apply immediately; other workers' writes within FEED_INDEX_MAX_AGE
+    # (plus the background rebuild).
+    # Requests with ?consistency=strong always go to SQL.
+    FEED_INDEX_ENABLED = True
+    FEED_INDEX_MAX_AGE = 60  # seconds between rebuilds from the database
+    FEED_INDEX_MAX_POSTS = 100_000  # newest posts kept; older pages are read from SQL
+
+    # Live feed (GET /api/pets/live, Server-Sent Events). Each open stream holds a
+    # worker thread, so run gunicorn with --worker-class gthread (or gevent).
+    # With several workers, start `flask pets live-broker` and point LIVE_BROKER_URL at it.
+    LIVE_ENABLED = True
+    LIVE_BROKER_URL = os.environ.get('LIVE_BROKER_URL')  # tcp://127.0.0.1:7001
+    LIVE_MAX_SUBSCRIBERS = 500  # per process
+    LIVE_QUEUE_SIZE = 100  # undelivered events per subscriber before it is dropped
+    LIVE_HEARTBEAT = 15  # seconds between keep-alive comments
+
+    # Geo search (near=lat,lon&radius_km= and bbox=west,south,east,north)
+    GEO_DEFAULT_RADIUS_KM = 5.0
+    GEO_MAX_RADIUS_KM = 100.0
+    GEO_MAX_CELLS = 16  # geohash cells scanned per bounding box
+    GEO_MAX_CANDIDATES = 5000
+    CLUSTER_MAX_CELLS = 32  # geohash prefixes looked up per clusters request
+
+    # Offline geocoding for pet posts: a form with only an address gets coordinates
+    # and vice versa. The gazetteer (default instance/gazetteer.bin) is built from a
+    # name,latitude,longitude CSV by `flask pets build-gazetteer`. GEOCODING_PROVIDER
+    # may also name a provider class ('package.module:Class', constructed with the app).
+    GEOCODING_PROVIDER = os.environ.get('GEOCODING_PROVIDER', 'gazetteer')  # or 'off'
+    GEOCODING_GAZETTEER_PATH = os.environ.get('GEOCODING_GAZETTEER_PATH')
+    GEOCODING_CACHE_SIZE = 10000
+    GEOCODING_CACHE_TTL = 86400  # seconds
+    GEOCODING_REVERSE_MAX_KM = 1.0  # nearest named place further than this is not used
+
+    # Background jobs (matching, image processing, image GC) are stored in the
+    # database and run by `flask worker`, in development too. Eager mode (opt-in,
+    # for tests and one-off scripts) runs them on the thread that committed the
+    # enqueuing transaction, so requests wait for them. Priorities: lower runs first.
+    JOBS_EAGER = os.environ.get('JOBS_EAGER', '').lower() in ('1', 'true')
+    JOBS_POLL_INTERVAL = 1.0  # seconds a worker sleeps when the queue is empty
+    JOBS_VISIBILITY_TIMEOUT = 300  # seconds before a claimed job counts as abandoned
+    JOBS_MAX_ATTEMPTS = 5
+    JOBS_BACKOFF_BASE = 5  # seconds, doubled after each failed attempt
+    JOBS_BACKOFF_MAX = 3600
+    JOBS_RETENTION = 86400  # seconds finished jobs are kept (failed ones stay)
+    JOBS_PURGE_INTERVAL = 600
+
+    # Lost/found matching, updated (by a background job) whenever a post is written. Candidates are posts of
+    # the same pet type and opposite status within the radius and the date window.
+    MATCHING_ENABLED = True
+    MATCH_RADIUS_KM = 25.0
+    MATCH_MAX_DAYS = 60
+    MATCH_MAX_CANDIDATES = 500
+    MATCH_MIN_SCORE = 0.35
+    MATCH_MAX_PER_POST = 20
+    MATCH_WEIGHTS = {'distance': 0.45, 'time': 0.3, 'text': 0.25}
+
+    # Full-text search (?q=): 'auto' uses SQLite FTS5 when available, else 'inverted'
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+    SEARCH_MAX_TOKENS = 8
     
     # JWT configuration
     JWT_ERROR_MESSAGE_KEY = 'message'
     JWT_IDENTITY_CLAIM = 'sub'
 
+    # Logging: records go through a queue to a background thread; JSON in production.
+    # DEBUG records can be sampled, and these headers are never logged verbatim.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_ASYNC = True
+    LOG_QUEUE_SIZE = 10000  # records beyond this are dropped instead of blocking
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    LOG_REDACT_HEADERS = ('Authorization', 'Cookie', 'Set-Cookie', 'X-Api-Key')
+
+    # Password hashing. Changing the method rehashes each password at its next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # per process
+    PASSWORD_HASH_QUEUE = 8  # waiting hashes beyond the workers before answering 503
+    PASSWORD_HASH_TIMEOUT = 10  # seconds
+
+    # Login/register throttling: (attempts, seconds), per process. Clients are
+    # told apart by address, so behind a reverse proxy set TRUSTED_PROXIES.
+    AUTH_RATE_LIMIT_IP = (30, 60)
+    AUTH_RATE_LIMIT_ACCOUNT = (5, 300)  # failed logins per account and address
+    AUTH_RATE_LIMIT_MAX_KEYS = 100000
+
+    # Per-process cache of user rows for authenticated requests (0 disables)
+    USER_CACHE_TTL = 60
+    USER_CACHE_MAX_ENTRIES = 10000
+
+    # Prometheus metrics at /metrics; with a token the scraper sends `Authorization: Bearer <token>`
+    METRICS_ENABLED = True
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Sampling profiler. 'header': only requests with `X-Profile: <PROFILE_TOKEN>`,
+    # 'all': every request, keeping profiles of those slower than PROFILE_SLOW_MS.
+    # Collapsed stacks (.folded) go to PROFILE_DIR (default: instance/profiles).
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', 'off')
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', 500))
+    PROFILE_INTERVAL = 0.005  # seconds between samples
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+
 class DevelopmentConfig(Config):
     DEBUG = True
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
     
 class ProductionConfig(Config):
     DEBUG = False
+    DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '').lower() in ('1', 'true')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
+class BenchmarkConfig(ProductionConfig):
+    # Production settings for bench/ runs, minus the throttling that would
+    # turn a load test into a stream of 429s
+    DB_AUTO_MIGRATE = True
+    AUTH_RATE_LIMIT_IP = (10 ** 9, 1)
+    AUTH_RATE_LIMIT_ACCOUNT = (10 ** 9, 1)
 
 config_by_name = {
     'dev': DevelopmentConfig,
-    'prod': ProductionConfig
+    'prod': ProductionConfig,
+    'bench': BenchmarkConfig
 }
 
 def get_config():
@@ -0,0 +1,108 @@
+"""geohash, map clusters, search index and image store
+
+Revision ID: 8b7e4d2c5a30
+Revises: 3f1c2a9d0b11
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.geo import encode_geohash
+
+
+# revision identifiers, used by Alembic.
+revision = '8b7e4d2c5a30'
+down_revision = '3f1c2a9d0b11'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases made by db.create_all() at a commit between the geohash and the
+    # migrations work already have some of these; only add what is missing
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    post_columns = {column['name'] for column in inspector.get_columns('pet_posts')}
+    post_indexes = {index['name'] for index in inspector.get_indexes('pet_posts')}
+
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        if 'geohash' not in post_columns:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        if 'image_digest' not in post_columns:
+            batch_op.add_column(sa.Column('image_digest', sa.String(length=64), nullable=True))
+        if 'ix_pet_posts_geohash' not in post_indexes:
+            batch_op.create_index('ix_pet_posts_geohash', ['geohash', 'latitude', 'longitude'], unique=False)
+        if 'ix_pet_posts_image_digest' not in post_indexes:
+            batch_op.create_index('ix_pet_posts_image_digest', ['image_digest'], unique=False)
+
+    if 'map_clusters' not in tables:
+        op.create_table('map_clusters',
+        sa.Column('precision', sa.Integer(), nullable=False),
+        sa.Column('cell', sa.String(length=12), nullable=False),
+        sa.Column('pet_type', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('latitude_sum', sa.Float(), nullable=False),
+        sa.Column('longitude_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('precision', 'cell', 'pet_type', 'status')
+        )
+    if 'pet_post_terms' not in tables:
+        op.create_table('pet_post_terms',
+        sa.Column('term', sa.String(length=64), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('tf', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('term', 'post_id')
+        )
+        with op.batch_alter_table('pet_post_terms', schema=None) as batch_op:
+            batch_op.create_index('ix_pet_post_terms_post_id', ['post_id'], unique=False)
+
+    if 'pet_post_search_docs' not in tables:
+        op.create_table('pet_post_search_docs',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('length', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('post_id')
+        )
+    if 'image_blobs' not in tables:
+        op.create_table('image_blobs',
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('extension', sa.String(length=8), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('digest')
+        )
+        with op.batch_alter_table('image_blobs', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_image_blobs_last_used_at'), ['last_used_at'], unique=False)
+
+    # Existing posts get their geohash cell; clusters and the search index are
+    # seeded from pet_posts when the app starts
+    connection = op.get_bind()
+    pet_posts = sa.table('pet_posts', sa.column('id'), sa.column('latitude'), sa.column('longitude'), sa.column('geohash'))
+    rows = connection.execute(
+        sa.select(pet_posts.c.id, pet_posts.c.latitude, pet_posts.c.longitude)
+        .where(pet_posts.c.latitude.isnot(None), pet_posts.c.longitude.isnot(None))
+    ).all()
+    for post_id, latitude, longitude in rows:
+        connection.execute(
+            pet_posts.update().where(pet_posts.c.id == post_id).values(geohash=encode_geohash(latitude, longitude))
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('image_blobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_blobs_last_used_at'))
+
+    op.drop_table('image_blobs')
+    op.drop_table('pet_post_search_docs')
+    with op.batch_alter_table('pet_post_terms', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_post_terms_post_id')
+
+    op.drop_table('pet_post_terms')
+    op.drop_table('map_clusters')
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_posts_image_digest')
+        batch_op.drop_index('ix_pet_posts_geohash')
+        batch_op.drop_column('image_digest')
+        batch_op.drop_column('geohash')
@@ -0,0 +1,36 @@
+"""composite indexes for the pet post listing queries
+
+Revision ID: c4d9e1f7a2b6
+Revises: 8b7e4d2c5a30
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d9e1f7a2b6'
+down_revision = '8b7e4d2c5a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Each matches a get_pet_posts/get_user_pet_posts filter combination and
+    # ends in (created_at, id) so the keyset ORDER BY is read off the index
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_posts_created_at', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_posts_status_created_at', ['status', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_posts_pet_type_created_at', ['pet_type', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_posts_status_pet_type_created_at', ['status', 'pet_type', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_pet_posts_user_id_created_at', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_posts_user_id_created_at')
+        batch_op.drop_index('ix_pet_posts_status_pet_type_created_at')
+        batch_op.drop_index('ix_pet_posts_pet_type_created_at')
+        batch_op.drop_index('ix_pet_posts_status_created_at')
+        batch_op.drop_index('ix_pet_posts_created_at')
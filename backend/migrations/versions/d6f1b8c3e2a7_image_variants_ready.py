@@ -0,0 +1,33 @@
+"""track whether image variants exist
+
+Revision ID: d6f1b8c3e2a7
+Revises: a9d4e6b2c8f1
+Create Date: 2026-10-18 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f1b8c3e2a7'
+down_revision = 'a9d4e6b2c8f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing images start as not ready; `flask pets build-image-variants` marks them
+    with op.batch_alter_table('image_blobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('variants_ready', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_variants_ready', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.drop_column('image_variants_ready')
+
+    with op.batch_alter_table('image_blobs', schema=None) as batch_op:
+        batch_op.drop_column('variants_ready')
@@ -0,0 +1,46 @@
+"""lost/found matches and the candidate index
+
+Revision ID: e7b3a1c9d5f2
+Revises: 5a2e8c7d1f43
+Create Date: 2026-10-18 11:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3a1c9d5f2'
+down_revision = '5a2e8c7d1f43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pet_post_matches',
+    sa.Column('missing_id', sa.Integer(), nullable=False),
+    sa.Column('found_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('distance_km', sa.Float(), nullable=True),
+    sa.Column('days_apart', sa.Float(), nullable=False),
+    sa.Column('text_score', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('missing_id', 'found_id')
+    )
+    with op.batch_alter_table('pet_post_matches', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_post_matches_found_id', ['found_id', 'score'], unique=False)
+
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.create_index('ix_pet_posts_match_candidates', ['pet_type', 'status', 'geohash'], unique=False)
+
+    # Existing posts are matched by `flask pets rebuild-matches`
+
+
+def downgrade():
+    with op.batch_alter_table('pet_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_posts_match_candidates')
+
+    with op.batch_alter_table('pet_post_matches', schema=None) as batch_op:
+        batch_op.drop_index('ix_pet_post_matches_found_id')
+
+    op.drop_table('pet_post_matches')
@@ -0,0 +1,49 @@
+"""perceptual image hashes for similar-image search
+
+Revision ID: f3c8d2a6b419
+Revises: e7b3a1c9d5f2
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d2a6b419'
+down_revision = 'e7b3a1c9d5f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_hashes',
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('phash', sa.BigInteger(), nullable=False),
+    sa.Column('dhash', sa.BigInteger(), nullable=False),
+    sa.Column('phash_0', sa.Integer(), nullable=False),
+    sa.Column('phash_1', sa.Integer(), nullable=False),
+    sa.Column('phash_2', sa.Integer(), nullable=False),
+    sa.Column('phash_3', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('digest')
+    )
+    with op.batch_alter_table('image_hashes', schema=None) as batch_op:
+        batch_op.create_index('ix_image_hashes_phash_0', ['phash_0', 'phash'], unique=False)
+        batch_op.create_index('ix_image_hashes_phash_1', ['phash_1', 'phash'], unique=False)
+        batch_op.create_index('ix_image_hashes_phash_2', ['phash_2', 'phash'], unique=False)
+        batch_op.create_index('ix_image_hashes_phash_3', ['phash_3', 'phash'], unique=False)
+        batch_op.create_index('ix_image_hashes_phash', ['phash'], unique=False)
+
+    # Existing images are hashed by `flask pets backfill-image-hashes`
+
+
+def downgrade():
+    with op.batch_alter_table('image_hashes', schema=None) as batch_op:
+        batch_op.drop_index('ix_image_hashes_phash')
+        batch_op.drop_index('ix_image_hashes_phash_3')
+        batch_op.drop_index('ix_image_hashes_phash_2')
+        batch_op.drop_index('ix_image_hashes_phash_1')
+        batch_op.drop_index('ix_image_hashes_phash_0')
+
+    op.drop_table('image_hashes')